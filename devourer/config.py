@@ -35,6 +35,9 @@ CUSTOMERS = {
 
 BITWERX_TIMEOUT = 5 * 60
 
+# Background imports of a customer data source running at once
+IMPORT_JOBS_CONCURRENCY = env.int('IMPORT_JOBS_CONCURRENCY', default=1)
+
 SENTRY_DSN = env.str('SENTRY_DSN')
 
 CELERY = {
@@ -3,6 +3,7 @@ import queue
 import threading
 import os
 import logging
+import typing
 from google.cloud import pubsub_v1
 
 from devourer import config
@@ -13,6 +14,8 @@ logger = logging.getLogger('devourer.publisher')
 
 
 class DataPublisher:
+    # bulk messages go in requests of up to 1000 messages, Pub/Sub limit is 10MB
+    BULK_BATCH_SETTINGS = {'max_messages': 1000, 'max_bytes': 9 * 1024 * 1024, 'max_latency': 0.05}
 
     def __init__(self, workers_count: int = None):
         self.futures = queue.Queue()
@@ -21,6 +24,7 @@ class DataPublisher:
         self.client = pubsub_v1.PublisherClient(
             batch_settings=pubsub_v1.types.BatchSettings(max_messages=100)
         )
+        self.bulk_client = None
         self.topic_path = self.client.topic_path(
             config.GCP_PROJECT_ID,
             config.GCP_PUBSUB_PUBLIC_TOPIC
@@ -42,11 +46,33 @@ class DataPublisher:
         """Send json serialized message to GCP Pub/Sub and put sending future
         to the queue for checking
         """
-        msg = json.dumps(data, cls=json_helpers.JSONEncoder)
+        self.publish_message(self.serialize(data))
 
-        future = self.client.publish(self.topic_path, data=msg.encode('utf-8'))
+    def publish_message(self, msg: bytes):
+        """Send already serialized message, see `serialize`"""
+        future = self.client.publish(self.topic_path, data=msg)
         self.futures.put(future)
 
+    def publish_messages(self, msgs: typing.Iterable[bytes], bulk: bool = False):
+        """Send already serialized messages, bulk ones go through the client
+        with larger batches, so large imports make fewer publish requests
+        """
+        client = self.get_bulk_client() if bulk else self.client
+        for msg in msgs:
+            self.futures.put(client.publish(self.topic_path, data=msg))
+
+    def get_bulk_client(self) -> pubsub_v1.PublisherClient:
+        if self.bulk_client is None:
+            self.bulk_client = pubsub_v1.PublisherClient(
+                batch_settings=pubsub_v1.types.BatchSettings(**self.BULK_BATCH_SETTINGS)
+            )
+
+        return self.bulk_client
+
+    @staticmethod
+    def serialize(data: dict) -> bytes:
+        return json.dumps(data, cls=json_helpers.JSONEncoder).encode('utf-8')
+
     def exit(self):
         """Send exit signal to thread workers"""
         self.exit_event.set()
@@ -4,6 +4,8 @@ import os
 import typing
 from aiohttp import web
 
+from devourer.core import jobs
+
 
 class DataSourceSetupAbstract(abc.ABC):
 
@@ -25,3 +27,25 @@ class DataSourceSetupAbstract(abc.ABC):
             os.path.join(self.url_prefix, path),
             functools.partial(view, customer_name=customer_name)
         )
+
+    def to_job_route_views(
+        self,
+        path: str,
+        run: typing.Callable[..., typing.Awaitable],
+        customer_name: str
+    ) -> typing.List[web.RouteDef]:
+        """Import route which runs `run(app, job, customer_name=...)` as a background
+        job and responds 202, status of the job is served at `jobs/{job_id}`
+        """
+        source = os.path.basename(self.url_prefix)
+
+        return [
+            web.view(
+                os.path.join(self.url_prefix, path),
+                functools.partial(jobs.submit_view, customer_name=customer_name, source=source, run=run)
+            ),
+            web.get(
+                os.path.join(self.url_prefix, path, 'jobs/{job_id}'),
+                functools.partial(jobs.status_view, customer_name=customer_name, source=source)
+            ),
+        ]
@@ -0,0 +1,175 @@
+import asyncio
+import collections
+import logging
+import time
+import typing
+import uuid
+from aiohttp import web
+
+
+logger = logging.getLogger('devourer.jobs')
+
+
+class Job:
+    """Background import of a customer data source, `fetched` and `published`
+    counters are updated by the import, stats of the publish pipeline stages
+    take precedence over them when the import runs one
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, customer: str, source: str):
+        self.id = uuid.uuid4().hex
+        self.customer = customer
+        self.source = source
+        self.status = self.QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.fetched = 0
+        self.published = 0
+        self.stages = {}
+        self.result = None
+        self.error = None
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in (self.QUEUED, self.RUNNING)
+
+    def start(self):
+        self.status = self.RUNNING
+        self.started = time.time()
+
+    def finish(self, status: str, error: str = None):
+        self.status = status
+        self.error = error
+        self.finished = time.time()
+
+    def get_elapsed(self) -> typing.Optional[float]:
+        if self.started is None:
+            return None
+
+        return (self.finished or time.time()) - self.started
+
+    def get_progress(self) -> typing.Tuple[int, int]:
+        """(fetched, published) items"""
+        if 'fetch' in self.stages and 'publish' in self.stages:
+            return (self.stages['fetch'].items, self.stages['publish'].items)
+
+        return (self.fetched, self.published)
+
+    def to_dict(self) -> dict:
+        fetched, published = self.get_progress()
+        elapsed = self.get_elapsed()
+
+        return {
+            'id': self.id,
+            'customer': self.customer,
+            'source': self.source,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'elapsed': None if elapsed is None else round(elapsed, 3),
+            'fetched': fetched,
+            'published': published,
+            'stages': {name: stats.to_dict() for name, stats in self.stages.items()},
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class JobManager:
+    """Runs import jobs in the background, at most `concurrency` jobs of a
+    customer data source at once, so imports don't read the same checkpoints
+    concurrently. A trigger while a job of the source is still queued returns
+    that job, overlapping triggers collapse into a single run. HISTORY_SIZE
+    finished jobs are kept for status requests.
+    """
+    CONCURRENCY = 1
+    HISTORY_SIZE = 100
+
+    def __init__(self, concurrency: int = None):
+        self.concurrency = concurrency or self.CONCURRENCY
+        self.jobs = collections.OrderedDict()
+        self.tasks = {}
+        self.semaphores = {}
+
+    def submit(self, customer: str, source: str, run: typing.Callable[[Job], typing.Awaitable]) -> Job:
+        for job in self.jobs.values():
+            if (job.customer, job.source, job.status) == (customer, source, Job.QUEUED):
+                logger.info('%s: %s import is already queued as %s', customer, source, job.id)
+                return job
+
+        job = Job(customer, source)
+        self.jobs[job.id] = job
+        self.tasks[job.id] = asyncio.ensure_future(self._run(job, run))
+        self._trim()
+
+        return job
+
+    def get(self, job_id: str) -> typing.Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def wait(self, job_id: str):
+        task = self.tasks.get(job_id)
+        if task is not None:
+            await asyncio.wait([task])
+
+    async def close(self):
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: Job, run: typing.Callable[[Job], typing.Awaitable]):
+        semaphore = self.semaphores.setdefault((job.customer, job.source), asyncio.Semaphore(self.concurrency))
+        try:
+            async with semaphore:
+                job.start()
+                logger.info('%s: %s import %s started', job.customer, job.source, job.id)
+                job.result = await run(job)
+        except asyncio.CancelledError:
+            job.finish(Job.CANCELLED)
+            raise
+        except Exception as ex:
+            logger.exception('%s: %s import %s failed', job.customer, job.source, job.id)
+            job.finish(Job.FAILED, str(ex))
+        else:
+            job.finish(Job.DONE)
+            logger.info('%s: %s import %s done in %.1f sec', job.customer, job.source, job.id, job.get_elapsed())
+        finally:
+            self.tasks.pop(job.id, None)
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.is_active]
+        for job_id in finished[:max(len(finished) - self.HISTORY_SIZE, 0)]:
+            del self.jobs[job_id]
+
+
+async def submit_view(
+    request: web.Request,
+    customer_name: str,
+    source: str,
+    run: typing.Callable[..., typing.Awaitable]
+) -> web.Response:
+    """Enqueue the import job and respond 202 with the job and its status URL"""
+    job = request.app['jobs'].submit(
+        customer_name,
+        source,
+        lambda job: run(request.app, job, customer_name=customer_name)
+    )
+    location = f"{request.path.rstrip('/')}/jobs/{job.id}"
+
+    return web.json_response(job.to_dict(), status=202, headers={'Location': location})
+
+
+async def status_view(request: web.Request, customer_name: str, source: str) -> web.Response:
+    job = request.app['jobs'].get(request.match_info['job_id'])
+    if job is None or (job.customer, job.source) != (customer_name, source):
+        raise web.HTTPNotFound()
+
+    return web.json_response(job.to_dict())
@@ -0,0 +1,35 @@
+import json
+import typing
+import aioredis
+
+
+class RunLedger:
+    """Entries of the import runs of a customer data source in a capped Redis
+    stream, about MAX_LEN newest entries are kept. Values are stored as JSON
+    """
+    MAX_LEN = 10000
+
+    def __init__(self, redis: aioredis.ConnectionsPool, customer: str, source: str):
+        self.redis = redis
+        self.customer = customer
+        self.source = source
+
+    async def append(self, entry: dict):
+        fields = {name: json.dumps(value, default=str) for name, value in entry.items()}
+        await self.redis.xadd(self.get_storage_key(), fields, max_len=self.MAX_LEN)
+
+    async def get_history(self, count: int = 100, table: str = None) -> typing.List[dict]:
+        """Newest entries first, `table` filters the `count` newest entries"""
+        entries = []
+        for entry_id, fields in await self.redis.xrevrange(self.get_storage_key(), count=count):
+            entry = {name.decode(): json.loads(value) for name, value in fields.items()}
+            if table is None or entry.get('table') == table:
+                entries.append(dict(entry, id=entry_id.decode()))
+
+        return entries
+
+    def get_storage_key(self) -> str:
+        return 'devourer.ledger.{}-{}'.format(
+            self.source,
+            self.customer
+        )
@@ -0,0 +1,180 @@
+import asyncio
+import concurrent.futures
+import logging
+import time
+import typing
+
+from .data_publish import DataPublisher
+
+
+logger = logging.getLogger('devourer.pipeline')
+
+_DONE = object()
+
+
+class StageStats:
+    """Throughput of a pipeline stage, `busy` is the time spent on the work
+    and `blocked` is the time spent waiting for room in the next stage queue
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+
+    def get_rate(self) -> float:
+        return self.items / self.busy if self.busy else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'items': self.items,
+            'bytes': self.bytes,
+            'busy': round(self.busy, 3),
+            'blocked': round(self.blocked, 3),
+            'rate': round(self.get_rate(), 1),
+        }
+
+    def __str__(self) -> str:
+        return (
+            f'{self.name}: {self.items} items, {self.get_rate():.0f} items/s, '
+            f'{self.busy:.1f}s busy, {self.blocked:.1f}s blocked'
+        )
+
+
+class PublishPipeline:
+    """Fetch, serialize and publish stages of the batches. Batches are serialized
+    by a single worker thread, it overlaps encoding with the reads the event loop
+    runs for the source meanwhile, more threads wouldn't help as the encoder holds
+    the GIL. The stage with the most busy time and the least blocked time is the
+    bottleneck.
+
+    The next batch is requested once the previous one is published, sources save
+    their state, like checkpoints, when they're resumed, so the state of a batch
+    isn't saved before it's published and a single batch is held at once. A failed
+    or cancelled run closes the source before it returns.
+
+    `get_group` keys the batches, publish stats of each key are kept in `groups`.
+    Batches of BULK_SIZE messages and more, like snapshot pages of the first
+    imports, go through the bulk publish path.
+    """
+    REPORT_INTERVAL = 60
+    BULK_SIZE = 1000
+
+    def __init__(
+        self,
+        publisher: DataPublisher,
+        get_group: typing.Callable[[typing.List[dict]], typing.Hashable] = None
+    ):
+        self.publisher = publisher
+        self.get_group = get_group
+        self.stats = {name: StageStats(name) for name in ('fetch', 'serialize', 'publish')}
+        self.groups = {}
+
+    async def run(self, batches: typing.AsyncIterator[typing.List[dict]]) -> typing.Dict[str, StageStats]:
+        """Publish messages of the batches, returns stats of the stages"""
+        serialize_queue = asyncio.Queue(maxsize=1)
+        publish_queue = asyncio.Queue(maxsize=1)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            tasks = [
+                asyncio.ensure_future(self.fetch(batches, serialize_queue)),
+                asyncio.ensure_future(self.serialize(serialize_queue, publish_queue, executor)),
+                asyncio.ensure_future(self.publish(publish_queue)),
+            ]
+            reporter = asyncio.ensure_future(self.report())
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks + [reporter]:
+                    task.cancel()
+                await asyncio.gather(*tasks, reporter, return_exceptions=True)
+
+        for stats in self.stats.values():
+            logger.info('pipeline %s', stats)
+
+        return self.stats
+
+    async def fetch(self, batches: typing.AsyncIterator[typing.List[dict]], queue: asyncio.Queue):
+        stats = self.stats['fetch']
+        published = None
+        try:
+            while True:
+                if published is not None:
+                    started = time.monotonic()
+                    await published.wait()
+                    stats.blocked += time.monotonic() - started
+
+                started = time.monotonic()
+                try:
+                    batch = await batches.__anext__()
+                except StopAsyncIteration:
+                    break
+
+                stats.busy += time.monotonic() - started
+                stats.items += len(batch)
+                published = asyncio.Event()
+                await self._put(queue, (batch, published), stats)
+        finally:
+            # the source suspended on a batch which isn't published is closed without saving its state
+            if hasattr(batches, 'aclose'):
+                await batches.aclose()
+
+        await queue.put(_DONE)
+
+    async def serialize(
+        self,
+        queue: asyncio.Queue,
+        publish_queue: asyncio.Queue,
+        executor: concurrent.futures.Executor
+    ):
+        stats = self.stats['serialize']
+        loop = asyncio.get_event_loop()
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+
+            batch, published = item
+            group = self.get_group(batch) if self.get_group is not None else None
+            started = time.monotonic()
+            messages = await loop.run_in_executor(executor, self.serialize_batch, batch)
+            stats.busy += time.monotonic() - started
+            stats.items += len(messages)
+            await self._put(publish_queue, (group, messages, published), stats)
+
+        await publish_queue.put(_DONE)
+
+    async def publish(self, queue: asyncio.Queue):
+        stats = self.stats['publish']
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+
+            group, messages, published = item
+            started = time.monotonic()
+            self.publisher.publish_messages(messages, bulk=len(messages) >= self.BULK_SIZE)
+            published.set()
+            elapsed = time.monotonic() - started
+            size = sum(map(len, messages))
+            for group_stats in (stats, self.groups.setdefault(group, StageStats(str(group)))):
+                group_stats.busy += elapsed
+                group_stats.items += len(messages)
+                group_stats.bytes += size
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.REPORT_INTERVAL)
+            for stats in self.stats.values():
+                logger.info('pipeline %s', stats)
+
+    def serialize_batch(self, batch: typing.List[dict]) -> typing.List[bytes]:
+        return [self.publisher.serialize(data) for data in batch]
+
+    @staticmethod
+    async def _put(queue: asyncio.Queue, item: typing.Any, stats: StageStats):
+        started = time.monotonic()
+        await queue.put(item)
+        stats.blocked += time.monotonic() - started
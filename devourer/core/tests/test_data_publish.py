@@ -48,3 +48,28 @@ def test_datapublisher(monkeypatch):
         ('topic_path', TEST_GCP_PROJECT_ID, TEST_GCP_PUBSUB_PUBLIC_TOPIC),
         ('publish', f'{TEST_GCP_PROJECT_ID}/{TEST_GCP_PUBSUB_PUBLIC_TOPIC}', b'{"msg": "Hello"}'),
     ]
+
+
+def test_publish_messages_bulk(monkeypatch):
+    log = []
+
+    class FakePublisherClient:
+
+        def __init__(self, batch_settings):
+            self.max_messages = batch_settings.max_messages
+
+        def topic_path(self, project_id, topic_name):
+            return f'{project_id}/{topic_name}'
+
+        def publish(self, topic, data):
+            log.append((self.max_messages, data))
+
+    monkeypatch.setattr(pubsub_v1, 'PublisherClient', FakePublisherClient)
+
+    publisher = data_publish.DataPublisher(workers_count=0)
+    publisher.publish_messages([b'1', b'2'])
+    publisher.publish_messages([b'3'], bulk=True)
+    publisher.publish_messages([b'4'], bulk=True)
+
+    assert log == [(100, b'1'), (100, b'2'), (1000, b'3'), (1000, b'4')]
+    assert publisher.futures.qsize() == 4
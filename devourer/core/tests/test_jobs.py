@@ -0,0 +1,141 @@
+import asyncio
+from aiohttp import web
+
+from devourer.core import jobs
+
+
+async def test_submit_deduplicates_queued():
+    log = []
+    release = asyncio.Event()
+
+    async def run(job):
+        log.append(('start', job.id))
+        await release.wait()
+        return job.id
+
+    manager = jobs.JobManager()
+    running = manager.submit('customer', 'vetsuccess', run)
+    await asyncio.sleep(0)
+    queued = manager.submit('customer', 'vetsuccess', run)
+
+    assert manager.submit('customer', 'vetsuccess', run) is queued
+    assert manager.submit('customer', 'bitwerx', run) is not queued
+    assert (running.status, queued.status) == (jobs.Job.RUNNING, jobs.Job.QUEUED)
+
+    release.set()
+    await manager.wait(queued.id)
+
+    assert (running.status, queued.status) == (jobs.Job.DONE, jobs.Job.DONE)
+    assert queued.result == queued.id
+    assert [entry for entry in log if entry[1] in (running.id, queued.id)] == [
+        ('start', running.id),
+        ('start', queued.id),
+    ]
+
+
+async def test_concurrency():
+    active = []
+    peak = []
+
+    async def run(job):
+        active.append(job.id)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        active.remove(job.id)
+
+    manager = jobs.JobManager(concurrency=2)
+    submitted = [manager.submit(f'customer-{i % 2}', 'vetsuccess', run) for i in range(2)]
+    await asyncio.sleep(0)
+    submitted += [manager.submit(f'customer-{i % 2}', 'vetsuccess', run) for i in range(2)]
+    for job in submitted:
+        await manager.wait(job.id)
+
+    assert max(peak) == 4
+    assert all(job.status == jobs.Job.DONE for job in submitted)
+
+    peak.clear()
+    manager = jobs.JobManager(concurrency=1)
+    submitted = [manager.submit('customer', 'vetsuccess', run)]
+    await asyncio.sleep(0)
+    submitted.append(manager.submit('customer', 'vetsuccess', run))
+    for job in submitted:
+        await manager.wait(job.id)
+
+    assert peak == [1, 1]
+
+
+async def test_failed():
+    async def run(job):
+        job.fetched = 5
+        raise ValueError('broken')
+
+    manager = jobs.JobManager()
+    job = manager.submit('customer', 'vetsuccess', run)
+    await manager.wait(job.id)
+
+    assert job.status == jobs.Job.FAILED
+    assert job.to_dict()['error'] == 'broken'
+    assert job.to_dict()['fetched'] == 5
+    assert manager.tasks == {}
+
+
+async def test_close_cancels():
+    async def run(job):
+        await asyncio.sleep(10)
+
+    manager = jobs.JobManager()
+    job = manager.submit('customer', 'vetsuccess', run)
+    await asyncio.sleep(0)
+    await manager.close()
+
+    assert job.status == jobs.Job.CANCELLED
+
+
+async def test_history_size(monkeypatch):
+    async def run(job):
+        ...
+
+    monkeypatch.setattr(jobs.JobManager, 'HISTORY_SIZE', 2)
+    manager = jobs.JobManager()
+    submitted = []
+    for _ in range(4):
+        submitted.append(manager.submit('customer', 'vetsuccess', run))
+        await manager.wait(submitted[-1].id)
+    manager.submit('customer', 'vetsuccess', run)
+
+    assert list(manager.jobs)[:2] == [job.id for job in submitted[2:]]
+    assert len(manager.jobs) == 3
+
+
+async def test_views(aiohttp_client):
+    async def run(app, job, customer_name=None):
+        job.published = 1
+        return customer_name
+
+    app = web.Application()
+    app['jobs'] = jobs.JobManager()
+    app.router.add_get('/import/{customer}/', lambda request: jobs.submit_view(
+        request, request.match_info['customer'], 'vetsuccess', run
+    ))
+    app.router.add_get('/import/{customer}/jobs/{job_id}', lambda request: jobs.status_view(
+        request, request.match_info['customer'], 'vetsuccess'
+    ))
+    client = await aiohttp_client(app)
+
+    resp = await client.get('/import/customer/')
+    assert resp.status == 202
+    job_id = (await resp.json())['id']
+    await app['jobs'].wait(job_id)
+
+    resp = await client.get(resp.headers['Location'])
+    assert resp.status == 200
+    assert {key: value for key, value in (await resp.json()).items() if key in ('status', 'published', 'result')} == {
+        'status': 'done',
+        'published': 1,
+        'result': 'customer',
+    }
+
+    resp = await client.get(f'/import/other/jobs/{job_id}')
+    assert resp.status == 404
+    resp = await client.get('/import/customer/jobs/missing')
+    assert resp.status == 404
@@ -0,0 +1,42 @@
+import collections
+from datetime import datetime
+
+from devourer.core import ledger
+
+
+async def test_append_and_history():
+    redis = FakeRedis()
+    run_ledger = ledger.RunLedger(redis, 'customer', 'vetsuccess')
+
+    await run_ledger.append({'table': 'clients', 'changed': 5, 'checkpoint_after': [datetime(2020, 1, 1), 7]})
+    await run_ledger.append({'table': 'phones', 'changed': 0, 'checkpoint_after': None})
+    await run_ledger.append({'table': 'clients', 'changed': 1, 'checkpoint_after': None})
+
+    assert redis.log == [('xadd', 'devourer.ledger.vetsuccess-customer', ledger.RunLedger.MAX_LEN)] * 3
+    assert await run_ledger.get_history() == [
+        {'id': '3-0', 'table': 'clients', 'changed': 1, 'checkpoint_after': None},
+        {'id': '2-0', 'table': 'phones', 'changed': 0, 'checkpoint_after': None},
+        {'id': '1-0', 'table': 'clients', 'changed': 5, 'checkpoint_after': ['2020-01-01 00:00:00', 7]},
+    ]
+    assert [entry['id'] for entry in await run_ledger.get_history(2, 'clients')] == ['3-0']
+
+
+class FakeRedis:
+
+    def __init__(self):
+        self.log = []
+        self.streams = collections.defaultdict(list)
+
+    async def xadd(self, stream, fields, message_id=b'*', max_len=None, exact_len=False):
+        self.log.append(('xadd', stream, max_len))
+        entries = self.streams[stream]
+        entry_id = f'{len(entries) + 1}-0'.encode()
+        entries.append((entry_id, collections.OrderedDict(
+            (name.encode(), value.encode()) for name, value in fields.items()
+        )))
+        del entries[:-max_len]
+
+        return entry_id
+
+    async def xrevrange(self, stream, start='+', stop='-', count=None):
+        return list(reversed(self.streams[stream]))[:count]
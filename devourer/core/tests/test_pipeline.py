@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import pytest
+
+from devourer.core import pipeline
+
+
+class FakePublisher:
+
+    def __init__(self):
+        self.messages = []
+        self.bulk = []
+
+    def publish_messages(self, msgs, bulk=False):
+        self.messages.extend(msgs)
+        self.bulk.append(bulk)
+
+    @staticmethod
+    def serialize(data):
+        return str(data['id']).encode('utf-8')
+
+
+async def batches(log, count=5):
+    for i in range(count):
+        log.append(('fetch', i))
+        yield [{'id': i * 10 + j} for j in range(3)]
+
+
+async def test_run():
+    log = []
+    publisher = FakePublisher()
+
+    stats = await pipeline.PublishPipeline(publisher).run(batches(log))
+
+    assert publisher.messages == [str(i * 10 + j).encode('utf-8') for i in range(5) for j in range(3)]
+    assert {name: stage.items for name, stage in stats.items()} == {'fetch': 15, 'serialize': 15, 'publish': 15}
+
+
+async def saved_batches(log, count=5):
+    try:
+        for i in range(count):
+            log.append(('fetch', i))
+            yield [{'id': i}]
+            log.append(('saved', i))
+    finally:
+        log.append('closed')
+
+
+class LoggedPublisher(FakePublisher):
+
+    def __init__(self, log, fail_at=None):
+        super().__init__()
+        self.log = log
+        self.fail_at = fail_at
+
+    def publish_messages(self, msgs, bulk=False):
+        if msgs == [str(self.fail_at).encode('utf-8')]:
+            raise ValueError('publish failed')
+        super().publish_messages(msgs, bulk)
+        self.log.append(('publish', int(msgs[0])))
+
+
+async def test_run_published_before_saved():
+    log = []
+
+    await pipeline.PublishPipeline(LoggedPublisher(log)).run(saved_batches(log, 2))
+
+    # the source saves the state of a batch once it's published
+    assert log == [('fetch', 0), ('publish', 0), ('saved', 0), ('fetch', 1), ('publish', 1), ('saved', 1), 'closed']
+
+
+async def test_run_publish_failed():
+    log = []
+
+    with pytest.raises(ValueError):
+        await pipeline.PublishPipeline(LoggedPublisher(log, fail_at=2)).run(saved_batches(log, 8))
+
+    # the source is closed before the run fails, states of unpublished batches aren't saved
+    assert log[-3:] == [('saved', 1), ('fetch', 2), 'closed']
+
+
+async def test_run_cancelled():
+    log = []
+    released = threading.Event()
+
+    class BlockedPublisher(LoggedPublisher):
+
+        @staticmethod
+        def serialize(data):
+            released.wait(5)
+            return FakePublisher.serialize(data)
+
+    task = asyncio.ensure_future(pipeline.PublishPipeline(BlockedPublisher(log)).run(saved_batches(log)))
+    await asyncio.sleep(0.1)
+    task.cancel()
+    released.set()
+
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert log == [('fetch', 0), 'closed']
+
+
+async def test_run_error():
+    publisher = FakePublisher()
+
+    async def failing():
+        yield [{'id': 1}]
+        raise ValueError('fetch failed')
+
+    with pytest.raises(ValueError):
+        await pipeline.PublishPipeline(publisher).run(failing())
+
+
+def test_stage_stats():
+    stats = pipeline.StageStats('fetch')
+    stats.items = 100
+    stats.busy = 2.0
+    stats.blocked = 0.5
+
+    assert stats.get_rate() == 50
+    assert stats.to_dict() == {'items': 100, 'bytes': 0, 'busy': 2.0, 'blocked': 0.5, 'rate': 50.0}
+    assert str(stats) == 'fetch: 100 items, 50 items/s, 2.0s busy, 0.5s blocked'
+
+
+async def test_run_groups():
+    log = []
+    publisher = FakePublisher()
+    publish_pipeline = pipeline.PublishPipeline(publisher, get_group=lambda batch: batch[0]['id'] // 10 % 2)
+
+    await publish_pipeline.run(batches(log, 3))
+
+    assert {group: (stats.items, stats.bytes) for group, stats in publish_pipeline.groups.items()} == {
+        0: (6, 9),
+        1: (3, 6),
+    }
+    assert publish_pipeline.stats['publish'].bytes == 15
+
+
+async def test_run_bulk(monkeypatch):
+    log = []
+    publisher = FakePublisher()
+    monkeypatch.setattr(pipeline.PublishPipeline, 'BULK_SIZE', 3)
+
+    async def sized_batches():
+        for size in (3, 2):
+            yield [{'id': i} for i in range(size)]
+
+    await pipeline.PublishPipeline(publisher).run(sized_batches())
+
+    assert publisher.bulk == [True, False]
+    assert log == []
@@ -6,7 +6,7 @@ import logging
 from aiohttp import web, ClientSession, BasicAuth
 
 from devourer import config
-from devourer.core import data_publish
+from devourer.core import data_publish, jobs
 from .validators import validate_line_item
 
 
@@ -67,8 +67,9 @@ async def set_last_updated_date(redis, practice_id, updated_date):
     await redis.set(get_redis_key(practice_id), updated_date.strftime(format_timestamp))
 
 
-async def import_run(request, customer_name: str = None) -> web.Response:
-    bw_config = request.app['secretmanager'].get_secret(customer_name)['bitwerx']
+async def import_run(app: web.Application, job: jobs.Job, customer_name: str = None) -> dict:
+    """Import line items of the practice, result status follows HTTP status codes"""
+    bw_config = app['secretmanager'].get_secret(customer_name)['bitwerx']
     username = bw_config['username']
     password = bw_config['password']
 
@@ -76,7 +77,7 @@ async def import_run(request, customer_name: str = None) -> web.Response:
 
     url = 'https://partner.daylight.vet/api/downloadRequest'
 
-    redis = request.app['redis_pool']
+    redis = app['redis_pool']
 
     payload = {
         'practiceId': practice_id,
@@ -89,12 +90,13 @@ async def import_run(request, customer_name: str = None) -> web.Response:
 
     response = await session.post(url=url, data=json.dumps(payload), auth=auth)
 
-    web_response = web.Response(status=200)
+    status = 200
     if response.status == 202:
         ok, response = await get_download_response_status(session, response, auth)
         if ok:
             if response.status == 200:
                 data = await get_data(session, response)
+                job.fetched = len(data)
 
                 publisher = data_publish.DataPublisher()
                 max_updated_date = datetime.datetime(1, 1, 1, 0, 0)
@@ -117,6 +119,7 @@ async def import_run(request, customer_name: str = None) -> web.Response:
                             'data': item,
                         }
                     )
+                    job.published += 1
 
                     updated_date = datetime.datetime.strptime(item['updated'][:-1], format_timestamp)
                     max_updated_date = max(max_updated_date, updated_date)
@@ -124,18 +127,18 @@ async def import_run(request, customer_name: str = None) -> web.Response:
                 if data_is_valid:
                     await set_last_updated_date(redis, practice_id, max_updated_date)
             else:
-                web_response = web.Response(status=404)
+                status = 404
         else:
-            web_response = web.Response(status=408)
+            status = 408
     else:
-        web_response = web.Response(status=400)
+        status = 400
 
     # publish
     await session.close()
 
     logger.info(
         f'{customer_name}: Bitwerx data source, practiceId - {payload["practiceId"]},'
-        f' status code - {web_response.status}'
+        f' status code - {status}'
     )
 
-    return web_response
+    return {'status': status}
@@ -11,6 +11,4 @@ class DataSourceSetup(setup.DataSourceSetupAbstract):
     def __call__(self, customer_name: str):
         logger.info(f'{customer_name}: Bitwerx data source initialization')
 
-        self.app.add_routes([
-            self.to_route_view('', api.import_run, customer_name),
-        ])
+        self.app.add_routes(self.to_job_route_views('', api.import_run, customer_name))
@@ -105,6 +105,16 @@ class TestImportRun:
         def __init__(self, status):
             self.status = status
 
+    @staticmethod
+    async def run_import(client):
+        resp = await client.get('/api/v1/import/test-customer/bitwerx/')
+        assert resp.status == 202
+
+        job_id = (await resp.json())['id']
+        await client.server.app['jobs'].wait(job_id)
+
+        return client.server.app['jobs'].get(job_id)
+
     @pytest.fixture
     async def bitwerx_client(self, monkeypatch, aiohttp_client):
 
@@ -135,12 +145,12 @@ class TestImportRun:
         # if status is not 202 then we get 400 anyway
 
         monkeypatch.setattr(ClientSession, 'post', CoroutineMock(return_value=self.FakeResponse(status=400)))
-        resp = await bitwerx_client.get('/api/v1/import/test-customer/bitwerx/')
-        assert resp.status == 400
+        job = await self.run_import(bitwerx_client)
+        assert job.result == {'status': 400}
 
         monkeypatch.setattr(ClientSession, 'post', CoroutineMock(return_value=self.FakeResponse(status=500)))
-        resp = await bitwerx_client.get('/api/v1/import/test-customer/bitwerx/')
-        assert resp.status == 400
+        job = await self.run_import(bitwerx_client)
+        assert job.result == {'status': 400}
 
     async def test_first_request_is_successful_and_get_download_response_status_not(self, bitwerx_client, monkeypatch):
         monkeypatch.setattr(ClientSession, 'post', CoroutineMock(return_value=self.FakeResponse(status=202)))
@@ -148,9 +158,9 @@ class TestImportRun:
         mock_download_response_status = CoroutineMock(return_value=(None, None))
         monkeypatch.setattr(api, 'get_download_response_status', mock_download_response_status)
 
-        resp = await bitwerx_client.get('/api/v1/import/test-customer/bitwerx/')
+        job = await self.run_import(bitwerx_client)
         mock_download_response_status.assert_awaited_once()
-        assert resp.status == 408
+        assert job.result == {'status': 408}
 
     async def test_first_request_is_successful_and_get_download_response_status_404(self, bitwerx_client, monkeypatch):
         monkeypatch.setattr(ClientSession, 'post', CoroutineMock(return_value=self.FakeResponse(status=202)))
@@ -158,9 +168,9 @@ class TestImportRun:
         mock_download_response_status = CoroutineMock(return_value=(True, self.FakeResponse(status=404)))
         monkeypatch.setattr(api, 'get_download_response_status', mock_download_response_status)
 
-        resp = await bitwerx_client.get('/api/v1/import/test-customer/bitwerx/')
+        job = await self.run_import(bitwerx_client)
         mock_download_response_status.assert_awaited_once()
-        assert resp.status == 404
+        assert job.result == {'status': 404}
 
     async def test_all_requests_are_successful(self, bitwerx_client, monkeypatch):
         monkeypatch.setattr(data_publish, 'DataPublisher', mock.Mock())
@@ -172,10 +182,10 @@ class TestImportRun:
         mock_get_data = CoroutineMock(return_value={})
         monkeypatch.setattr(api, 'get_data', mock_get_data)
 
-        resp = await bitwerx_client.get('/api/v1/import/test-customer/bitwerx/')
+        job = await self.run_import(bitwerx_client)
         mock_download_response_status.assert_awaited_once()
         mock_get_data.assert_awaited_once()
-        assert resp.status == 200
+        assert job.result == {'status': 200}
 
     async def test_update_last_updated_date(self, bitwerx_client, monkeypatch):
         mock_get_last_updated_date = CoroutineMock(return_value='0001-01-01T00:00:00.0000000Z')
@@ -186,7 +196,7 @@ class TestImportRun:
         monkeypatch.setattr(api, 'set_last_updated_date', mock_set_last_updated_date)
         monkeypatch.setattr(data_publish, 'DataPublisher', mock.Mock())
 
-        await bitwerx_client.get('/api/v1/import/test-customer/bitwerx/')
+        await self.run_import(bitwerx_client)
 
         mock_get_last_updated_date.assert_awaited_once()
         mock_set_last_updated_date.assert_not_awaited()
@@ -200,7 +210,7 @@ class TestImportRun:
         )
         monkeypatch.setattr(api, 'get_data', CoroutineMock(return_value={}))
 
-        await bitwerx_client.get('/api/v1/import/test-customer/bitwerx/')
+        await self.run_import(bitwerx_client)
 
         mock_get_last_updated_date.assert_awaited_once()
         mock_set_last_updated_date.assert_awaited_once()
@@ -236,14 +246,14 @@ class TestImportRun:
         monkeypatch.setattr(api, 'get_data', mock_get_data)
 
         monkeypatch.setattr(api, 'validate_line_item', mock.Mock(return_value=False))
-        resp = await bitwerx_client.get('/api/v1/import/test-customer/bitwerx/')
+        job = await self.run_import(bitwerx_client)
         mock_download_response_status.assert_awaited_once()
         mock_get_data.assert_awaited_once()
-        assert resp.status == 200
+        assert job.result == {'status': 200}
 
         monkeypatch.setattr(api, 'validate_line_item', mock.Mock(return_value=True))
-        resp = await bitwerx_client.get('/api/v1/import/test-customer/bitwerx/')
-        assert resp.status == 200
+        job = await self.run_import(bitwerx_client)
+        assert job.result == {'status': 200}
 
         assert log == [
             (
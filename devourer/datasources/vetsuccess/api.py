@@ -1,32 +1,122 @@
+import typing
 from aiohttp import web
 
-from devourer.core import data_publish
-from . import db
+from devourer.core import data_publish, jobs, ledger, pipeline
+from . import db, unload
 
 
-async def import_run(request, customer_name: str = None) -> web.Response:
+async def import_run(app: web.Application, job: jobs.Job, customer_name: str = None):
+    config = app['secretmanager'].get_secret(customer_name)['vetsuccess']
+
+    unloader = None
+    if config.get('unload'):
+        unloader = unload.Unloader.from_config(config['unload'])
+
+    publisher = data_publish.DataPublisher()
+    try:
+        publish_pipeline = pipeline.PublishPipeline(publisher, get_group=get_table_name)
+        job.stages = publish_pipeline.stats
+        conn = await db.connect(
+            config['redshift_dsn'],
+            app['redis_pool'],
+            unloader,
+            config.get('concurrency'),
+            app['redshift_pools'],
+            config.get('pool_size')
+        )
+        try:
+            await publish_pipeline.run(get_messages(conn, customer_name))
+        finally:
+            await conn.close()
+            await record_table_runs(app, job, customer_name, conn.table_runs, publish_pipeline.groups)
+    finally:
+        publisher.exit()
+        publisher.wait()
+
+
+async def record_table_runs(
+    app: web.Application,
+    job: jobs.Job,
+    customer_name: str,
+    table_runs: typing.List[dict],
+    groups: typing.Dict[str, pipeline.StageStats]
+):
+    """Ledger entries of the tables imported by the job, failed and cancelled ones included"""
+    run_ledger = ledger.RunLedger(app['redis_pool'], customer_name, 'vetsuccess')
+    for table_run in table_runs:
+        published = groups.get(table_run['table'], pipeline.StageStats(table_run['table']))
+        await run_ledger.append(dict(
+            table_run,
+            run=job.id,
+            bytes=published.bytes,
+            publish_time=round(published.busy, 3),
+        ))
+
+
+async def get_messages(conn: db.DB, customer_name: str) -> typing.AsyncGenerator[typing.List[dict], None]:
+    batches = conn.get_batches()
+    try:
+        async for table_name, batch in batches:
+            meta = {
+                'customer': customer_name,
+                'data_source': 'vetsuccess',
+                'table_name': table_name,
+            }
+            yield [{'meta': meta, 'data': record} for record in batch]
+    finally:
+        await batches.aclose()
+
+
+def get_table_name(batch: typing.List[dict]) -> str:
+    return batch[0]['meta']['table_name']
+
+
+async def import_history(request, customer_name: str = None) -> web.Response:
+    """Ledger entries of the recent table imports, newest first"""
+    try:
+        count = int(request.query.get('count', 100))
+    except ValueError:
+        raise web.HTTPBadRequest(text='count should be an integer')
+
+    run_ledger = ledger.RunLedger(request.app['redis_pool'], customer_name, 'vetsuccess')
+    history = await run_ledger.get_history(min(max(count, 1), run_ledger.MAX_LEN), request.query.get('table'))
+
+    return web.json_response(history)
+
+
+async def table_plan(request, customer_name: str = None) -> web.Response:
+    """Decisions the planner would make for the next import run by the stored
+    stats, `?fingerprint=1` takes the live fingerprints of the checksum tables
+    which aggregates each of them on Redshift
+    """
     config = request.app['secretmanager'].get_secret(customer_name)['vetsuccess']
 
     conn = await db.connect(
         config['redshift_dsn'],
-        request.app['redis_pool']
+        request.app['redis_pool'],
+        pools=request.app['redshift_pools'],
+        pool_size=config.get('pool_size')
     )
-    publisher = data_publish.DataPublisher()
+    try:
+        plan = await conn.plan_tables(request.query.get('fingerprint') in ('1', 'true'))
+    finally:
+        await conn.close()
 
-    async for table_name, record in conn.get_updates():
-        publisher.publish(
-            {
-                'meta': {
-                    'customer': customer_name,
-                    'data_source': 'vetsuccess',
-                    'table_name': table_name,
-                },
-                'data': record,
-            }
-        )
+    return web.json_response([decision.to_dict() for _, _, decision in plan])
 
-    await conn.close()
-    publisher.exit()
-    publisher.wait()
 
-    return web.Response(status=200)
+async def table_schema(request, customer_name: str = None) -> web.Response:
+    config = request.app['secretmanager'].get_secret(customer_name)['vetsuccess']
+
+    conn = await db.connect(
+        config['redshift_dsn'],
+        request.app['redis_pool'],
+        pools=request.app['redshift_pools'],
+        pool_size=config.get('pool_size')
+    )
+    try:
+        schema = await conn.get_schema()
+    finally:
+        await conn.close()
+
+    return web.json_response(schema)
@@ -0,0 +1,148 @@
+import itertools
+import operator
+import typing
+import numpy as np
+import psycopg2.extensions
+
+
+DIGEST_DTYPE = np.dtype('>u8')
+
+_SEED = np.uint64(0x9e3779b97f4a7c15)
+_NULL = np.uint64(0x6a09e667f3bcc908)
+_PRIME = np.uint64(0x100000001b3)
+_MIX_1 = np.uint64(0xbf58476d1ce4e5b9)
+_MIX_2 = np.uint64(0x94d049bb133111eb)
+# values of up to 2 ** _MIN_GROUP words are padded together
+_MIN_GROUP = 3
+
+INTEGER, FLOAT, BOOLEAN, TEMPORAL, TEXT = range(5)
+KINDS = (
+    (psycopg2.extensions.INTEGER, INTEGER),
+    (psycopg2.extensions.LONGINTEGER, INTEGER),
+    (psycopg2.extensions.FLOAT, FLOAT),
+    (psycopg2.extensions.BOOLEAN, BOOLEAN),
+    # timezone aware values go through the text form
+    (psycopg2.extensions.PYDATETIME, TEMPORAL),
+    (psycopg2.extensions.PYDATE, TEMPORAL),
+)
+
+
+def mix(values: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, uint64 arithmetic wraps around"""
+    values = values ^ (values >> np.uint64(30))
+    values = values * _MIX_1
+    values = values ^ (values >> np.uint64(27))
+    values = values * _MIX_2
+
+    return values ^ (values >> np.uint64(31))
+
+
+def get_kind(type_code: int) -> int:
+    for typ, kind in KINDS:
+        if type_code in typ.values:
+            return kind
+
+    return TEXT
+
+
+def get_columns(rows: typing.Sequence[tuple], size: int) -> typing.List[tuple]:
+    """Transpose the page rows into column tuples"""
+    if not rows:
+        return [()] * size
+
+    return list(zip(*rows))
+
+
+def hash_column(values: typing.Sequence, type_code: int) -> np.ndarray:
+    """uint64 hashes of the column values, Python objects are converted into
+    NumPy arrays by type of the column and hashed by whole column
+    """
+    has_nulls = None in values
+    if has_nulls:
+        nulls = np.fromiter(map(operator.is_, values, itertools.repeat(None)), bool, len(values))
+        values = [value for value in values if value is not None]
+
+    kind = get_kind(type_code)
+    if kind == INTEGER:
+        hashes = mix(np.array(values, dtype=np.int64).view(np.uint64))
+    elif kind == FLOAT:
+        hashes = mix(np.array(values, dtype=np.float64).view(np.uint64))
+    elif kind == BOOLEAN:
+        hashes = mix(np.array(values, dtype=bool).astype(np.uint64))
+    elif kind == TEMPORAL:
+        # binary pickle state of the naive date and datetime values
+        hashes = hash_bytes([value.__reduce__()[1][0] for value in values])
+    else:
+        hashes = hash_bytes(list(map(str.encode, map(str, values))))
+
+    if not has_nulls:
+        return hashes
+
+    result = np.full(len(nulls), _NULL, dtype=np.uint64)
+    result[~nulls] = hashes
+
+    return result
+
+
+def hash_bytes(values: typing.List[bytes]) -> np.ndarray:
+    """Hash the values by 8 byte words, length is mixed in first and a value
+    mixes its own words only, so its hash doesn't depend on the other values.
+    Values of up to 2 ** _MIN_GROUP words are hashed in a single zero padded
+    array, longer ones are padded by groups of up to twice their word count,
+    so a long value doesn't pad the others
+    """
+    lengths = np.fromiter(map(len, values), np.uint64, len(values))
+    hashes = lengths ^ _SEED
+    word_counts = (lengths + np.uint64(7)) // np.uint64(8)
+    if not len(values) or word_counts.max() <= 1 << _MIN_GROUP:
+        return mix(hash_words(hashes, values, word_counts))
+
+    groups = np.maximum(np.ceil(np.log2(np.maximum(word_counts, 1))), _MIN_GROUP).astype(int)
+    for group in np.unique(groups).tolist():
+        index = np.flatnonzero(groups == group)
+        hashes[index] = hash_words(hashes[index], [values[i] for i in index.tolist()], word_counts[index])
+
+    return mix(hashes)
+
+
+def hash_words(hashes: np.ndarray, values: typing.List[bytes], word_counts: np.ndarray) -> np.ndarray:
+    """Mix the 8 byte words of the values into their hashes, zero padding past
+    the last word of a value is skipped
+    """
+    width = int(word_counts.max()) if len(values) else 0
+    if not width:
+        return hashes
+
+    words = np.array(values, dtype=f'S{8 * width}').view(np.uint64).reshape(len(values), width)
+    uniform = bool((word_counts == width).all())
+    for i in range(width):
+        mixed = (hashes ^ words[:, i]) * _PRIME
+        mixed ^= mixed >> np.uint64(32)
+        hashes = mixed if uniform else np.where(word_counts > i, mixed, hashes)
+
+    return hashes
+
+
+def get_digests(rows: typing.Sequence[tuple], type_codes: typing.Sequence[int]) -> np.ndarray:
+    """64 bit digests of the rows computed column by column"""
+    digests = np.full(len(rows), _SEED, dtype=np.uint64)
+    for i, (values, type_code) in enumerate(zip(get_columns(rows, len(type_codes)), type_codes)):
+        digests = mix(digests ^ (hash_column(values, type_code) + np.uint64(i)))
+
+    return digests
+
+
+def pack_digests(digests: typing.Sequence[typing.Optional[bytes]]) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """(uint64 array, missing mask) of the stored digests"""
+    size = DIGEST_DTYPE.itemsize
+    missing = np.fromiter((digest is None or len(digest) != size for digest in digests), bool, len(digests))
+    data = b''.join(
+        bytes(size) if is_missing else digest
+        for digest, is_missing in zip(digests, missing)
+    )
+
+    return np.frombuffer(data, dtype=DIGEST_DTYPE).astype(np.uint64), missing
+
+
+def unpack_digest(digest: np.uint64) -> bytes:
+    return np.array(digest, dtype=DIGEST_DTYPE).tobytes()
@@ -1,60 +1,275 @@
+import abc
+import asyncio
+import collections
+import contextlib
+import functools
+import json
 import logging
+import re
 import time
 import typing
 import itertools
 import aiopg
 import aioredis
+import numpy as np
 from datetime import datetime, date
-from hashlib import sha1
 
-from . import tables
+from devourer.core.datasource import exceptions
+from devourer.utils import aio
+from . import columnar, encoding, planner, tables, unload
 
 
 logger = logging.getLogger('devourer.datasource.vetsuccess')
 
 
-class DB:
+class ImproperPoolSize(exceptions.DataSourceException):
+    message = 'Redshift pool should fit the connections of the concurrently imported tables'
+
 
-    def __init__(self, db: aiopg.Pool, redis: aioredis.ConnectionsPool):
+class DB:
+    CONCURRENCY = 4
+    # aiopg default
+    POOL_SIZE = 10
+    # a table import holds its fetch connection while it waits for the rows or enrichment one,
+    # a partitioned one holds a fetch connection of each partition
+    CONNECTIONS_PER_TABLE = 2
+    # statuses of the table runs
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    # batches, each one holds a whole page of the table
+    QUEUE_SIZE = 2
+
+    def __init__(
+        self,
+        db: aiopg.Pool,
+        redis: aioredis.ConnectionsPool,
+        unloader: unload.Unloader = None,
+        concurrency: int = None,
+        close_pool: bool = True,
+        table_planner: planner.Planner = None
+    ):
         self._db = db
         self._redis = redis
+        self._unloader = unloader
+        self._concurrency = concurrency or self.CONCURRENCY
+        self._close_pool = close_pool
+        self._planner = table_planner
+        # stats of the imported tables for the run ledger
+        self.table_runs = []
 
     async def get_updates(self) -> typing.AsyncGenerator[typing.Tuple[str, dict], None]:
+        async for table_name, batch in self.get_batches():
+            for record in batch:
+                yield (table_name, record)
+
+    async def get_batches(self) -> typing.AsyncGenerator[typing.Tuple[str, typing.List[encoding.Record]], None]:
         start = time.time()
         total_new_records = 0
-        for (table, additional_data_fetcher) in self.get_tables():
-            table_start = time.time()
-            fetcher_class = TimestampedTableFetcher
-            if table.timestamp_column is None:
-                fetcher_class = ChecksumTableFether
-
-            fetcher = fetcher_class(table, self._db, self._redis)
-
-            new_records = 0
-            async for record in fetcher.fetch():
-                new_records += 1
-                if additional_data_fetcher:
-                    record['_additionals'] = await additional_data_fetcher.fetch(record, table, self._db)
-                yield (table.name, record)
-                if new_records % 1000 == 0:
-                    logger.info('import progress: %d of %s', new_records, table.name)
-
-            total_new_records += new_records
-            working_time = time.time() - table_start
-            logger.info(f'import {table.name} for {working_time} sec, {new_records} new records')
+        tables_to_import = []
+        for table, additional_data_fetcher, decision in await self.plan_tables():
+            if decision is not None:
+                logger.info('plan: %s', decision)
+                if not decision.run:
+                    await self._planner.record_skip(decision)
+                    continue
+            tables_to_import.append((table, additional_data_fetcher, decision))
+
+        imports = (
+            self.import_table(table, additional_data_fetcher, decision)
+            for table, additional_data_fetcher, decision in tables_to_import
+        )
+        batches = aio.merge(imports, self._concurrency, self.QUEUE_SIZE)
+        try:
+            async for table_name, batch in batches:
+                total_new_records += len(batch)
+                yield (table_name, batch)
+        finally:
+            # imports are stopped and recorded before a closed run returns
+            await batches.aclose()
 
         total = time.time() - start
         logger.info(f'import VetSuccess for {total} sec, {total_new_records} new records')
 
+    async def plan_tables(
+        self,
+        fingerprints: bool = True
+    ) -> typing.List[typing.Tuple[tables.TableConfig, typing.Any, typing.Optional[planner.Decision]]]:
+        """Tables in import order with decisions of the planner, all the tables
+        are imported by priority when there's no planner. Without `fingerprints`
+        the decisions are made by the stored stats only, no table is queried
+        """
+        if self._planner is None:
+            tables_to_import = sorted(self.get_tables(), key=lambda item: item[0].priority, reverse=True)
+            return [(table, additional_data_fetcher, None) for table, additional_data_fetcher in tables_to_import]
+
+        return await self._planner.plan(self.get_tables(), self.get_fingerprint if fingerprints else None)
+
+    async def get_fingerprint(self, table: tables.TableConfig) -> typing.Optional[typing.List[str]]:
+        """Fingerprint of the whole table, None when the table has no stored
+        checksums, so the table isn't skipped before its checksums are written
+        """
+        if not await ChecksumStorage(table.name, self._redis).exists():
+            return None
+
+        if table.exclude_columns and table.columns is None and table.schema is None:
+            await self.load_schema(table)
+
+        async with self._db.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f'{table.get_sql()} LIMIT 0', table.get_sql_params())
+                columns = [(column.name, column.type_code) for column in cur.description]
+                await cur.execute(table.get_table_fingerprint_sql(columns), table.get_sql_params())
+                row = await cur.fetchone()
+
+        return [str(value) for value in row]
+
+    async def import_table(
+        self,
+        table: tables.TableConfig,
+        additional_data_fetcher: typing.Any,
+        decision: planner.Decision = None
+    ) -> typing.AsyncGenerator[typing.Tuple[str, typing.List[encoding.Record]], None]:
+        table_start = time.time()
+        fetcher_class = TimestampedTableFetcher
+        if table.timestamp_column is None:
+            fetcher_class = ChecksumTableFether
+
+        if table.exclude_columns and table.columns is None:
+            await self.load_schema(table)
+
+        fetcher = fetcher_class(table, self._db, self._redis, self._unloader)
+        batches = fetcher.fetch_batches()
+        if additional_data_fetcher:
+            batches = self.enrich(batches, table, additional_data_fetcher())
+
+        new_records = 0
+        # failed and cancelled imports are recorded too, they're the runs to look into
+        status, error = self.FAILED, None
+        try:
+            async for batch in batches:
+                new_records += len(batch)
+                yield (table.name, batch)
+                logger.info('import progress: %d of %s', new_records, table.name)
+            status = self.DONE
+        except (asyncio.CancelledError, GeneratorExit):
+            status = self.CANCELLED
+            raise
+        except Exception as ex:
+            error = str(ex)
+            raise
+        finally:
+            working_time = time.time() - table_start
+            stats = fetcher.get_stats()
+            self.table_runs.append(dict(
+                stats,
+                table=table.name,
+                start=table_start,
+                end=table_start + working_time,
+                changed=new_records,
+                status=status,
+                error=error,
+            ))
+            await batches.aclose()
+
+        logger.info(f'import {table.name} for {working_time} sec, {new_records} new records')
+        if decision is not None:
+            await self._planner.record(decision, stats['scanned'], new_records, working_time)
+
+    async def enrich(
+        self,
+        batches: typing.AsyncIterator[typing.List[encoding.Record]],
+        table: tables.TableConfig,
+        additional_data_fetcher: 'AdditionalDataFetcher'
+    ) -> typing.AsyncGenerator[typing.List[encoding.Record], None]:
+        """Resolve `_additionals` of the records by chunks of fetcher BATCH_SIZE,
+        a chunk is enriched while the previous one is handled, order of records is kept.
+        Chunks of a batch are yielded before the next batch is requested, so the
+        fetcher saves checksums of the batch once all of it is handed over
+        """
+        size = additional_data_fetcher.BATCH_SIZE
+        pending = None
+        try:
+            async for batch in batches:
+                for i in range(0, len(batch), size):
+                    chunk = batch[i:i + size]
+                    previous, pending = pending, (
+                        chunk,
+                        asyncio.ensure_future(additional_data_fetcher.fetch_batch(chunk, table, self._db))
+                    )
+                    if previous is not None:
+                        yield await self._resolve_additionals(*previous)
+
+                if pending is not None:
+                    previous, pending = pending, None
+                    yield await self._resolve_additionals(*previous)
+        finally:
+            if pending is not None:
+                pending[1].cancel()
+            await batches.aclose()
+
+    @staticmethod
+    async def _resolve_additionals(
+        batch: typing.List[encoding.Record],
+        task: asyncio.Future
+    ) -> typing.List[encoding.Record]:
+        for record, additionals in zip(batch, await task):
+            record['_additionals'] = additionals
+
+        return batch
+
+    async def load_schema(self, table: tables.TableConfig) -> encoding.Columns:
+        async with self._db.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(table.get_schema_sql())
+                columns = encoding.Columns(cur.description)
+
+        table.set_schema(columns)
+
+        return columns
+
+    async def get_schema(self) -> typing.Dict[str, typing.List[dict]]:
+        """Columns of the imported tables and whether they're selected,
+        helps to maintain column lists of the table configs
+        """
+        schema = {}
+        for table, _ in self.get_tables():
+            columns = await self.load_schema(table)
+            selected = table.get_columns()
+            schema[table.name] = [
+                {
+                    'name': name,
+                    'type_code': type_code,
+                    'selected': selected is None or name in selected,
+                }
+                for name, type_code in zip(columns, columns.type_codes)
+            ]
+
+        return schema
+
     async def close(self):
-        self._db.close()
+        if self._close_pool:
+            self._db.close()
+            await self._db.wait_closed()
 
-    def get_tables(self) -> typing.Iterable[typing.Tuple[tables.TableConfig, typing.Any]]:
+    @classmethod
+    def get_pool_size(cls, concurrency: int = None) -> int:
+        """Connections the concurrent table imports may hold at once at most"""
+        connections = sorted(
+            (max(table.partitions, 1) + cls.CONNECTIONS_PER_TABLE - 1 for table, _ in cls.get_tables()),
+            reverse=True
+        )
+
+        return sum(connections[:concurrency or cls.CONCURRENCY])
+
+    @staticmethod
+    def get_tables() -> typing.Iterable[typing.Tuple[tables.TableConfig, typing.Any]]:
         return (
             (
                 tables.TableConfig(
                     name='aaha_accounts',
-                    checksum_column='id'
+                    checksum_column='id',
+                    checksum_pushdown=True
                 ), None
             ),
             (
@@ -79,27 +294,32 @@ class DB:
             (
                 tables.TableConfig(
                     name='dates',
-                    checksum_column='record_date'
+                    checksum_column='record_date',
+                    checksum_pushdown=True,
+                    fingerprint_buckets=64
                 ), None
             ),
             (
                 tables.TableConfig(
                     name='emails',
                     checksum_column='vetsuccess_id',
-                    order_by='client_vetsuccess_id'
+                    order_by='client_vetsuccess_id',
+                    nullable_columns=('client_vetsuccess_id', )
                 ), None
             ),
             (
                 tables.TableConfig(
                     name='invoices',
-                    timestamp_column='source_updated_at'
+                    timestamp_column='source_updated_at',
+                    priority=10
                 ), None
             ),
             (
                 tables.PatientTableConfig(
                     name='patients',
                     checksum_column='vetsuccess_id',
-                    order_by='client_vetsuccess_id'
+                    order_by='client_vetsuccess_id',
+                    nullable_columns=('client_vetsuccess_id', )
                 ), None
             ),
             (
@@ -123,7 +343,9 @@ class DB:
             (
                 tables.TableConfig(
                     name='practices',
-                    checksum_column='id'
+                    checksum_column='id',
+                    checksum_pushdown=True,
+                    fingerprint_buckets=64
                 ), None
             ),
             (
@@ -141,7 +363,9 @@ class DB:
             (
                 tables.TableConfig(
                     name='normalized_transactions',
-                    timestamp_column='updated_at'
+                    timestamp_column='updated_at',
+                    priority=20,
+                    partitions=4
                 ), None
             ),
             (
@@ -153,177 +377,753 @@ class DB:
             (
                 tables.TableConfig(
                     name='sites',
-                    checksum_column='vetsuccess_id'
+                    checksum_column='vetsuccess_id',
+                    checksum_pushdown=True,
+                    fingerprint_buckets=64
                 ), None
             ),
         )
 
 
 class ChecksumStorage:
+    """Checksums of the table rows, `load` fetches checksums of the current page
+    only, `cache` keeps loaded checksums for the lifetime of the storage.
+
+    Checksums are DIGEST_SIZE bytes digests, integer primary keys are stored
+    as minimal big-endian bytes and other ones as zero prefixed UTF-8. Lookups
+    fall back to the legacy hex checksums hash until it's migrated.
+
+    Snapshot checksums of the first table import are written without lookups,
+    buffered up to SNAPSHOT_THRESHOLD fields and sent in a single pipeline.
+    """
     THRESHOLD = 1000
+    SNAPSHOT_THRESHOLD = 100000
+    VERSION = 2
+    DIGEST_SIZE = encoding.DIGEST_SIZE
+    INTEGER_PK = re.compile(r'-?(0|[1-9][0-9]*)')
 
-    def __init__(self, table_name: str, redis: aioredis.ConnectionsPool):
+    def __init__(self, table_name: str, redis: aioredis.ConnectionsPool, cache: bool = False):
         self.table_name = table_name
         self.redis = redis
+        self.cache = cache
         self.checksums = None
         self.updated = {}
+        self.snapshot = {}
+        self.legacy = None
 
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.flush_snapshot()
         await self.sync_current_block()
 
-    async def __getitem__(self, pk: int) -> str:
-        if self.checksums is None:
-            self.checksums = await self.get_block()
-
-        return self.checksums.get(str(pk))
-
-    def __setitem__(self, pk: int, checksum: str):
+    async def exists(self) -> bool:
+        return bool(await self.redis.exists(self.get_storage_key(), self.get_legacy_storage_key()))
+
+    async def has_state(self) -> bool:
+        """Checksums are stored or the table was initialized by a snapshot"""
+        return bool(await self.redis.exists(
+            self.get_storage_key(),
+            self.get_legacy_storage_key(),
+            self.get_initialized_key()
+        ))
+
+    async def write_snapshot(self, checksums: typing.Iterable[typing.Tuple[typing.Any, bytes]]):
+        self.snapshot.update((self.encode_pk(pk), checksum) for pk, checksum in checksums)
+        if len(self.snapshot) >= self.SNAPSHOT_THRESHOLD:
+            await self.flush_snapshot()
+
+    async def flush_snapshot(self):
+        if not self.snapshot:
+            return
+
+        fields = list(self.snapshot.items())
+        self.snapshot = {}
+        pipe = self.redis.pipeline()
+        for i in range(0, len(fields), self.THRESHOLD):
+            pipe.hmset_dict(self.get_storage_key(), dict(fields[i:i + self.THRESHOLD]))
+        await pipe.execute()
+
+    async def mark_initialized(self):
+        await self.flush_snapshot()
+        await self.redis.set(self.get_initialized_key(), int(time.time()))
+
+    def __setitem__(self, pk: int, checksum: bytes):
         self.updated[pk] = checksum
+        if self.checksums is not None:
+            self.checksums[self.encode_pk(pk)] = checksum
 
-    async def set(self, pk: int, checksum: str):
-        self[pk] = checksum
+    async def update(self, checksums: dict):
+        for pk, checksum in checksums.items():
+            self[pk] = checksum
         if len(self.updated) > self.THRESHOLD:
             await self.sync_current_block()
 
-    async def get_block(self):
-        data = await self.redis.hgetall(self.get_storage_key(), encoding='utf-8')
+    def get(self, pk) -> typing.Optional[bytes]:
+        """Checksum of the primary key passed to `load` before"""
+        return self.checksums.get(self.encode_pk(pk))
+
+    async def load(self, pks: typing.Iterable):
+        if self.checksums is None or not self.cache:
+            self.checksums = {}
+
+        pks = list({self.encode_pk(pk): pk for pk in pks if self.encode_pk(pk) not in self.checksums}.values())
+        if not pks:
+            return
 
-        return data or {}
+        checksums = dict(zip(pks, await self._hmget(self.get_storage_key(), [self.encode_pk(pk) for pk in pks])))
+        missing = [pk for pk, checksum in checksums.items() if checksum is None]
+        if missing and await self.has_legacy():
+            legacy = await self._hmget(self.get_legacy_storage_key(), [str(pk) for pk in missing])
+            checksums.update(zip(missing, map(self.decode_legacy_checksum, legacy)))
+
+        self.checksums.update((self.encode_pk(pk), checksum) for pk, checksum in checksums.items())
+
+    async def has_legacy(self) -> bool:
+        if self.legacy is None:
+            self.legacy = bool(await self.redis.exists(self.get_legacy_storage_key()))
+
+        return self.legacy
+
+    async def _hmget(self, key: str, fields: typing.List) -> typing.List:
+        pipe = self.redis.pipeline()
+        futures = [
+            pipe.hmget(key, *fields[i:i + self.THRESHOLD])
+            for i in range(0, len(fields), self.THRESHOLD)
+        ]
+        await pipe.execute()
+
+        return list(itertools.chain.from_iterable(future.result() for future in futures))
 
     async def sync_current_block(self):
         if self.updated:
             await self.redis.hmset_dict(
                 self.get_storage_key(),
-                self.updated
+                {self.encode_pk(pk): checksum for pk, checksum in self.updated.items()}
             )
             self.updated = {}
 
+    @classmethod
+    def encode_pk(cls, pk) -> bytes:
+        text = str(pk)
+        if cls.INTEGER_PK.fullmatch(text):
+            value = int(text)
+            return value.to_bytes(value.bit_length() // 8 + 1, 'big', signed=True)
+
+        return b'\x00' + text.encode('utf-8')
+
+    @classmethod
+    def digest(cls, checksum: str) -> bytes:
+        """Compact form of a hex checksum"""
+        return bytes.fromhex(checksum)[:cls.DIGEST_SIZE]
+
+    @classmethod
+    def decode_legacy_checksum(cls, checksum: typing.Optional[bytes]) -> typing.Optional[bytes]:
+        if checksum is None:
+            return None
+
+        return cls.digest(checksum.decode('utf-8'))
+
     def get_storage_key(self) -> str:
+        return 'devourer.datasource.versuccess.checksums.v{}-{}'.format(
+            self.VERSION,
+            self.table_name
+        )
+
+    def get_legacy_storage_key(self) -> str:
         return 'devourer.datasource.versuccess.checksums-{}'.format(
             self.table_name
         )
 
+    def get_initialized_key(self) -> str:
+        return 'devourer.datasource.versuccess.initialized-{}'.format(
+            self.table_name
+        )
+
+
+class ChecksumStorageMigration:
+    """Resumable migration of the legacy hex checksums hashes to the compact
+    format, keys are found with SCAN and copied with HSCAN batches. Fields are
+    written with HSETNX so checksums saved by running imports aren't overwritten,
+    legacy hash is removed once it's copied completely.
+    """
+    LEGACY_PATTERN = 'devourer.datasource.versuccess.checksums-*'
+    BATCH_SIZE = 1000
+
+    def __init__(self, redis: aioredis.ConnectionsPool):
+        self.redis = redis
+
+    async def run(self) -> dict:
+        migrated = {}
+        cursor = None
+        while cursor != 0:
+            cursor, keys = await self.redis.scan(cursor or 0, match=self.LEGACY_PATTERN, count=self.BATCH_SIZE)
+            for key in keys:
+                key = key.decode('utf-8')
+                migrated[key] = await self.migrate(key)
+
+        return migrated
+
+    async def migrate(self, key: str) -> int:
+        stor = ChecksumStorage(self.get_table_name(key), self.redis)
+        progress_key = self.get_progress_key()
+        cursor = int(await self.redis.hget(progress_key, key) or 0)
+        count = 0
+        while True:
+            cursor, items = await self.redis.hscan(key, cursor, count=self.BATCH_SIZE)
+            pipe = self.redis.pipeline()
+            for pk, checksum in items:
+                pipe.hsetnx(
+                    stor.get_storage_key(),
+                    stor.encode_pk(pk.decode('utf-8')),
+                    stor.decode_legacy_checksum(checksum)
+                )
+            pipe.hset(progress_key, key, cursor)
+            await pipe.execute()
+            count += len(items)
+
+            if not cursor:
+                break
+
+        logger.info('checksums migration: %d checksums of %s', count, key)
+        tr = self.redis.multi_exec()
+        tr.delete(key)
+        tr.hdel(progress_key, key)
+        await tr.execute()
+
+        return count
+
+    @staticmethod
+    def get_table_name(key: str) -> str:
+        # keys of the old blocks layout are "checksums-{table}-{block}"
+        return key[len(ChecksumStorageMigration.LEGACY_PATTERN) - 1:].split('-')[0]
+
+    @staticmethod
+    def get_progress_key() -> str:
+        return 'devourer.datasource.versuccess.checksums.migration'
+
 
 class TimestampStorage:
-    SAVE_THRESHOLD = 1000
+    """Import checkpoint of the timestamped table, the full precision (timestamp,
+    primary key) sort key of the last fetched batch, the next fetch resumes
+    strictly after it. Integer timestamps saved before the checkpoints are
+    resumed from their second.
+    """
+    INITIAL = datetime(1, 1, 1)
 
     def __init__(self, table_name: str, redis: aioredis.ConnectionsPool):
         self.table_name = table_name
         self.redis = redis
-        self.timestamp = None
-        self._debounce = 0
+        self.checkpoint = None
 
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc_value, traceback):
-        if self.timestamp:
-            await self._save_to_redis()
+        ...
 
-    async def get_latest(self) -> int:
-        ts = await self.redis.get(self.get_storage_key())
+    async def get_checkpoint(self) -> typing.Tuple[datetime, typing.Optional[tuple]]:
+        """(lowest timestamp, sort key to resume after) of the next fetch"""
+        value = await self.redis.get(self.get_storage_key())
+        if value is None:
+            return (self.INITIAL, None)
 
-        if ts is None:
-            last_update = datetime(1, 1, 1)
-        else:
-            last_update = datetime.fromtimestamp(int(ts))
+        value = json.loads(value)
+        if isinstance(value, int):
+            return (datetime.fromtimestamp(value), None)
+
+        timestamp, pk = value
+        timestamp = datetime.fromisoformat(timestamp)
 
-        return last_update
+        return (timestamp, (timestamp, pk))
 
-    async def set_timestamp(self, row_time):
-        if isinstance(row_time, datetime):
-            row_time = time.mktime(row_time.timetuple())
-        self.timestamp = int(row_time)
+    async def set_checkpoint(self, key: tuple):
+        """Commit the sort key of the last fetched row, partitioned scans fetch
+        pages out of order so the greatest key is kept
+        """
+        if self.checkpoint is not None and key <= self.checkpoint:
+            return
 
-        self._debounce += 1
-        if self._debounce > self.SAVE_THRESHOLD:
-            await self._save_to_redis()
-            self._debounce = 0
+        self.checkpoint = key
+        # str() keeps full precision of datetime keys
+        await self.redis.set(self.get_storage_key(), json.dumps(key, default=str))
 
     def get_storage_key(self) -> str:
         return 'devourer.datasource.versuccess.timestamp-{}'.format(
             self.table_name
         )
 
-    async def _save_to_redis(self):
-        await self.redis.set(self.get_storage_key(), self.timestamp)
-
 
-class TimestampedTableFetcher:
+class FingerprintStorage:
+    """Per bucket fingerprints of the table rows, a bucket with unchanged
+    fingerprint doesn't need row level comparison
+    """
 
-    def __init__(self, table: tables.TableConfig, db: aiopg.Pool, redis: aioredis.ConnectionsPool):
-        self.table = table
-        self.db = db
+    def __init__(self, table_name: str, redis: aioredis.ConnectionsPool):
+        self.table_name = table_name
         self.redis = redis
+        self.fingerprints = {}
+
+    async def get_changed_buckets(
+        self,
+        cur: aiopg.Cursor,
+        table: tables.TableConfig,
+        columns: typing.List[tuple]
+    ) -> typing.List[int]:
+        await cur.execute(table.get_fingerprint_sql(columns))
+        self.fingerprints = {
+            str(bucket): f'{count}:{hash_sum}'
+            for bucket, count, hash_sum in await cur.fetchall()
+        }
+        stored = await self.redis.hgetall(self.get_storage_key(), encoding='utf-8') or {}
+
+        return sorted(
+            int(bucket)
+            for bucket in set(self.fingerprints) | set(stored)
+            if self.fingerprints.get(bucket) != stored.get(bucket)
+        )
 
-    async def fetch(self):
-        async with self.db.acquire() as conn:
-            async with conn.cursor() as cur:
-                async with TimestampStorage(self.table.name, self.redis) as stor:
-                    timestamp = await stor.get_latest()
-                    sql = self.table.get_sql() % {'timestamp': timestamp.isoformat()}
-                    offset = 0
-                    limit = 500000
-                    while True:
-                        await cur.execute(f'{sql} LIMIT {limit} OFFSET {offset}', timeout=60 * 15)
+    async def save(self):
+        tr = self.redis.multi_exec()
+        tr.delete(self.get_storage_key())
+        if self.fingerprints:
+            tr.hmset_dict(self.get_storage_key(), self.fingerprints)
+        await tr.execute()
+
+    def get_storage_key(self) -> str:
+        return 'devourer.datasource.versuccess.fingerprints-{}'.format(
+            self.table_name
+        )
+
+
+class PartitionStorage:
+    """Key ranges of the partitioned table scan with the last fetched key of each range,
+    kept until the scan is finished so an interrupted import re-reads unfinished ranges only
+    """
+
+    def __init__(self, table_name: str, redis: aioredis.ConnectionsPool):
+        self.table_name = table_name
+        self.redis = redis
 
-                        column_names = [
-                            column.name
-                            for column in cur.description
-                        ]
+    async def get_partitions(self) -> typing.List[dict]:
+        data = await self.redis.hgetall(self.get_storage_key(), encoding='utf-8')
 
-                        async for rawdata in cur:
-                            data = dict(zip(column_names, rawdata))
-                            yield data
-                            await stor.set_timestamp(data[self.table.timestamp_column])
+        return [
+            json.loads(data[index])
+            for index in sorted(data or {}, key=int)
+        ]
 
-                        if cur.rowcount == 0:
-                            break
+    async def set_partitions(self, partitions: typing.List[dict]):
+        await self.redis.hmset_dict(
+            self.get_storage_key(),
+            {str(index): self._dumps(partition) for index, partition in enumerate(partitions)}
+        )
 
-                        offset += limit
+    async def set_partition(self, index: int, partition: dict):
+        await self.redis.hset(self.get_storage_key(), str(index), self._dumps(partition))
 
+    async def clear(self):
+        await self.redis.delete(self.get_storage_key())
 
-class ChecksumTableFether:
+    def get_storage_key(self) -> str:
+        return 'devourer.datasource.versuccess.partitions-{}'.format(
+            self.table_name
+        )
 
-    def __init__(self, table: tables.TableConfig, db: aiopg.Pool, redis: aioredis.ConnectionsPool):
+    @staticmethod
+    def _dumps(partition: dict) -> str:
+        # str() keeps full precision of datetime and Decimal keys
+        return json.dumps(partition, default=str)
+
+
+class TableFetcher(abc.ABC):
+    PAGE_SIZE = 10000
+    QUERY_TIMEOUT = None
+    # pages fetched ahead of the consumer, each one keeps up to page size rows in memory
+    READ_AHEAD = 1
+
+    def __init__(
+        self,
+        table: tables.TableConfig,
+        db: aiopg.Pool,
+        redis: aioredis.ConnectionsPool,
+        unloader: unload.Unloader = None
+    ):
         self.table = table
         self.db = db
         self.redis = redis
-        self._checksums_range = (-1, -1)
-        self._checksums = {}
+        self.unloader = unloader
+        self.page_size = table.page_size or self.PAGE_SIZE
+        self.read_ahead = self.READ_AHEAD if table.read_ahead is None else table.read_ahead
+        self.scanned = 0
+        # time spent waiting for Redshift pages and rows
+        self.fetch_time = 0.0
+        self.checkpoint_before = None
+        self.checkpoint_after = None
+
+    async def fetch_pages(
+        self,
+        initial: bool = False,
+        after: tuple = None,
+        **params
+    ) -> typing.AsyncGenerator[typing.Tuple[typing.List[str], typing.List[tuple]], None]:
+        """Yield (column names, rows) pages of the table using table fetch strategy,
+        rows start strictly after the `after` sort key when it's given,
+        initial import goes through bulk UNLOAD when unloader is configured
+        """
+        bulk = self.is_bulk(initial)
+        if not bulk and self.table.partitions > 1 and self.table.strategy == tables.FetchStrategy.KEYSET:
+            async for page in self._count_pages(self._fetch_partitioned_pages(after, **params)):
+                yield page
+            return
 
-    async def fetch(self):
         async with self.db.acquire() as conn:
             async with conn.cursor() as cur:
-                sql = self.table.get_sql()
-                offset = 0
-                limit = 10000
-                while True:
-                    await cur.execute(f'{sql} LIMIT {limit} OFFSET {offset}')
-
-                    column_names = [
-                        column.name
-                        for column in cur.description
-                    ]
-
-                    async with ChecksumStorage(self.table.name, self.redis) as stor:
-                        async for rawdata in cur:
-                            data = dict(zip(column_names, rawdata))
-                            is_changed = await self.is_changed(
-                                stor,
-                                self.checksum_column_normalization(data[self.table.checksum_column]),
-                                rawdata
-                            )
-                            if not is_changed:
-                                yield data
+                if bulk:
+                    pages = self.unloader.fetch_pages(self.table, cur, self.page_size, **params)
+                else:
+                    pages = {
+                        tables.FetchStrategy.OFFSET: self._fetch_offset_pages,
+                        tables.FetchStrategy.KEYSET: self._fetch_keyset_pages,
+                        tables.FetchStrategy.CURSOR: self._fetch_cursor_pages,
+                    }[self.table.strategy](cur, after, **params)
+
+                pages = aio.read_ahead(pages, self.read_ahead)
+                try:
+                    async for page in self._count_pages(pages):
+                        yield page
+                finally:
+                    await pages.aclose()
+
+    def is_bulk(self, initial: bool) -> bool:
+        return initial and self.unloader is not None
+
+    async def _count_pages(self, pages: typing.AsyncIterator[tuple]) -> typing.AsyncGenerator[tuple, None]:
+        """Count rows of the pages and time spent waiting for them"""
+        started = time.monotonic()
+        async for page in pages:
+            self.fetch_time += time.monotonic() - started
+            self.scanned += len(page[1])
+            yield page
+            started = time.monotonic()
+
+    async def _fetch_offset_pages(self, cur: aiopg.Cursor, after: tuple = None, **params):
+        sql = self.table.get_sql(after)
+        offset = 0
+        while True:
+            await cur.execute(
+                f'{sql} LIMIT {self.page_size} OFFSET {offset}',
+                self.table.get_sql_params(after, **params),
+                timeout=self.QUERY_TIMEOUT
+            )
+            rows = await cur.fetchall()
+            yield (self.get_column_names(cur), rows)
+
+            if len(rows) < self.page_size:
+                break
+
+            offset += self.page_size
+
+    async def _fetch_keyset_pages(
+        self,
+        cur: aiopg.Cursor,
+        after: tuple = None,
+        partition: tuple = None,
+        get_sql: typing.Callable = None,
+        **params
+    ):
+        get_sql = get_sql or self.table.get_sql
+        while True:
+            await cur.execute(
+                f'{get_sql(after, partition)} LIMIT {self.page_size}',
+                self.table.get_sql_params(after, partition, **params),
+                timeout=self.QUERY_TIMEOUT
+            )
+            rows = await cur.fetchall()
+            column_names = self.get_column_names(cur)
+            yield (column_names, rows)
+
+            if len(rows) < self.page_size:
+                break
+
+            after = self.table.get_key(dict(zip(column_names, rows[-1])))
+
+    async def _fetch_cursor_pages(self, cur: aiopg.Cursor, after: tuple = None, **params):
+        """Stream the whole table query through the named server-side cursor,
+        the query is planned once and only `page_size` rows are kept in memory
+        """
+        name = f'devourer_{self.table.name}'
+        await cur.execute('BEGIN')
+        try:
+            await cur.execute(
+                f'DECLARE {name} NO SCROLL CURSOR FOR {self.table.get_sql(after)}',
+                self.table.get_sql_params(after, **params),
+                timeout=self.QUERY_TIMEOUT
+            )
+            while True:
+                await cur.execute(f'FETCH FORWARD {self.page_size} FROM {name}', timeout=self.QUERY_TIMEOUT)
+                rows = await cur.fetchall()
+                yield (self.get_column_names(cur), rows)
 
-                    if cur.rowcount == 0:
-                        break
+                if len(rows) < self.page_size:
+                    break
+        except BaseException:
+            await cur.execute('ROLLBACK')
+            raise
+        else:
+            await cur.execute(f'CLOSE {name}')
+            await cur.execute('COMMIT')
+
+    async def _fetch_partitioned_pages(self, after: tuple = None, **params):
+        """Scan key ranges of the table concurrently on separate pool connections"""
+        stor = PartitionStorage(self.table.name, self.redis)
+        partitions = await stor.get_partitions()
+        if partitions:
+            logger.info('resume partitioned scan of %s', self.table.name)
+        else:
+            partitions = await self.get_partitions(after, **params)
+            await stor.set_partitions(partitions)
+
+        pending = [
+            (index, partition)
+            for index, partition in enumerate(partitions)
+            if not partition['done']
+        ]
+        fetchers = (
+            self._fetch_partition(stor, index, partition)
+            for index, partition in pending
+        )
+        async for page in aio.merge(fetchers, max(len(pending), 1), queue_size=1):
+            yield page
 
-                    offset += limit
+        await stor.clear()
+
+    async def _fetch_partition(self, stor: 'PartitionStorage', index: int, partition: dict):
+        async with self.db.acquire() as conn:
+            async with conn.cursor() as cur:
+                pages = self._fetch_keyset_pages(cur, partition['after'], partition['range'], **partition['params'])
+                async for column_names, rows in pages:
+                    yield (column_names, rows)
+                    if rows:
+                        partition['after'] = self.table.get_key(dict(zip(column_names, rows[-1])))
+                        await stor.set_partition(index, partition)
+
+        partition['done'] = True
+        await stor.set_partition(index, partition)
+
+    async def get_partitions(self, after: tuple = None, **params) -> typing.List[dict]:
+        async with self.db.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    self.table.get_partition_probe_sql(),
+                    self.table.get_sql_params(**params),
+                    timeout=self.QUERY_TIMEOUT
+                )
+                bounds = sorted({bound for bound in await cur.fetchone() if bound is not None})
+
+        edges = [None] + bounds + [None]
+
+        return [
+            {'range': [lower, upper], 'after': after, 'params': params, 'done': False}
+            for lower, upper in zip(edges, edges[1:])
+        ]
+
+    def get_stats(self) -> dict:
+        return {
+            'scanned': self.scanned,
+            'fetch_time': round(self.fetch_time, 3),
+            'checkpoint_before': self.checkpoint_before,
+            'checkpoint_after': self.checkpoint_after,
+        }
+
+    async def fetch(self) -> typing.AsyncGenerator[encoding.Record, None]:
+        async for batch in self.fetch_batches():
+            for record in batch:
+                yield record
+
+    @abc.abstractmethod
+    async def fetch_batches(self) -> typing.AsyncGenerator[typing.List[encoding.Record], None]:
+        """Batches of the new and changed records of the table"""
+
+    @staticmethod
+    def get_column_names(cur: aiopg.Cursor) -> encoding.Columns:
+        return encoding.Columns(cur.description)
+
+
+class TimestampedTableFetcher(TableFetcher):
+    PAGE_SIZE = 500000
+    QUERY_TIMEOUT = 60 * 15
+
+    async def fetch_batches(self):
+        async with TimestampStorage(self.table.name, self.redis) as stor:
+            timestamp, after = await stor.get_checkpoint()
+            self.checkpoint_before = self.checkpoint_after = after or timestamp
+            initial = timestamp == stor.INITIAL
+            # bulk UNLOAD pages aren't ordered, so the checkpoint is saved once all of them are read,
+            # an interrupted bulk import starts over
+            bulk = self.is_bulk(initial)
+            bulk_key = None
+            async for column_names, rows in self.fetch_pages(initial, after, timestamp=timestamp):
+                if not rows:
+                    continue
+
+                yield [encoding.Record(column_names, rawdata) for rawdata in rows]
+
+                key = [column_names.positions[column] for column in self.table.get_key_columns()]
+                page_key = max(tuple(rawdata[i] for i in key) for rawdata in rows)
+                if bulk:
+                    bulk_key = page_key if bulk_key is None else max(bulk_key, page_key)
+                else:
+                    await stor.set_checkpoint(page_key)
+                    self.checkpoint_after = stor.checkpoint
+
+            if bulk_key is not None:
+                await stor.set_checkpoint(bulk_key)
+                self.checkpoint_after = stor.checkpoint
+
+
+class ChecksumTableFether(TableFetcher):
+    PK_BATCH_SIZE = 1000
+    # checksums saved before the binary row encoding are verified and upgraded
+    VERIFY_LEGACY_CHECKSUMS = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.snapshot = False
+
+    def get_stats(self) -> dict:
+        return dict(super().get_stats(), snapshot=self.snapshot)
+
+    async def fetch_batches(self):
+        # checksums of the pushdown tables are computed by Redshift, the first import included,
+        # the bulk path would store row digests which don't match them
+        if self.table.checksum_pushdown:
+            async for batch in self.fetch_changed():
+                yield batch
+            return
+
+        stor = ChecksumStorage(self.table.name, self.redis)
+        if not await stor.has_state():
+            async for batch in self.fetch_snapshot():
+                yield batch
+            return
+
+        initial = self.unloader is not None and not await stor.exists()
+
+        async with ChecksumStorage(self.table.name, self.redis, self.table.checksum_cache) as stor:
+            async for column_names, rows in self.fetch_pages(initial):
+                pk_index = column_names.positions[self.table.checksum_column]
+                pks = [self.checksum_column_normalization(rawdata[pk_index]) for rawdata in rows]
+                await stor.load(pks)
+                encoder = encoding.get_row_encoder(tuple(column_names.type_codes), stor.DIGEST_SIZE)
+                compare_page = self.compare_columns if self.table.columnar else self.compare_rows
+                changed, checksums = compare_page([stor.get(pk) for pk in pks], rows, encoder)
+
+                batch = [encoding.Record(column_names, rows[i]) for i in changed]
+                checksums = {pks[i]: checksum for i, checksum in checksums.items()}
+                if batch:
+                    yield batch
+                await stor.update(checksums)
+
+    async def fetch_snapshot(self):
+        """First import of the table, all the rows are new so whole pages are
+        published without checksum lookups and comparisons. Checksums are the
+        same ones the comparisons compute, the table is marked initialized once
+        it's fetched completely, an interrupted snapshot is continued by
+        comparisons against the checksums written so far
+        """
+        self.snapshot = True
+        logger.info('%s: snapshot import', self.table.name)
+        async with ChecksumStorage(self.table.name, self.redis) as stor:
+            async for column_names, rows in self.fetch_pages(initial=True):
+                if not rows:
+                    continue
+
+                pk_index = column_names.positions[self.table.checksum_column]
+                if self.table.columnar:
+                    digests = columnar.get_digests(rows, column_names.type_codes)
+                    checksums = [columnar.unpack_digest(digest) for digest in digests]
+                else:
+                    encoder = encoding.get_row_encoder(tuple(column_names.type_codes), stor.DIGEST_SIZE)
+                    checksums = [encoder.digest(rawdata) for rawdata in rows]
+
+                yield [encoding.Record(column_names, rawdata) for rawdata in rows]
+                await stor.write_snapshot(
+                    (self.checksum_column_normalization(rawdata[pk_index]), checksum)
+                    for rawdata, checksum in zip(rows, checksums)
+                )
+
+            await stor.mark_initialized()
+
+    async def fetch_changed(self):
+        """Two-phase fetch: compare row checksums computed by Redshift with stored ones
+        first, then fetch full rows of changed primary keys only
+        """
+        async with contextlib.AsyncExitStack() as stack:
+            conn = await stack.enter_async_context(self.db.acquire())
+            # pages read ahead run concurrently with the rows queries on a second connection
+            rows_conn = await stack.enter_async_context(self.db.acquire()) if self.read_ahead else conn
+            cur = await stack.enter_async_context(conn.cursor())
+            rows_cur = await stack.enter_async_context(rows_conn.cursor())
+            await cur.execute(f'{self.table.get_sql()} LIMIT 0', self.table.get_sql_params())
+            columns = [(column.name, column.type_code) for column in cur.description]
+
+            get_sql = functools.partial(self.table.get_checksum_sql, columns)
+            params = {}
+            fingerprints = None
+            if self.table.fingerprint_buckets:
+                fingerprints = FingerprintStorage(self.table.name, self.redis)
+                buckets = await fingerprints.get_changed_buckets(cur, self.table, columns)
+                logger.info('%s: %d changed fingerprint buckets', self.table.name, len(buckets))
+                if not buckets:
+                    return
+
+                get_sql = functools.partial(get_sql, buckets=True)
+                params['buckets'] = buckets
+
+            pages = aio.read_ahead(self._fetch_keyset_pages(cur, get_sql=get_sql, **params), self.read_ahead)
+            try:
+                async with ChecksumStorage(self.table.name, self.redis, self.table.checksum_cache) as stor:
+                    async for column_names, rows in self._count_pages(pages):
+                        pk_index = column_names.positions[self.table.checksum_column]
+                        checksum_index = column_names.positions[tables.CHECKSUM_ALIAS]
+                        await stor.load(self.checksum_column_normalization(rawdata[pk_index]) for rawdata in rows)
+
+                        changed = {}
+                        for rawdata in rows:
+                            pk = rawdata[pk_index]
+                            checksum = stor.digest(rawdata[checksum_index])
+                            if stor.get(self.checksum_column_normalization(pk)) != checksum:
+                                changed[pk] = checksum
+
+                        pks = list(changed)
+                        for i in range(0, len(pks), self.PK_BATCH_SIZE):
+                            started = time.monotonic()
+                            await rows_cur.execute(
+                                self.table.get_rows_by_pk_sql(),
+                                self.table.get_sql_params(pks=pks[i:i + self.PK_BATCH_SIZE]),
+                                timeout=self.QUERY_TIMEOUT
+                            )
+                            rows_column_names = self.get_column_names(rows_cur)
+                            batch = [
+                                encoding.Record(rows_column_names, rawdata)
+                                for rawdata in await rows_cur.fetchall()
+                            ]
+                            self.fetch_time += time.monotonic() - started
+                            if not batch:
+                                continue
+
+                            yield batch
+                            await stor.update({
+                                self.checksum_column_normalization(pk): changed[pk]
+                                for pk in (record[self.table.checksum_column] for record in batch)
+                            })
+            finally:
+                await pages.aclose()
+
+            if fingerprints is not None:
+                await fingerprints.save()
 
     @staticmethod
     def checksum_column_normalization(value):
@@ -332,81 +1132,232 @@ class ChecksumTableFether:
 
         return value
 
-    async def is_changed(self, stor: ChecksumStorage, pk: int, data: typing.Iterable) -> bool:
-        checksum = sha1(':'.join(map(str, data)).encode('utf-8')).hexdigest()
+    def compare_rows(
+        self,
+        stored: typing.List[typing.Optional[bytes]],
+        rows: typing.List[tuple],
+        encoder: encoding.RowEncoder
+    ) -> typing.Tuple[typing.List[int], typing.Dict[int, bytes]]:
+        """(positions of changed rows, checksums to save by position) of the page"""
+        changed = []
+        checksums = {}
+        for i, (stored_checksum, rawdata) in enumerate(zip(stored, rows)):
+            is_changed, checksum = self.compare(stored_checksum, rawdata, encoder)
+            if checksum is not None:
+                checksums[i] = checksum
+            if is_changed:
+                changed.append(i)
+
+        return changed, checksums
+
+    def compare_columns(
+        self,
+        stored: typing.List[typing.Optional[bytes]],
+        rows: typing.List[tuple],
+        encoder: encoding.RowEncoder
+    ) -> typing.Tuple[typing.List[int], typing.Dict[int, bytes]]:
+        """Vectorized `compare_rows`, digests are computed over the page columns and
+        only rows whose stored checksum doesn't match are checked by `compare`, so
+        checksums saved by the row encoding are upgraded without republishing
+        """
+        digests = columnar.get_digests(rows, encoder.type_codes)
+        stored_digests, missing = columnar.pack_digests(stored)
+        mismatched = np.flatnonzero(missing | (stored_digests != digests)).tolist()
+
+        changed = [i for i in mismatched if self.compare(stored[i], rows[i], encoder)[0]]
+        checksums = {i: columnar.unpack_digest(digests[i]) for i in mismatched}
+
+        return changed, checksums
+
+    def compare(
+        self,
+        stored: typing.Optional[bytes],
+        data: typing.Sequence,
+        encoder: encoding.RowEncoder
+    ) -> typing.Tuple[bool, typing.Optional[bytes]]:
+        """(row is changed, checksum to save) of the row against its stored checksum"""
+        checksum = encoder.digest(data)
+        if stored == checksum:
+            return (False, None)
+
+        if self.VERIFY_LEGACY_CHECKSUMS and stored is not None:
+            return (stored != encoding.legacy_digest(data, len(stored)), checksum)
+
+        return (True, checksum)
+
+
+class AdditionalDataFetcher(abc.ABC):
+    """Enrichment of the table records, `fetch_batch` gets additional data of
+    BATCH_SIZE records at once and should use set based queries. Chunks of a
+    table are enriched concurrently, shared state should be loaded under a lock
+    """
+    BATCH_SIZE = 1000
+
+    async def fetch_batch(self, records: typing.List[dict], table: tables.TableConfig, db: aiopg.Pool) -> list:
+        return [await self.fetch(record, table, db) for record in records]
+
+    @abc.abstractmethod
+    async def fetch(self, record: dict, table: tables.TableConfig, db: aiopg.Pool) -> typing.Any:
+        """Additional data of the record"""
+
+
+class CodeAdditionalDataFetcher(AdditionalDataFetcher):
+    """Code tags and revenue category of the codes, reference tables are loaded
+    once per import run and indexed in memory, so records need no queries
+    """
+    REVENUE_CATEGORY_FIELDS = ('revenue_category_id', 'subset_of_level_2_id', 'subset_of_level_1_id')
+
+    def __init__(self):
+        self.loaded = False
+        self.lock = asyncio.Lock()
+        self.code_tags = {}
+        self.mappings_by_code = collections.defaultdict(list)
+        self.mappings_by_tag = collections.defaultdict(list)
+        self.related_code_tags = {}
+        self.revenue_categories = {field: {} for field in self.REVENUE_CATEGORY_FIELDS}
+
+    async def fetch(self, record: dict, table: tables.CodeTableConfig, db: aiopg.Pool) -> dict:
+        if not self.loaded:
+            async with self.lock:
+                if not self.loaded:
+                    await self.load(table, db)
 
-        if (await stor[pk]) != checksum:
-            await stor.set(pk, checksum)
+        data = {}
+        if record['pms_code_vetsuccess_id']:
+            data['code_tags'] = self.get_code_tags(record['pms_code_vetsuccess_id'])
+        if record['revenue_category_id']:
+            data['revenue_category'] = self.get_revenue_category(record['revenue_category_id'])
 
-            return False
+        return data
 
-        return True
+    async def load(self, table: tables.CodeTableConfig, db: aiopg.Pool):
+        start = time.time()
+        async with db.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(table.get_code_tags_sql())
+                column_names = TableFetcher.get_column_names(cur)
+                for rawdata in await cur.fetchall():
+                    code_tag = dict(zip(column_names, rawdata))
+                    self.code_tags[str(code_tag['id'])] = code_tag
+
+                await cur.execute(table.get_code_tag_mappings_sql())
+                for code_tag_id, pms_code_vetsuccess_id, practice_id in await cur.fetchall():
+                    mapping = {'pms_code_vetsuccess_id': pms_code_vetsuccess_id, 'practice_id': practice_id}
+                    self.mappings_by_code[pms_code_vetsuccess_id].append((str(code_tag_id), mapping))
+                    self.mappings_by_tag[str(code_tag_id)].append(mapping)
+
+                await cur.execute(table.get_revenue_categories_sql())
+                column_names = TableFetcher.get_column_names(cur)
+                for rawdata in await cur.fetchall():
+                    revenue_category = dict(zip(column_names, rawdata))
+                    for field, index in self.revenue_categories.items():
+                        index.setdefault(revenue_category[field], revenue_category)
+
+        self.loaded = True
+        logger.info(
+            '%s: %d code tags, %d revenue categories loaded for %.2f sec',
+            table.name,
+            len(self.code_tags),
+            len(self.revenue_categories['revenue_category_id']),
+            time.time() - start
+        )
 
+    def get_code_tags(self, pms_code_vetsuccess_id: str) -> list:
+        """Tags mapped to the code with all the mappings of their ancestors"""
+        code_tags = []
+        ancestors = set()
+        for code_tag_id, mapping in self.mappings_by_code.get(pms_code_vetsuccess_id, ()):
+            code_tag = self.code_tags.get(code_tag_id)
+            if code_tag is None:
+                continue
 
-class CodeAdditionalDataFetcher:
+            code_tags.append(dict(code_tag, **mapping))
+            ancestors.update(filter(None, (code_tag['ancestry'] or '').split('/')))
 
-    @classmethod
-    async def fetch(cls, record: dict, table: tables.TableConfig, db: aiopg.Pool):
-        data = {}
-        async with db.acquire() as conn:
-            if record['pms_code_vetsuccess_id']:
-                data['code_tags'] = await cls.fetch_code_tags(record, table, conn)
-            if record['revenue_category_id']:
-                data['revenue_category'] = await cls.fetch_revenue_category(record, table, conn)
+        for code_tag_id in ancestors:
+            code_tags.extend(self.get_related_code_tags(code_tag_id))
 
-        return data
+        return sorted(code_tags, key=lambda r: r['id'])
 
-    @staticmethod
-    async def fetch_code_tags(record: dict, table: tables.TableConfig, conn: aiopg.Connection) -> list:
-        code_tags = []
+    def get_related_code_tags(self, code_tag_id: str) -> list:
+        if code_tag_id not in self.related_code_tags:
+            code_tag = self.code_tags.get(code_tag_id)
+            mappings = self.mappings_by_tag.get(code_tag_id) or [{'pms_code_vetsuccess_id': None, 'practice_id': None}]
+            self.related_code_tags[code_tag_id] = [] if code_tag is None else [
+                dict(code_tag, **mapping)
+                for mapping in mappings
+            ]
 
-        async with conn.cursor() as cur:
-            await cur.execute(table.get_code_tags_sql(record['pms_code_vetsuccess_id']))
+        return [dict(code_tag) for code_tag in self.related_code_tags[code_tag_id]]
 
-            column_names = [
-                column.name
-                for column in cur.description
-            ]
+    def get_revenue_category(self, revenue_category_id: int) -> typing.Optional[dict]:
+        for field in self.REVENUE_CATEGORY_FIELDS:
+            revenue_category = self.revenue_categories[field].get(revenue_category_id)
+            if revenue_category is not None:
+                return dict(revenue_category)
 
-            async for rawdata in cur:
-                code_tags.append(dict(zip(column_names, rawdata)))
+        return None
 
-            if code_tags:
-                ids = set(itertools.chain(*[
-                    code_tag['ancestry'].split('/')
-                    for code_tag in code_tags
-                ]))
-                await cur.execute(table.get_related_code_tags_sql(ids))
-                async for rawdata in cur:
-                    data = dict(zip(column_names, rawdata))
-                    code_tags.append(data)
 
-        return sorted(code_tags, key=lambda r: r['id'])
+class PoolRegistry:
+    """Redshift pools kept by DSN across import runs, a pool is created on
+    first use and replaced once it's closed. A pool isn't replaced on failed
+    queries, it may serve running imports, aiopg drops broken connections on
+    release and idle ones are recycled before Redshift drops them.
+    """
+    POOL_RECYCLE = 30 * 60
 
-    @staticmethod
-    async def fetch_revenue_category(record: dict, table: tables.TableConfig, conn: aiopg.Connection) -> dict:
-        revenue_category = None
-        async with conn.cursor() as cur:
-            for search_field in ('revenue_category_id', 'subset_of_level_2_id', 'subset_of_level_1_id'):
-                await cur.execute(table.get_revenue_category_sql(
-                    search_field,
-                    record['revenue_category_id']
-                ))
-
-                rawdata = await cur.fetchone()
-                if rawdata:
-                    column_names = [
-                        column.name
-                        for column in cur.description
-                    ]
-                    revenue_category = dict(zip(column_names, rawdata))
+    def __init__(self):
+        self.pools = {}
+        self.locks = collections.defaultdict(asyncio.Lock)
 
-                    break
+    async def get(self, dsn: str, size: int = None) -> aiopg.Pool:
+        async with self.locks[dsn]:
+            pool = self.pools.get(dsn)
+            if pool is None or pool.closed:
+                if pool is not None:
+                    logger.warning('replace closed Redshift pool')
+                pool = await self.create_pool(dsn, size)
+                self.pools[dsn] = pool
 
-        return revenue_category
+        return pool
 
+    async def create_pool(self, dsn: str, size: int = None) -> aiopg.Pool:
+        options = {'maxsize': size} if size else {}
 
-async def connect(dsn: str, redis: aioredis.ConnectionsPool) -> DB:
-    pool = await aiopg.create_pool(dsn, enable_hstore=False)
+        return await aiopg.create_pool(dsn, enable_hstore=False, pool_recycle=self.POOL_RECYCLE, **options)
 
-    return DB(pool, redis)
+    async def close(self):
+        pools, self.pools = list(self.pools.values()), {}
+        for pool in pools:
+            pool.close()
+        await asyncio.gather(*(pool.wait_closed() for pool in pools))
+
+
+async def connect(
+    dsn: str,
+    redis: aioredis.ConnectionsPool,
+    unloader: unload.Unloader = None,
+    concurrency: int = None,
+    pools: PoolRegistry = None,
+    pool_size: int = None
+) -> DB:
+    """DB over the pool of the registry, or over an own pool when there's no
+    registry, the own pool is closed by `DB.close`. The pool should fit the
+    connections of the concurrent table imports, see `DB.get_pool_size`,
+    otherwise the imports may wait for each other's connections forever
+    """
+    required = DB.get_pool_size(concurrency)
+    if pool_size is None:
+        pool_size = max(DB.POOL_SIZE, required)
+    elif pool_size < required:
+        raise ImproperPoolSize()
+
+    table_planner = planner.Planner(redis)
+    if pools is not None:
+        pool = await pools.get(dsn, pool_size)
+        return DB(pool, redis, unloader, concurrency, close_pool=False, table_planner=table_planner)
+
+    pool = await aiopg.create_pool(dsn, enable_hstore=False, maxsize=pool_size)
+
+    return DB(pool, redis, unloader, concurrency, table_planner=table_planner)
@@ -0,0 +1,112 @@
+import collections.abc
+import functools
+import typing
+from hashlib import blake2b, sha1
+import psycopg2.extensions
+
+
+DIGEST_SIZE = 8
+TEMPORAL_TYPES = (
+    psycopg2.extensions.PYDATETIME,
+    psycopg2.extensions.PYDATETIMETZ,
+    psycopg2.extensions.PYDATE,
+    psycopg2.extensions.PYTIME,
+)
+
+
+class Columns(list):
+    """Column names of the page which also keep type codes of the query description,
+    the same object is shared by all records of the page
+    """
+
+    def __init__(self, description: typing.Iterable):
+        description = list(description)
+        super().__init__(column.name for column in description)
+        self.type_codes = [column.type_code for column in description]
+        # the last one wins for duplicated names, as in dict(zip(...))
+        self.positions = {name: i for i, name in enumerate(self)}
+
+
+class Record(collections.abc.Mapping):
+    """Read-only mapping view of the row values, dict is built only when
+    the record is serialized. Assigned keys, like `_additionals`, are kept aside.
+    """
+    __slots__ = ('columns', 'values', 'extra')
+
+    def __init__(self, columns: Columns, values: typing.Sequence):
+        self.columns = columns
+        self.values = values
+        self.extra = None
+
+    def __getitem__(self, key: str) -> typing.Any:
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+
+        return self.values[self.columns.positions[key]]
+
+    def __setitem__(self, key: str, value: typing.Any):
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self.to_dict())
+
+    def __len__(self) -> int:
+        return len(self.to_dict())
+
+    def keys(self) -> typing.KeysView[str]:
+        return self.to_dict().keys()
+
+    def items(self) -> typing.ItemsView[str, typing.Any]:
+        return self.to_dict().items()
+
+    def to_dict(self) -> dict:
+        data = dict(zip(self.columns, self.values))
+        if self.extra is not None:
+            data.update(self.extra)
+
+        return data
+
+    def __repr__(self) -> str:
+        return f'Record({self.to_dict()!r})'
+
+
+class RowEncoder:
+    """Canonical form of the rows for change detection. Values keep type tags of
+    their repr and strings are quoted and escaped, so different rows can't produce
+    the same bytes. Date and time columns, picked by type codes of the query
+    description, are replaced with their binary pickle state which is several
+    times cheaper than formatting them.
+    """
+
+    def __init__(self, type_codes: typing.Iterable[int], digest_size: int = DIGEST_SIZE):
+        type_codes = tuple(type_codes)
+        self.type_codes = type_codes
+        self.temporal = [
+            i for i, type_code in enumerate(type_codes)
+            if any(type_code in typ.values for typ in TEMPORAL_TYPES)
+        ]
+        self.digest_size = digest_size
+
+    def encode(self, row: typing.Sequence) -> bytes:
+        values = list(row)
+        for i in self.temporal:
+            if values[i] is not None:
+                # (state bytes, ) or (state bytes, tzinfo)
+                values[i] = values[i].__reduce__()[1]
+
+        return repr(values).encode('utf-8')
+
+    def digest(self, row: typing.Sequence) -> bytes:
+        return blake2b(self.encode(row), digest_size=self.digest_size).digest()
+
+
+@functools.lru_cache(maxsize=None)
+def get_row_encoder(type_codes: typing.Tuple[int, ...], digest_size: int = DIGEST_SIZE) -> RowEncoder:
+    return RowEncoder(type_codes, digest_size)
+
+
+def legacy_digest(row: typing.Iterable, digest_size: int = DIGEST_SIZE) -> bytes:
+    """Checksum of the rows saved before the binary encoding"""
+    return sha1(':'.join(map(str, row)).encode('utf-8')).digest()[:digest_size]
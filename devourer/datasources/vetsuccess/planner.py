@@ -0,0 +1,203 @@
+import json
+import logging
+import time
+import typing
+import aioredis
+
+from . import tables
+
+
+logger = logging.getLogger('devourer.datasource.vetsuccess')
+
+
+class TableStats:
+    """Stats of the table scans, `quiet` counts scans without changes in a row
+    and `skipped` counts runs the table was skipped since its last scan
+    """
+    FIELDS = ('runs', 'quiet', 'skipped', 'scanned', 'changed', 'duration', 'fingerprint', 'updated')
+
+    def __init__(
+        self,
+        runs: int = 0,
+        quiet: int = 0,
+        skipped: int = 0,
+        scanned: int = 0,
+        changed: int = 0,
+        duration: float = None,
+        fingerprint: list = None,
+        updated: float = None
+    ):
+        self.runs = runs
+        self.quiet = quiet
+        self.skipped = skipped
+        self.scanned = scanned
+        self.changed = changed
+        self.duration = duration
+        self.fingerprint = fingerprint
+        self.updated = updated
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class Decision:
+    NEW = 'new'
+    INCREMENTAL = 'incremental'
+    HOT = 'hot'
+    DUE = 'due'
+    FINGERPRINT = 'fingerprint'
+    UNCHANGED = 'unchanged'
+    STATIC = 'static'
+
+    def __init__(
+        self,
+        table_name: str,
+        run: bool,
+        reason: str,
+        interval: int = 1,
+        stats: TableStats = None,
+        fingerprint: list = None
+    ):
+        self.table_name = table_name
+        self.run = run
+        self.reason = reason
+        self.interval = interval
+        self.stats = stats
+        self.fingerprint = fingerprint
+
+    def get_duration(self) -> float:
+        """Expected scan duration, tables without stats are expected to be the longest"""
+        if self.stats is None or self.stats.duration is None:
+            return float('inf')
+
+        return self.stats.duration
+
+    def to_dict(self) -> dict:
+        return {
+            'table': self.table_name,
+            'run': self.run,
+            'reason': self.reason,
+            'interval': self.interval,
+            'stats': None if self.stats is None else self.stats.to_dict(),
+            'fingerprint': self.fingerprint,
+        }
+
+    def __str__(self):
+        action = 'scan' if self.run else 'skip'
+        skipped = 0 if self.stats is None else self.stats.skipped
+
+        return (
+            f'{action} {self.table_name} ({self.reason}), every {self.interval} run, '
+            f'skipped {skipped}, expected {self.get_duration():.1f} sec'
+        )
+
+
+class Planner:
+    """Scan frequency and order of the tables by stats of their previous scans.
+
+    A checksum table whose fingerprint matches the one taken before its last
+    scan is unchanged and skipped, but it's scanned anyway after MAX_INTERVAL
+    runs. A checksum table without changes in QUIET_RUNS scans in a row is
+    static, it's scanned every `interval` run, the interval doubles with each
+    further quiet scan up to MAX_INTERVAL, or earlier when its fingerprint
+    changes. Timestamped tables are incremental and scanned every run.
+    Longest tables start first within the same priority.
+    """
+    QUIET_RUNS = 3
+    MAX_INTERVAL = 8
+    # weight of the last scan duration in the expected duration
+    SMOOTHING = 0.5
+
+    def __init__(self, redis: aioredis.ConnectionsPool):
+        self.redis = redis
+
+    @staticmethod
+    def get_key(table_name: str) -> str:
+        return f'devourer.datasource.versuccess.stats-{table_name}'
+
+    async def get_stats(self, table_name: str) -> typing.Optional[TableStats]:
+        value = await self.redis.get(self.get_key(table_name))
+        if value is None:
+            return None
+
+        return TableStats(**json.loads(value))
+
+    async def save_stats(self, table_name: str, stats: TableStats):
+        await self.redis.set(self.get_key(table_name), json.dumps(stats.to_dict(), default=str))
+
+    def get_interval(self, stats: TableStats) -> int:
+        if stats.quiet < self.QUIET_RUNS:
+            return 1
+
+        return min(2 ** (stats.quiet - self.QUIET_RUNS + 1), self.MAX_INTERVAL)
+
+    async def plan(
+        self,
+        items: typing.Iterable[typing.Tuple[tables.TableConfig, typing.Any]],
+        get_fingerprint: typing.Optional[typing.Callable[[tables.TableConfig], typing.Awaitable[list]]]
+    ) -> typing.List[typing.Tuple[tables.TableConfig, typing.Any, Decision]]:
+        """(table, additional data fetcher, decision) of the tables in scan order,
+        checksum tables are decided by their stats only without `get_fingerprint`
+        """
+        plan = []
+        for table, additional_data_fetcher in items:
+            plan.append((table, additional_data_fetcher, await self.decide(table, get_fingerprint)))
+
+        return sorted(plan, key=lambda item: (item[0].priority, item[2].get_duration()), reverse=True)
+
+    async def decide(
+        self,
+        table: tables.TableConfig,
+        get_fingerprint: typing.Optional[typing.Callable[[tables.TableConfig], typing.Awaitable[list]]]
+    ) -> Decision:
+        stats = await self.get_stats(table.name)
+        if stats is None:
+            return Decision(table.name, True, Decision.NEW)
+
+        if table.timestamp_column:
+            return Decision(table.name, True, Decision.INCREMENTAL, stats=stats)
+
+        interval = self.get_interval(stats)
+        fingerprint = None if get_fingerprint is None else await get_fingerprint(table)
+        unchanged = fingerprint is not None and stats.fingerprint == fingerprint
+        if unchanged and stats.skipped + 1 < self.MAX_INTERVAL:
+            return Decision(table.name, False, Decision.UNCHANGED, interval, stats, fingerprint)
+
+        if interval == 1:
+            reason = Decision.HOT
+        elif stats.skipped + 1 >= interval:
+            reason = Decision.DUE
+        elif get_fingerprint is not None and (fingerprint is None or stats.fingerprint is not None):
+            # fingerprint is changed or there're no checksums to compare with
+            reason = Decision.FINGERPRINT
+        else:
+            return Decision(table.name, False, Decision.STATIC, interval, stats, fingerprint)
+
+        return Decision(table.name, True, reason, interval, stats, fingerprint)
+
+    async def record(self, decision: Decision, scanned: int, changed: int, duration: float):
+        """Update stats of the table after its scan is completed"""
+        stats = decision.stats or TableStats()
+        stats.runs += 1
+        stats.quiet = 0 if changed else stats.quiet + 1
+        stats.skipped = 0
+        stats.scanned = scanned
+        stats.changed = changed
+        if stats.duration is None:
+            stats.duration = duration
+        else:
+            stats.duration = self.SMOOTHING * duration + (1 - self.SMOOTHING) * stats.duration
+        if decision.fingerprint is not None:
+            stats.fingerprint = decision.fingerprint
+        stats.updated = time.time()
+
+        await self.save_stats(decision.table_name, stats)
+
+    async def record_skip(self, decision: Decision):
+        stats = decision.stats
+        stats.skipped += 1
+        if decision.fingerprint is not None:
+            stats.fingerprint = decision.fingerprint
+        stats.updated = time.time()
+
+        await self.save_stats(decision.table_name, stats)
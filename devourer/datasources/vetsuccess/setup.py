@@ -1,6 +1,7 @@
 import logging
+from aiohttp import web
 from devourer.core.datasource import setup
-from . import api
+from . import api, db
 
 
 logger = logging.getLogger('devourer.datasource.vetsuccess')
@@ -11,6 +12,17 @@ class DataSourceSetup(setup.DataSourceSetupAbstract):
     def __call__(self, customer_name: str):
         logger.info(f'{customer_name}: VetSuccess data source initialization')
 
-        self.app.add_routes([
-            self.to_route_view('', api.import_run, customer_name),
+        # pools are shared by customers and closed after jobs are cancelled
+        if 'redshift_pools' not in self.app:
+            self.app['redshift_pools'] = db.PoolRegistry()
+            self.app.on_shutdown.append(close_pools)
+
+        self.app.add_routes(self.to_job_route_views('', api.import_run, customer_name) + [
+            self.to_route_view('schema', api.table_schema, customer_name),
+            self.to_route_view('plan', api.table_plan, customer_name),
+            self.to_route_view('history', api.import_history, customer_name),
         ])
+
+
+async def close_pools(app: web.Application):
+    await app['redshift_pools'].close()
@@ -1,15 +1,49 @@
+import enum
 import typing
+import psycopg2.extensions
 
 from devourer.core.datasource import exceptions
 
 
+CHECKSUM_ALIAS = 'devourer_checksum'
+BUCKET_ALIAS = 'devourer_bucket'
+
+
 class ImproperTableConfig(exceptions.DataSourceException):
     message = 'Table config should have timestamp or checksum column'
 
 
+class SchemaNotLoaded(exceptions.DataSourceException):
+    message = 'Table schema should be loaded to exclude columns'
+
+
+class FetchStrategy(enum.Enum):
+    OFFSET = 'offset'
+    KEYSET = 'keyset'
+    CURSOR = 'cursor'
+
+
 class TableConfig:
 
-    def __init__(self, name: str, timestamp_column: str = None, checksum_column: str = None, order_by: str = 'id'):
+    def __init__(
+        self,
+        name: str,
+        timestamp_column: str = None,
+        checksum_column: str = None,
+        order_by: str = 'id',
+        page_size: int = None,
+        strategy: FetchStrategy = FetchStrategy.KEYSET,
+        priority: int = 0,
+        partitions: int = 1,
+        checksum_pushdown: bool = False,
+        fingerprint_buckets: int = None,
+        checksum_cache: bool = False,
+        columnar: bool = False,
+        columns: typing.Sequence[str] = None,
+        exclude_columns: typing.Sequence[str] = (),
+        read_ahead: int = None,
+        nullable_columns: typing.Sequence[str] = ()
+    ):
         if not any((timestamp_column, checksum_column)):
             raise ImproperTableConfig()
 
@@ -17,71 +51,279 @@ class TableConfig:
         self.timestamp_column = timestamp_column
         self.checksum_column = checksum_column
         self.order_by = order_by
+        self.page_size = page_size
+        self.strategy = strategy
+        self.priority = priority
+        self.partitions = partitions
+        self.checksum_pushdown = checksum_pushdown
+        self.fingerprint_buckets = fingerprint_buckets
+        self.checksum_cache = checksum_cache
+        self.columnar = columnar
+        self.columns = columns
+        self.exclude_columns = exclude_columns
+        self.schema = None
+        self.read_ahead = read_ahead
+        # key columns which may be NULL, keyset pagination sorts their NULLs last and pages through them
+        self.nullable_columns = nullable_columns
+
+    def get_sql(self, after: tuple = None, partition: tuple = None) -> str:
+        return (
+            f'SELECT {self.get_select()} FROM {self.get_from()} '
+            f'{self.get_where_clause(after, partition)}'
+            f'ORDER BY {self.get_order_by()} '
+        )
+
+    def get_checksum_sql(
+        self,
+        columns: typing.List[tuple],
+        after: tuple = None,
+        partition: tuple = None,
+        buckets: bool = False
+    ) -> str:
+        """Query of the sort key columns with MD5 of the whole row computed by Redshift,
+        `columns` are (name, type_code) pairs of the table query description,
+        `buckets` limits rows to fingerprint buckets passed in the query params
+        """
+        keys = ', '.join(self.get_column_expression(column) for column in self.get_key_columns())
+        conditions = self.get_conditions(after, partition)
+        if buckets:
+            conditions.append(f'{self.get_bucket_expression()} = ANY(%(buckets)s)')
+
+        return (
+            f'SELECT {keys}, {self.get_checksum_expression(columns)} AS {CHECKSUM_ALIAS} '
+            f'FROM {self.get_from()} '
+            f'{self.format_where_clause(conditions)}'
+            f'ORDER BY {self.get_order_by()} '
+        )
+
+    def get_fingerprint_sql(self, columns: typing.List[tuple]) -> str:
+        """Query of (bucket, rows count, sum of row hashes) fingerprints, order independent
+        so any changed, added or removed row changes the fingerprint of its bucket
+        """
+        row_hash = f'STRTOL(SUBSTRING({self.get_checksum_expression(columns)}, 1, 8), 16)'
+
+        return (
+            f'SELECT {self.get_bucket_expression()} AS {BUCKET_ALIAS}, COUNT(*), SUM({row_hash}) '
+            f'FROM {self.get_from()} '
+            f'{self.get_where_clause()}'
+            f'GROUP BY 1'
+        )
+
+    def get_table_fingerprint_sql(self, columns: typing.List[tuple]) -> str:
+        """Query of the rows count and sums of the row hash halves, 64 bits of hash
+        in total, order independent like the bucket fingerprints of the table
+        """
+        checksum = self.get_checksum_expression(columns)
+        sums = ', '.join(f'SUM(STRTOL(SUBSTRING({checksum}, {start}, 8), 16))' for start in (1, 9))
+
+        return f'SELECT COUNT(*), {sums} FROM {self.get_from()} {self.get_where_clause()}'.rstrip()
+
+    def get_bucket_expression(self) -> str:
+        column = self.get_column_expression(self.checksum_column)
+
+        return (
+            f'MOD(STRTOL(SUBSTRING(MD5(CAST({column} AS VARCHAR(65535))), 1, 8), 16), {self.fingerprint_buckets})'
+        )
+
+    def get_checksum_expression(self, columns: typing.List[tuple]) -> str:
+        values = []
+        for name, type_code in dict(columns).items():
+            column = self.get_column_expression(name)
+            if type_code in psycopg2.extensions.BOOLEAN.values:
+                # Redshift can't cast boolean to varchar
+                value = f"CASE WHEN {column} THEN 't' WHEN NOT {column} THEN 'f' END"
+            else:
+                value = f'CAST({column} AS VARCHAR(65535))'
+            values.append(f"COALESCE({value}, '\\N')")
+
+        return 'MD5({})'.format(" || ':' || ".join(values))
+
+    def get_rows_by_pk_sql(self) -> str:
+        conditions = self.get_conditions() + [f'{self.get_column_expression(self.checksum_column)} = ANY(%(pks)s)']
+
+        return (
+            f'SELECT {self.get_select()} FROM {self.get_from()} '
+            f'WHERE {" AND ".join(conditions)} '
+            f'ORDER BY {self.get_order_by()} '
+        )
+
+    def get_partition_probe_sql(self) -> str:
+        """Query of the partition column percentiles which split the table into equal ranges"""
+        column = self.get_column_expression(self.get_key_columns()[0])
+        percentiles = ', '.join(
+            f'PERCENTILE_DISC({i / self.partitions:.4f}) WITHIN GROUP (ORDER BY {column})'
+            for i in range(1, self.partitions)
+        )
+
+        return f'SELECT {percentiles} FROM {self.get_from()} {self.get_where_clause()}'
+
+    def get_schema_sql(self) -> str:
+        return f'SELECT * FROM external.{self.name} LIMIT 0'
+
+    def set_schema(self, column_names: typing.Iterable[str]):
+        self.schema = list(column_names)
+
+    def get_columns(self) -> typing.Optional[typing.List[str]]:
+        """Selected columns, None selects all of them. Excluded columns are
+        removed from `columns` or from the loaded schema, key columns are
+        always selected
+        """
+        columns = self.columns
+        if columns is None and self.exclude_columns:
+            if self.schema is None:
+                raise SchemaNotLoaded()
+            columns = self.schema
+        if columns is None:
+            return None
 
-    def get_sql(self) -> str:
-        sql = None
+        keys = [self.checksum_column, self.timestamp_column] + list(self.get_key_columns())
+        columns = [column for column in columns if column not in self.exclude_columns]
+
+        return list(dict.fromkeys([key for key in keys if key is not None] + columns))
+
+    def get_select(self) -> str:
+        columns = self.get_columns()
+        if columns is None:
+            return '*'
+
+        return ', '.join(self.get_column_expression(column) for column in columns)
+
+    def get_from(self) -> str:
+        return f'external.{self.name}'
+
+    def get_conditions(self, after: tuple = None, partition: tuple = None) -> typing.List[str]:
+        conditions = []
+        if after is not None:
+            conditions.append(self.get_keyset_condition(
+                [self.get_column_expression(column) for column in self.get_key_columns()],
+                after,
+                [self.get_column_expression(column) for column in self.nullable_columns]
+            ))
+        elif self.timestamp_column:
+            conditions.append(f'{self.get_column_expression(self.timestamp_column)} >= %(timestamp)s')
+
+        if partition is not None:
+            column = self.get_column_expression(self.get_key_columns()[0])
+            lower, upper = partition
+            if lower is not None:
+                condition = f'{column} > %(partition_lower)s'
+                if self.get_key_columns()[0] in self.nullable_columns:
+                    # NULLs sort last, so they belong to the last range
+                    condition = f'({condition} OR {column} IS NULL)'
+                conditions.append(condition)
+            if upper is not None:
+                conditions.append(f'{column} <= %(partition_upper)s')
+
+        return conditions
+
+    def get_where_clause(self, after: tuple = None, partition: tuple = None) -> str:
+        return self.format_where_clause(self.get_conditions(after, partition))
+
+    @staticmethod
+    def format_where_clause(conditions: typing.List[str]) -> str:
+        if not conditions:
+            return ''
+
+        return 'WHERE {} '.format(' AND '.join(conditions))
+
+    def get_order_by(self) -> str:
+        return ', '.join(
+            f'{self.get_column_expression(column)} NULLS LAST' if column in self.nullable_columns
+            else self.get_column_expression(column)
+            for column in self.get_key_columns()
+        )
+
+    def get_column_expression(self, column: str) -> str:
+        return column
+
+    def get_key_columns(self) -> typing.Tuple[str, ...]:
+        """Columns which make the unique sort key of the table, used for keyset pagination"""
         if self.timestamp_column:
-            sql = (
-                f'SELECT * FROM external.{self.name} '
-                f"WHERE {self.timestamp_column} >= '%(timestamp)s'::timestamp "
-                f'ORDER BY {self.order_by} '
-            )
-        else:
-            sql = (
-                f'SELECT * FROM external.{self.name} '
-                f'ORDER BY {self.order_by} '
-            )
+            return (self.timestamp_column, self.order_by)
+
+        if self.order_by == self.checksum_column:
+            return (self.order_by, )
+
+        return (self.order_by, self.checksum_column)
+
+    def get_key(self, record: dict) -> tuple:
+        return tuple(record[column] for column in self.get_key_columns())
 
-        return sql
+    @staticmethod
+    def get_keyset_condition(
+        columns: typing.Sequence[str],
+        after: tuple = None,
+        nullable: typing.Collection[str] = ()
+    ) -> str:
+        """Build "(c1, c2, ...) > (k1, k2, ...)" predicate in expanded form,
+        Redshift doesn't support row value comparison. NULLs of the `nullable`
+        columns sort last, so they follow any value, and a NULL key is matched
+        by IS NULL with nothing after it
+        """
+        def equals(j: int, column: str) -> str:
+            if after is not None and after[j] is None:
+                return f'{column} IS NULL'
+
+            return f'{column} = %(key_{j})s'
+
+        conditions = []
+        for i, column in enumerate(columns):
+            if after is not None and after[i] is None:
+                continue
+
+            greater = f'{column} > %(key_{i})s'
+            if column in nullable:
+                greater = f'({greater} OR {column} IS NULL)'
+            conditions.append(' AND '.join([equals(j, prev) for j, prev in enumerate(columns[:i])] + [greater]))
+
+        return '({})'.format(' OR '.join(f'({condition})' for condition in conditions))
+
+    @staticmethod
+    def get_sql_params(after: tuple = None, partition: tuple = None, **kwargs) -> dict:
+        params = dict(kwargs)
+        if after is not None:
+            params.update({f'key_{i}': value for i, value in enumerate(after)})
+        if partition is not None:
+            params.update(partition_lower=partition[0], partition_upper=partition[1])
+
+        return params
 
 
 class PatientTableConfig(TableConfig):
 
-    def get_sql(self) -> str:
+    def get_select(self) -> str:
+        if self.get_columns() is not None:
+            return f'DISTINCT {super().get_select()}'
+
+        return f'DISTINCT {self.name}.vetsuccess_id, rel.client_vetsuccess_id, {self.name}.*'
+
+    def get_from(self) -> str:
         return (
-            f'SELECT DISTINCT {self.name}.vetsuccess_id, rel.client_vetsuccess_id, {self.name}.* '
-            f'FROM external.{self.name} '
+            f'external.{self.name} '
             f'INNER JOIN external.client_patient_relationships as rel ON '
-            f'  rel.patient_vetsuccess_id = {self.name}.vetsuccess_id AND rel.is_primary = \'true\' '
-            f'ORDER BY {self.order_by} '
+            f'  rel.patient_vetsuccess_id = {self.name}.vetsuccess_id AND rel.is_primary = \'true\''
         )
 
+    def get_column_expression(self, column: str) -> str:
+        if column == 'client_vetsuccess_id':
+            return f'rel.{column}'
+
+        return f'{self.name}.{column}'
+
 
 class PatientCoOwnerTableConfig(TableConfig):
 
-    def get_sql(self) -> str:
-        return (
-            f'SELECT {self.name}.* FROM external.{self.name} '
-            f'WHERE is_primary = \'false\' ORDER BY {self.order_by} '
-        )
+    def get_conditions(self, after: tuple = None, partition: tuple = None) -> typing.List[str]:
+        return ['is_primary = \'false\''] + super().get_conditions(after, partition)
 
 
 class CodeTableConfig(TableConfig):
 
-    def get_code_tags_sql(self, pms_code_vetsuccess_id: str) -> str:
-        return (
-            'SELECT '
-            '  code_tags.*, '
-            '  code_tag_mappings.pms_code_vetsuccess_id, '
-            ' code_tag_mappings.practice_id '
-            'FROM external.code_tags '
-            'LEFT OUTER JOIN external.code_tag_mappings ON code_tag_mappings.code_tag_id = code_tags.id '
-            'WHERE code_tag_mappings.pms_code_vetsuccess_id = \'{pk}\''
-        ).format(pk=pms_code_vetsuccess_id)
-
-    def get_related_code_tags_sql(self, ids: typing.List[str]) -> str:
-        return (
-            'SELECT '
-            '  code_tags.*, '
-            '  code_tag_mappings.pms_code_vetsuccess_id, '
-            '  code_tag_mappings.practice_id '
-            'FROM external.code_tags '
-            'LEFT OUTER JOIN external.code_tag_mappings ON code_tag_mappings.code_tag_id = code_tags.id '
-            'WHERE code_tags.id = ANY(ARRAY[{ids}]); '
-        ).format(ids=', '.join(ids))
-
-    def get_revenue_category_sql(self, field, revenue_category_id: int) -> str:
-        return (
-            'SELECT * FROM external.revenue_categories_hierarchy '
-            'WHERE {field}={pk} '
-        ).format(field=field, pk=revenue_category_id)
+    def get_code_tags_sql(self) -> str:
+        return 'SELECT * FROM external.code_tags'
+
+    def get_code_tag_mappings_sql(self) -> str:
+        return 'SELECT code_tag_id, pms_code_vetsuccess_id, practice_id FROM external.code_tag_mappings'
+
+    def get_revenue_categories_sql(self) -> str:
+        return 'SELECT * FROM external.revenue_categories_hierarchy'
@@ -1,43 +1,135 @@
+import json
+import pytest
 from devourer import config
 from devourer.main import get_application
-from devourer.core import data_publish
+from devourer.core import data_publish, ledger
 from devourer.datasources.vetsuccess import db
 from devourer.utils import secret_manager
 
 
-async def test_import_run(aiohttp_client, monkeypatch):
-    log = []
+async def test_import_run(import_client):
+    client, log = import_client
+    resp = await client.get('/api/v1/import/test-customer/vetsuccess/')
 
-    class FakePublisher:
+    assert resp.status == 202
+    data = await resp.json()
+    assert (data['customer'], data['source']) == ('test-customer', 'vetsuccess')
+    assert resp.headers['Location'] == f'/api/v1/import/test-customer/vetsuccess/jobs/{data["id"]}'
 
-        def publish(self, msg):
-            log.append(('publish', msg))
+    await client.server.app['jobs'].wait(data['id'])
 
-        def exit(self):
-            log.append('publisher.exit')
+    resp = await client.get(resp.headers['Location'])
+    assert resp.status == 200
+    data = await resp.json()
+    assert data['status'] == 'done'
+    assert (data['fetched'], data['published']) == (3, 3)
+
+    assert [entry for entry in log if entry[0] != 'ledger'] == [
+        (
+            'publish',
+            {
+                'meta': {'customer': 'test-customer', 'data_source': 'vetsuccess', 'table_name': 'test_table'},
+                'data': value,
+            },
+        )
+        for value in (1, 2, 3)
+    ] + ['db.close', 'publisher.exit', 'publisher.wait']
 
-        def wait(self):
-            log.append('publisher.wait')
 
-    class DB:
+async def test_import_run_failed(import_client, monkeypatch):
+    client, log = import_client
 
-        async def get_updates(self):
-            for i in (1, 2, 3):
-                yield ('test_table', i)
+    async def get_batches(self):
+        yield ('test_table', [1])
+        raise ValueError('broken')
 
-        async def close(self):
-            ...
+    monkeypatch.setattr(FakeDB, 'get_batches', get_batches)
+    resp = await client.get('/api/v1/import/test-customer/vetsuccess/')
+    job_id = (await resp.json())['id']
+    await client.server.app['jobs'].wait(job_id)
 
-    class FakeSecretManger:
+    job = client.server.app['jobs'].get(job_id)
+    assert (job.status, job.error) == ('failed', 'broken')
+    # the publisher and the connection are released by a failed run too, and its tables are recorded
+    assert [entry for entry in log if isinstance(entry, str)] == ['db.close', 'publisher.exit', 'publisher.wait']
+    assert [entry[2]['table'] for entry in log if entry[0] == 'ledger'] == ['test_table']
 
-        def __init__(self, project):
-            ...
 
-        def get_secret(self, name):
-            return {'vetsuccess': {'redshift_dsn': 'test-dsn'}}
+async def test_import_run_publish_failed(import_client, monkeypatch):
+    client, log = import_client
 
-    async def connect(dsn, redis):
-        return DB()
+    def publish_messages(self, msgs, bulk=False):
+        raise ValueError('publish failed')
+
+    async def batches(conn):
+        try:
+            yield ('test_table', [1])
+            yield ('test_table', [2])
+        finally:
+            conn.table_runs = [{'table': 'test_table', 'status': 'cancelled'}]
+
+    def get_batches(self):
+        # the running imports are referenced by the connection, like merge tasks of DB
+        self.batches = batches(self)
+        return self.batches
+
+    monkeypatch.setattr(FakePublisher, 'publish_messages', publish_messages)
+    monkeypatch.setattr(FakeDB, 'get_batches', get_batches)
+    resp = await client.get('/api/v1/import/test-customer/vetsuccess/')
+    job_id = (await resp.json())['id']
+    await client.server.app['jobs'].wait(job_id)
+
+    job = client.server.app['jobs'].get(job_id)
+    assert (job.status, job.error) == ('failed', 'publish failed')
+    # the import is stopped before the ledger is written, so its table is recorded as cancelled
+    assert [entry[2] for entry in log if entry[0] == 'ledger'] == [
+        {'table': 'test_table', 'status': 'cancelled', 'run': job_id, 'bytes': 0, 'publish_time': 0},
+    ]
+
+
+async def test_import_run_ledger(import_client):
+    client, log = import_client
+    resp = await client.get('/api/v1/import/test-customer/vetsuccess/')
+    job_id = (await resp.json())['id']
+    await client.server.app['jobs'].wait(job_id)
+
+    published_bytes = sum(len(FakePublisher.serialize(entry[1])) for entry in log if entry[0] == 'publish')
+    assert [entry for entry in log if entry[0] == 'ledger'] == [
+        (
+            'ledger',
+            'devourer.ledger.vetsuccess-test-customer',
+            {
+                'table': 'test_table',
+                'scanned': 10,
+                'changed': 3,
+                'run': job_id,
+                'bytes': published_bytes,
+                'publish_time': pytest.approx(0, abs=0.1),
+            },
+        ),
+    ]
+
+
+@pytest.mark.parametrize('query, fingerprints', (('', False), ('?fingerprint=1', True)))
+async def test_table_plan(import_client, query, fingerprints):
+    client, log = import_client
+    resp = await client.get(f'/api/v1/import/test-customer/vetsuccess/plan{query}')
+
+    assert resp.status == 200
+    assert await resp.json() == [{'table': 'test_table'}]
+    assert log == [('plan', fingerprints), 'db.close']
+
+
+@pytest.fixture
+async def import_client(aiohttp_client, monkeypatch):
+    log = []
+
+    async def append(self, entry):
+        log.append(('ledger', self.get_storage_key(), entry))
+
+    async def connect(dsn, redis, unloader=None, concurrency=None, pools=None, pool_size=None):
+        assert isinstance(pools, db.PoolRegistry)
+        return FakeDB(log)
 
     monkeypatch.setattr(
         config,
@@ -50,36 +142,62 @@ async def test_import_run(aiohttp_client, monkeypatch):
     )
     monkeypatch.setattr(secret_manager, 'SecretManager', FakeSecretManger)
     monkeypatch.setattr(db, 'connect', connect)
-    monkeypatch.setattr(data_publish, 'DataPublisher', FakePublisher)
+    monkeypatch.setattr(data_publish, 'DataPublisher', lambda: FakePublisher(log))
+    monkeypatch.setattr(ledger.RunLedger, 'append', append)
 
     app = await get_application()
-    client = await aiohttp_client(app)
-    resp = await client.get('/api/v1/import/test-customer/vetsuccess/')
 
-    assert resp.status == 200
-    assert await resp.text() == ''
-    assert log == [
-        (
-            'publish',
-            {
-                'meta': {'customer': 'test-customer', 'data_source': 'vetsuccess', 'table_name': 'test_table'},
-                'data': 1,
-            },
-        ),
-        (
-            'publish',
-            {
-                'meta': {'customer': 'test-customer', 'data_source': 'vetsuccess', 'table_name': 'test_table'},
-                'data': 2,
-            },
-        ),
-        (
-            'publish',
-            {
-                'meta': {'customer': 'test-customer', 'data_source': 'vetsuccess', 'table_name': 'test_table'},
-                'data': 3,
-            },
-        ),
-        'publisher.exit',
-        'publisher.wait',
-    ]
+    return (await aiohttp_client(app), log)
+
+
+class FakePublisher:
+
+    def __init__(self, log):
+        self.log = log
+
+    def publish_messages(self, msgs, bulk=False):
+        for msg in msgs:
+            self.log.append(('publish', json.loads(msg)))
+
+    @staticmethod
+    def serialize(data):
+        return json.dumps(data).encode('utf-8')
+
+    def exit(self):
+        self.log.append('publisher.exit')
+
+    def wait(self):
+        self.log.append('publisher.wait')
+
+
+class FakeDB:
+    table_runs = [{'table': 'test_table', 'scanned': 10, 'changed': 3}]
+
+    def __init__(self, log):
+        self.log = log
+
+    async def get_batches(self):
+        yield ('test_table', [1, 2])
+        yield ('test_table', [3])
+
+    async def plan_tables(self, fingerprints=True):
+        self.log.append(('plan', fingerprints))
+        return [(None, None, FakeDecision())]
+
+    async def close(self):
+        self.log.append('db.close')
+
+
+class FakeDecision:
+
+    def to_dict(self):
+        return {'table': 'test_table'}
+
+
+class FakeSecretManger:
+
+    def __init__(self, project):
+        ...
+
+    def get_secret(self, name):
+        return {'vetsuccess': {'redshift_dsn': 'test-dsn'}}
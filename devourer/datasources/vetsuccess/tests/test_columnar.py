@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from devourer.datasources.vetsuccess import columnar
+
+
+TYPE_CODES = (23, 1043, 1700, 16, 1114, 1082, 701, 1184)
+ROW = (
+    1,
+    'Max',
+    Decimal('10.50'),
+    True,
+    datetime(2020, 1, 1, 10, 30),
+    date(2020, 1, 1),
+    1.5,
+    datetime(2020, 1, 1, 10, 30, tzinfo=timezone.utc),
+)
+
+
+def test_get_digests():
+    rows = [ROW, (2, ) + ROW[1:], ROW]
+    digests = columnar.get_digests(rows, TYPE_CODES)
+
+    assert digests.dtype == np.uint64
+    assert digests[0] == digests[2]
+    assert digests[0] != digests[1]
+    assert (columnar.get_digests(rows[:1], TYPE_CODES) == digests[:1]).all()
+    assert len(columnar.get_digests([], TYPE_CODES)) == 0
+
+
+@pytest.mark.parametrize('i, value', (
+    (0, None),
+    (1, 'Max '),
+    (1, 'None'),
+    (2, Decimal('10.5')),
+    (3, False),
+    (4, datetime(2020, 1, 1, 10, 30, 0, 1)),
+    (5, date(2020, 1, 2)),
+    (6, 1.5000001),
+    (7, datetime(2020, 1, 1, 10, 30, tzinfo=timezone(timedelta(hours=-5)))),
+))
+def test_changed_value(i, value):
+    changed = ROW[:i] + (value, ) + ROW[i + 1:]
+
+    assert len(set(columnar.get_digests([ROW, changed], TYPE_CODES))) == 2
+
+
+@pytest.mark.parametrize('row1, row2', (
+    (('a', 'bc'), ('ab', 'c')),
+    ((None, 'x'), ('None', 'x')),
+    (('x', None), (None, 'x')),
+    (('abcd', ''), ('abcd ', '')),
+    (('abcd', ''), ('abcd\x00', '')),
+))
+def test_no_collisions(row1, row2):
+    digests = columnar.get_digests([row1, row2], (1043, 1043))
+
+    assert digests[0] != digests[1]
+
+
+def test_hash_bytes_independent_of_page():
+    values = [b'a', b'abcdefghi', b'x' * 65536]
+
+    hashes = columnar.hash_bytes(values)
+
+    assert [columnar.hash_bytes([value])[0] for value in values] == hashes.tolist()
+    assert len(set(hashes.tolist())) == 3
+
+
+def test_pack_digests():
+    digests = columnar.get_digests([ROW, (2, ) + ROW[1:]], TYPE_CODES)
+    stored = [columnar.unpack_digest(digest) for digest in digests]
+
+    assert all(len(digest) == 8 for digest in stored)
+
+    packed, missing = columnar.pack_digests(stored + [None, b'legacy'])
+
+    assert (packed[:2] == digests).all()
+    assert missing.tolist() == [False, False, True, True]
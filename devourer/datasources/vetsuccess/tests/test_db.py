@@ -1,4 +1,12 @@
-from devourer.datasources.vetsuccess import db, tables
+import psycopg2
+import pytest
+from collections import namedtuple
+from decimal import Decimal
+
+from devourer.datasources.vetsuccess import db, planner, tables
+
+
+Column = namedtuple('Column', 'name type_code')
 
 
 def test_table_to_import():
@@ -123,7 +131,7 @@ def test_table_to_import():
 async def test_get_updates(monkeypatch):
     log = []
 
-    class FakeAdditionalFetcher:
+    class FakeAdditionalFetcher(db.AdditionalDataFetcher):
 
         @staticmethod
         async def fetch(data, *args):
@@ -148,7 +156,7 @@ async def test_get_updates(monkeypatch):
         FakeFetcher.build('checksum-fetcher', [{'id': 10}, {'id': 20}])
     )
 
-    _db = db.DB(None, None)
+    _db = db.DB(None, None, concurrency=1)
     monkeypatch.setattr(_db, 'get_tables', get_tables)
 
     result = []
@@ -164,6 +172,139 @@ async def test_get_updates(monkeypatch):
     assert log == ['additional_fetcher', 'additional_fetcher']
 
 
+async def test_get_batches_handoff(monkeypatch):
+    log = []
+
+    class CheckpointFetcher(FakeFetcher):
+
+        async def fetch_batches(self):
+            for record in self.data:
+                yield [record]
+                log.append(('checkpoint', record['id']))
+
+    monkeypatch.setattr(db, 'ChecksumTableFether', CheckpointFetcher.build('checksum-fetcher', [{'id': 1}, {'id': 2}]))
+
+    _db = db.DB(None, None)
+    monkeypatch.setattr(_db, 'get_tables', lambda: ((tables.TableConfig('test-checksum', None, 'id'), None), ))
+
+    async for _, batch in _db.get_batches():
+        log.append(('taken', batch[0]['id']))
+
+    # checksums and checkpoints of a batch are saved after the consumer takes it
+    assert log == [('taken', 1), ('checkpoint', 1), ('taken', 2), ('checkpoint', 2)]
+
+
+async def test_enrich():
+    log = []
+
+    async def batches():
+        for batch in ([0, 1, 2], [3, 4]):
+            log.append(('fetch', batch))
+            yield [{'id': i} for i in batch]
+
+    class FakeAdditionalFetcher(db.AdditionalDataFetcher):
+        BATCH_SIZE = 2
+
+        async def fetch_batch(self, records, table, conn):
+            log.append(('enrich', [record['id'] for record in records]))
+
+            return await super().fetch_batch(records, table, conn)
+
+        async def fetch(self, record, table, conn):
+            return record['id'] * 10
+
+    result = []
+    async for batch in db.DB(None, None).enrich(batches(), None, FakeAdditionalFetcher()):
+        log.append(('yield', [record['id'] for record in batch]))
+        result.extend(batch)
+
+    assert result == [{'id': i, '_additionals': i * 10} for i in range(5)]
+    # the next batch is requested once the whole batch is handed over
+    assert log == [
+        ('fetch', [0, 1, 2]),
+        ('enrich', [0, 1]),
+        ('enrich', [2]),
+        ('yield', [0, 1]),
+        ('yield', [2]),
+        ('fetch', [3, 4]),
+        ('enrich', [3, 4]),
+        ('yield', [3, 4]),
+    ]
+
+
+async def test_get_updates_priority(monkeypatch):
+    def get_tables():
+        return (
+            (tables.TableConfig('test-checksum', None, 'id'), None),
+            (tables.TableConfig('test-timestamped', 'updated_at', None, priority=10), None),
+        )
+
+    monkeypatch.setattr(db, 'TimestampedTableFetcher', FakeFetcher.build('timestampled-fetcher', [{'id': 1}]))
+    monkeypatch.setattr(db, 'ChecksumTableFether', FakeFetcher.build('checksum-fetcher', [{'id': 10}]))
+
+    _db = db.DB(None, None, concurrency=1)
+    monkeypatch.setattr(_db, 'get_tables', get_tables)
+
+    result = []
+    async for ret in _db.get_updates():
+        result.append(ret)
+
+    assert result == [
+        ('test-timestamped', {'id': 1}),
+        ('test-checksum', {'id': 10}),
+    ]
+
+
+async def test_get_schema(monkeypatch):
+    log = []
+
+    def get_tables():
+        return (
+            (tables.TableConfig('clients', None, 'id', exclude_columns=('notes', )), None),
+            (tables.TableConfig('phones', None, 'id', columns=('number', )), None),
+            (tables.TableConfig('sites', None, 'id'), None),
+        )
+
+    _db = db.DB(FakeDB(log), None)
+    monkeypatch.setattr(_db, 'get_tables', get_tables)
+
+    assert await _db.get_schema() == {
+        table: [
+            {'name': 'id', 'type_code': 23, 'selected': True},
+            {'name': 'number', 'type_code': 1043, 'selected': True},
+            {'name': 'notes', 'type_code': 1043, 'selected': table == 'sites'},
+        ]
+        for table in ('clients', 'phones', 'sites')
+    }
+    assert log == [
+        'SELECT * FROM external.clients LIMIT 0',
+        'SELECT * FROM external.phones LIMIT 0',
+        'SELECT * FROM external.sites LIMIT 0',
+    ]
+
+
+class FakeDB:
+
+    def __init__(self, log):
+        self.log = log
+        self.description = (Column('id', 23), Column('number', 1043), Column('notes', 1043))
+
+    def acquire(self):
+        return self
+
+    def cursor(self):
+        return self
+
+    async def execute(self, sql, params=None, timeout=None):
+        self.log.append(sql)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        ...
+
+
 class FakeFetcher:
 
     @classmethod
@@ -177,6 +318,213 @@ class FakeFetcher:
         self.name = name
         self.data = data
 
-    async def fetch(self):
-        for record in self.data:
-            yield record
+    def get_stats(self):
+        return {'scanned': 5, 'fetch_time': 0.5, 'checkpoint_before': None, 'checkpoint_after': None}
+
+    async def fetch_batches(self):
+        yield list(self.data)
+
+
+async def test_pool_registry(monkeypatch):
+    log = []
+
+    class FakePool(FakeDB):
+
+        def __init__(self, dsn, broken=False):
+            super().__init__(log)
+            self.dsn = dsn
+            self.broken = broken
+            self.closed = False
+
+        async def execute(self, sql, params=None, timeout=None):
+            log.append((self.dsn, sql))
+            if self.broken:
+                raise psycopg2.OperationalError()
+
+        def close(self):
+            log.append((self.dsn, 'close'))
+            self.closed = True
+
+        async def wait_closed(self):
+            log.append((self.dsn, 'wait_closed'))
+
+    async def create_pool(dsn, **kwargs):
+        log.append((dsn, 'create', kwargs.get('maxsize')))
+        return FakePool(dsn)
+
+    monkeypatch.setattr(db.aiopg, 'create_pool', create_pool)
+    pools = db.PoolRegistry()
+
+    first = await pools.get('dsn-1', 2)
+    # a pool with failing queries may serve a running import, it's kept
+    first.broken = True
+    assert await pools.get('dsn-1', 2) is first
+    await pools.get('dsn-2')
+
+    first.closed = True
+    replaced = await pools.get('dsn-1', 2)
+    assert replaced is not first
+
+    await pools.close()
+
+    assert log == [
+        ('dsn-1', 'create', 2),
+        ('dsn-2', 'create', None),
+        ('dsn-1', 'create', 2),
+        ('dsn-1', 'close'),
+        ('dsn-2', 'close'),
+        ('dsn-1', 'wait_closed'),
+        ('dsn-2', 'wait_closed'),
+    ]
+    assert pools.pools == {}
+
+
+async def test_connect_pool_size(monkeypatch):
+    log = []
+
+    class FakePools:
+
+        async def get(self, dsn, size=None):
+            log.append((dsn, size))
+
+    # normalized_transactions holds a connection of each of its 4 partitions
+    assert db.DB.get_pool_size(4) == 11
+    assert db.DB.get_pool_size(1) == 5
+
+    with pytest.raises(db.ImproperPoolSize):
+        await db.connect('dsn', None, concurrency=4, pools=FakePools(), pool_size=10)
+
+    await db.connect('dsn', None, concurrency=4, pools=FakePools(), pool_size=11)
+    await db.connect('dsn', None, concurrency=1, pools=FakePools())
+    await db.connect('dsn', None, pools=FakePools())
+
+    assert log == [('dsn', 11), ('dsn', db.DB.POOL_SIZE), ('dsn', 11)]
+
+
+async def test_close_shared_pool():
+    log = []
+
+    class FakePool:
+
+        def close(self):
+            log.append('close')
+
+        async def wait_closed(self):
+            log.append('wait_closed')
+
+    await db.DB(FakePool(), None, close_pool=False).close()
+    assert log == []
+
+    await db.DB(FakePool(), None).close()
+    assert log == ['close', 'wait_closed']
+
+
+async def test_get_updates_planned(monkeypatch):
+    log = []
+
+    class FakePlanner:
+
+        async def plan(self, items, get_fingerprint):
+            return [
+                (table, additional_data_fetcher, planner.Decision(table.name, table.name != 'test-static', 'test'))
+                for table, additional_data_fetcher in items
+            ]
+
+        async def record(self, decision, scanned, changed, duration):
+            log.append(('record', decision.table_name, scanned, changed))
+
+        async def record_skip(self, decision):
+            log.append(('record_skip', decision.table_name))
+
+    def get_tables():
+        return (
+            (tables.TableConfig('test-static', None, 'id'), None),
+            (tables.TableConfig('test-hot', None, 'id'), None),
+        )
+
+    monkeypatch.setattr(db, 'ChecksumTableFether', FakeFetcher.build('checksum-fetcher', [{'id': 10}, {'id': 20}]))
+
+    _db = db.DB(None, None, concurrency=1, table_planner=FakePlanner())
+    monkeypatch.setattr(_db, 'get_tables', get_tables)
+
+    result = []
+    async for ret in _db.get_updates():
+        result.append(ret)
+
+    assert result == [('test-hot', {'id': 10}), ('test-hot', {'id': 20})]
+    assert log == [('record_skip', 'test-static'), ('record', 'test-hot', 5, 2)]
+    assert [
+        {key: value for key, value in table_run.items() if key not in ('start', 'end')}
+        for table_run in _db.table_runs
+    ] == [
+        {
+            'table': 'test-hot',
+            'scanned': 5,
+            'changed': 2,
+            'fetch_time': 0.5,
+            'checkpoint_before': None,
+            'checkpoint_after': None,
+            'status': 'done',
+            'error': None,
+        },
+    ]
+
+
+async def test_import_table_failed(monkeypatch):
+    class FailedFetcher(FakeFetcher):
+
+        async def fetch_batches(self):
+            yield list(self.data)
+            raise ValueError('broken')
+
+    monkeypatch.setattr(db, 'ChecksumTableFether', FailedFetcher.build('checksum-fetcher', [{'id': 10}]))
+    _db = db.DB(None, None)
+
+    with pytest.raises(ValueError):
+        async for _ in _db.import_table(tables.TableConfig('test', None, 'id'), None):
+            ...
+
+    assert [(run['table'], run['changed'], run['status'], run['error']) for run in _db.table_runs] == [
+        ('test', 1, 'failed', 'broken'),
+    ]
+
+
+async def test_get_batches_closed(monkeypatch):
+    monkeypatch.setattr(db, 'ChecksumTableFether', FakeFetcher.build('checksum-fetcher', [{'id': 10}, {'id': 20}]))
+    _db = db.DB(None, None)
+    monkeypatch.setattr(_db, 'get_tables', lambda: ((tables.TableConfig('test', None, 'id'), None), ))
+
+    batches = _db.get_batches()
+    await batches.__anext__()
+    await batches.aclose()
+
+    # the stopped import is recorded by the time the run is closed
+    assert [(run['table'], run['status']) for run in _db.table_runs] == [('test', 'cancelled')]
+
+
+async def test_get_fingerprint():
+    log = []
+
+    class FakeRedis:
+
+        def __init__(self, exists):
+            self.exists_ = exists
+
+        async def exists(self, *keys):
+            return self.exists_
+
+    class FakeFingerprintDB(FakeDB):
+
+        async def fetchone(self):
+            return (3, Decimal('7'), Decimal('11'))
+
+    table = tables.TableConfig('test', None, 'id', columns=('id', 'number'))
+
+    assert await db.DB(FakeFingerprintDB(log), FakeRedis(0)).get_fingerprint(table) is None
+    assert log == []
+
+    assert await db.DB(FakeFingerprintDB(log), FakeRedis(1)).get_fingerprint(table) == ['3', '7', '11']
+    assert log == [
+        'SELECT id, number FROM external.test ORDER BY id  LIMIT 0',
+        table.get_table_fingerprint_sql([('id', 23), ('number', 1043), ('notes', 1043)]),
+    ]
@@ -1,3 +1,6 @@
+import asyncio
+import pytest
+
 from devourer.datasources.vetsuccess import db
 
 
@@ -16,8 +19,8 @@ async def test_sync_on_exit():
 
     assert len(redis_log) == 1
     assert redis_log[0][0] == 'hmset_dict'
-    assert redis_log[0][1] == 'devourer.datasource.versuccess.checksums-test'
-    assert redis_log[0][2] == {1: 'a', 2: 'b'}
+    assert redis_log[0][1] == 'devourer.datasource.versuccess.checksums.v2-test'
+    assert redis_log[0][2] == {b'\x01': 'a', b'\x02': 'b'}
 
 
 async def test_clear_update_on_sync():
@@ -46,3 +49,258 @@ def test_set_log_update():
         assert len(stor.updated) == i + 1
 
     assert stor.updated == updates
+
+
+@pytest.mark.parametrize('pk, expected', (
+    (1, b'\x01'),
+    (127, b'\x7f'),
+    (128, b'\x00\x80'),
+    (436728, b'\x06\xa9\xf8'),
+    (-1, b'\xff'),
+    ('436728', b'\x06\xa9\xf8'),
+    ('007', b'\x00007'),
+    ('2c9d0c1a-ad31', b'\x002c9d0c1a-ad31'),
+))
+def test_encode_pk(pk, expected):
+    assert db.ChecksumStorage.encode_pk(pk) == expected
+
+
+class FakePipelineRedis:
+
+    def __init__(self, data, log, legacy=None):
+        self.data = data
+        self.legacy = legacy or {}
+        self.log = log
+        self.futures = []
+
+    async def exists(self, *keys):
+        self.log.append(('exists', ) + keys)
+        return int(bool(self.legacy))
+
+    def pipeline(self):
+        return self
+
+    def hmget(self, key, *fields):
+        self.log.append(('hmget', key, fields))
+        data = self.legacy if key.endswith('checksums-test') else self.data
+        future = asyncio.get_event_loop().create_future()
+        self.futures.append((future, [data.get(field) for field in fields]))
+
+        return future
+
+    async def execute(self):
+        self.log.append('execute')
+        for future, result in self.futures:
+            future.set_result(result)
+        self.futures = []
+
+
+@pytest.mark.parametrize('cache, expected_log, expected_checksums', (
+    (
+        False,
+        [
+            ('hmget', 'devourer.datasource.versuccess.checksums.v2-test', (b'\x01', b'\x02')),
+            'execute',
+            ('hmget', 'devourer.datasource.versuccess.checksums.v2-test', (b'\x02', b'\x03')),
+            'execute',
+            ('exists', 'devourer.datasource.versuccess.checksums-test'),
+        ],
+        {b'\x02': b'b', b'\x03': None},
+    ),
+    (
+        True,
+        [
+            ('hmget', 'devourer.datasource.versuccess.checksums.v2-test', (b'\x01', b'\x02')),
+            'execute',
+            ('hmget', 'devourer.datasource.versuccess.checksums.v2-test', (b'\x03', )),
+            'execute',
+            ('exists', 'devourer.datasource.versuccess.checksums-test'),
+        ],
+        {b'\x01': b'a', b'\x02': b'b', b'\x03': None},
+    ),
+))
+async def test_load_page(cache, expected_log, expected_checksums):
+    log = []
+    stor = db.ChecksumStorage('test', FakePipelineRedis({b'\x01': b'a', b'\x02': b'b'}, log), cache)
+
+    await stor.load([1, 2])
+    assert stor.get(1) == b'a'
+    await stor.load([2, 3])
+
+    assert log == expected_log
+    assert stor.checksums == expected_checksums
+    assert stor.get(2) == b'b'
+    assert stor.get(3) is None
+
+
+async def test_load_page_chunks(monkeypatch):
+    log = []
+    monkeypatch.setattr(db.ChecksumStorage, 'THRESHOLD', 2)
+    stor = db.ChecksumStorage('test', FakePipelineRedis({}, log))
+    stor.legacy = False
+
+    await stor.load([1, 2, 3, 1])
+
+    assert log == [
+        ('hmget', 'devourer.datasource.versuccess.checksums.v2-test', (b'\x01', b'\x02')),
+        ('hmget', 'devourer.datasource.versuccess.checksums.v2-test', (b'\x03', )),
+        'execute',
+    ]
+
+
+async def test_load_page_legacy_fallback():
+    log = []
+    legacy = {'2': b'76ba9bcaaee3e7f329ad1b02f4a1808354ac9084'}
+    stor = db.ChecksumStorage('test', FakePipelineRedis({b'\x01': b'a'}, log, legacy))
+
+    await stor.load([1, 2, 3])
+
+    assert stor.checksums == {b'\x01': b'a', b'\x02': bytes.fromhex('76ba9bcaaee3e7f3'), b'\x03': None}
+    assert log[-2:] == [('hmget', 'devourer.datasource.versuccess.checksums-test', ('2', '3')), 'execute']
+
+
+async def test_set_updates_loaded_checksums():
+    stor = db.ChecksumStorage('test', FakePipelineRedis({b'\x01': b'a'}, []), cache=True)
+
+    await stor.load([1])
+    stor[1] = b'b'
+
+    assert stor.get(1) == b'b'
+    assert stor.updated == {1: b'b'}
+
+
+async def test_write_snapshot(monkeypatch):
+    log = []
+
+    class FakeRedis:
+
+        async def exists(self, *keys):
+            log.append(('exists', ) + keys)
+            return 0
+
+        def pipeline(self):
+            return self
+
+        def hmset_dict(self, key, _dict):
+            log.append(('hmset_dict', key, _dict))
+
+        async def execute(self):
+            log.append('execute')
+
+        async def set(self, key, value):
+            log.append(('set', key))
+
+    monkeypatch.setattr(db.ChecksumStorage, 'THRESHOLD', 2)
+    monkeypatch.setattr(db.ChecksumStorage, 'SNAPSHOT_THRESHOLD', 3)
+    stor = db.ChecksumStorage('test', FakeRedis())
+
+    assert not await stor.has_state()
+    await stor.write_snapshot([(1, b'a'), (2, b'b')])
+    assert log[1:] == []
+    await stor.write_snapshot([(3, b'c')])
+    await stor.write_snapshot([(4, b'd')])
+    await stor.mark_initialized()
+
+    key = 'devourer.datasource.versuccess.checksums.v2-test'
+    assert log == [
+        (
+            'exists',
+            key,
+            'devourer.datasource.versuccess.checksums-test',
+            'devourer.datasource.versuccess.initialized-test',
+        ),
+        ('hmset_dict', key, {b'\x01': b'a', b'\x02': b'b'}),
+        ('hmset_dict', key, {b'\x03': b'c'}),
+        'execute',
+        ('hmset_dict', key, {b'\x04': b'd'}),
+        'execute',
+        ('set', 'devourer.datasource.versuccess.initialized-test'),
+    ]
+
+
+class FakeMigrationRedis:
+
+    def __init__(self, data, progress=None):
+        self.data = data
+        self.progress = progress or {}
+        self.log = []
+
+    async def scan(self, cursor, match=None, count=None):
+        keys = sorted(key for key in self.data if key.startswith(match[:-1]))
+        return 0, [key.encode('utf-8') for key in keys]
+
+    async def hget(self, key, field):
+        return self.progress.get(field)
+
+    async def hscan(self, key, cursor, count=None):
+        items = sorted(self.data[key].items())[cursor:cursor + count]
+        cursor = cursor + count if cursor + count < len(self.data[key]) else 0
+
+        return cursor, [(pk.encode('utf-8'), checksum) for pk, checksum in items]
+
+    def pipeline(self):
+        return self
+
+    def multi_exec(self):
+        return self
+
+    def hsetnx(self, key, field, value):
+        self.data.setdefault(key, {}).setdefault(field, value)
+
+    def hset(self, key, field, value):
+        self.log.append(('progress', field, value))
+
+    def hdel(self, key, field):
+        self.log.append(('done', field))
+
+    def delete(self, key):
+        del self.data[key]
+
+    async def execute(self):
+        ...
+
+
+async def test_checksum_storage_migration(monkeypatch):
+    monkeypatch.setattr(db.ChecksumStorageMigration, 'BATCH_SIZE', 2)
+    legacy = {
+        '1': b'76ba9bcaaee3e7f329ad1b02f4a1808354ac9084',
+        '2': b'0e8a967ad386c1662068badaccdbeebfcdd7f9d3',
+        '3': b'0e8a967ad386c1662068badaccdbeebfcdd7f9d3',
+    }
+    redis = FakeMigrationRedis({
+        'devourer.datasource.versuccess.checksums-test': legacy,
+        'devourer.datasource.versuccess.checksums-other-2': {'a': b'00ff'},
+        'devourer.datasource.versuccess.checksums.v2-test': {b'\x01': b'fresh'},
+    })
+
+    migrated = await db.ChecksumStorageMigration(redis).run()
+
+    assert migrated == {
+        'devourer.datasource.versuccess.checksums-other-2': 1,
+        'devourer.datasource.versuccess.checksums-test': 3,
+    }
+    assert redis.data == {
+        'devourer.datasource.versuccess.checksums.v2-other': {b'\x00a': b'\x00\xff'},
+        'devourer.datasource.versuccess.checksums.v2-test': {
+            b'\x01': b'fresh',
+            b'\x02': bytes.fromhex('0e8a967ad386c166'),
+            b'\x03': bytes.fromhex('0e8a967ad386c166'),
+        },
+    }
+    assert redis.log == [
+        ('progress', 'devourer.datasource.versuccess.checksums-other-2', 0),
+        ('done', 'devourer.datasource.versuccess.checksums-other-2'),
+        ('progress', 'devourer.datasource.versuccess.checksums-test', 2),
+        ('progress', 'devourer.datasource.versuccess.checksums-test', 0),
+        ('done', 'devourer.datasource.versuccess.checksums-test'),
+    ]
+
+
+async def test_checksum_storage_migration_resume():
+    redis = FakeMigrationRedis(
+        {'devourer.datasource.versuccess.checksums-test': {'1': b'00', '2': b'01', '3': b'02'}},
+        {'devourer.datasource.versuccess.checksums-test': b'2'}
+    )
+
+    assert await db.ChecksumStorageMigration(redis).migrate('devourer.datasource.versuccess.checksums-test') == 1
+    assert redis.data == {'devourer.datasource.versuccess.checksums.v2-test': {b'\x03': b'\x02'}}
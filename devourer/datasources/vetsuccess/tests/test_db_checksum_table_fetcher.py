@@ -1,53 +1,44 @@
+import asyncio
 import pytest
 from collections import namedtuple
 from datetime import datetime
 
-from devourer.datasources.vetsuccess import db, tables
+from devourer.datasources.vetsuccess import columnar, db, encoding, tables
+
+
+ENCODER = encoding.RowEncoder((1043, 23, 1114))
+ROW = ('str', 42, datetime(2019, 11, 20, 11, 0))
+LEGACY = bytes.fromhex('76ba9bcaaee3e7f329ad1b02f4a1808354ac9084')[:8]
 
 
 @pytest.mark.parametrize(
-    'stor_data, input_data, expected',
+    'stored, row, verify_legacy, expected',
     (
-        (
-            {1: '76ba9bcaaee3e7f329ad1b02f4a1808354ac9084'},
-            (1, ('str', 42, datetime(2019, 11, 20, 11, 0)), ),
-            (True, '76ba9bcaaee3e7f329ad1b02f4a1808354ac9084'),
-        ),
-        (
-            {1: '76ba9bcaaee3e7f329ad1b02f4a1808354ac9084'},
-            (1, ('STR', 42, datetime(2019, 11, 20, 11, 0)), ),
-            (False, '0e8a967ad386c1662068badaccdbeebfcdd7f9d3'),
-        ),
-        (
-            {1: '76ba9bcaaee3e7f329ad1b02f4a1808354ac9084'},
-            (2, ('str', 42, datetime(2019, 11, 20, 11, 0)), ),
-            (False, '76ba9bcaaee3e7f329ad1b02f4a1808354ac9084'),
-        ),
+        (ENCODER.digest(ROW), ROW, True, (False, None)),
+        (LEGACY, ROW, True, (False, ENCODER.digest(ROW))),
+        (LEGACY, ROW, False, (True, ENCODER.digest(ROW))),
+        (LEGACY, ('STR', ) + ROW[1:], True, (True, ENCODER.digest(('STR', ) + ROW[1:]))),
+        (None, ROW, True, (True, ENCODER.digest(ROW))),
     )
 )
-async def test_is_changed(stor_data, input_data, expected):
-    log = []
+def test_compare(stored, row, verify_legacy, expected, monkeypatch):
+    fetcher = db.ChecksumTableFether(tables.TableConfig('test', None, 'id'), None, None)
+    monkeypatch.setattr(fetcher, 'VERIFY_LEGACY_CHECKSUMS', verify_legacy)
 
-    class FakeStorage:
+    assert fetcher.compare(stored, row, ENCODER) == expected
 
-        async def __getitem__(self, key):
-            return stor_data.get(key)
 
-        def __setitem__(self, key, value):
-            log.append(('new-value', key, value))
+def test_compare_columns():
+    fetcher = db.ChecksumTableFether(tables.TableConfig('test', None, 'id', columnar=True), None, None)
+    rows = [ROW, ('str', 43, ROW[2]), ('str', 44, ROW[2]), ('str', 45, ROW[2])]
+    digests = [columnar.unpack_digest(digest) for digest in columnar.get_digests(rows, ENCODER.type_codes)]
+    stored = [digests[0], ENCODER.digest(rows[1]), LEGACY, None]
 
-        async def set(self, key, value):
-            log.append(('new-value', key, value))
+    changed, checksums = fetcher.compare_columns(stored, rows, ENCODER)
 
-    stor = FakeStorage()
-    fetcher = db.ChecksumTableFether('test', None, None)
-
-    assert len(log) == 0
-    assert await fetcher.is_changed(stor, *input_data) == expected[0]
-    if expected[0]:
-        assert len(log) == 0
-    else:
-        assert log == [('new-value', input_data[0], expected[1])]
+    assert changed == [2, 3]
+    assert checksums == {1: digests[1], 2: digests[2], 3: digests[3]}
+    assert fetcher.compare_rows(stored, rows, ENCODER)[0] == [0, 2, 3]
 
 
 @pytest.mark.parametrize(
@@ -70,14 +61,14 @@ def test_checksum_column_normalization(input_data, expected):
             ((1, 'N1', 53), (2, 'N2', 103)),
             (True, True),
             [],
-            ['acquire', 'cursor', ('execute', 'SELECT * FROM external.test ORDER BY id  LIMIT 10000 OFFSET 0')],
+            ['acquire', 'cursor', ('execute', 'SELECT * FROM external.test ORDER BY id  LIMIT 10000', {})],
         ),
         (
             tables.TableConfig('testing', None, 'date', 'date'),
             ((1, 'N1', 53), (2, 'N2', 103)),
             (True, False),
             [{'date': 2, 'name': 'N2', 'amount': 103}, ],
-            ['acquire', 'cursor', ('execute', 'SELECT * FROM external.testing ORDER BY date  LIMIT 10000 OFFSET 0')],
+            ['acquire', 'cursor', ('execute', 'SELECT * FROM external.testing ORDER BY date  LIMIT 10000', {})],
         ),
     )
 )
@@ -87,15 +78,15 @@ async def test_fetch(tableconfig, input_data, is_changed_vals, expected_result,
     input_data = iter(input_data)
     is_changed_vals = iter(is_changed_vals)
 
-    async def fake_is_changed(stor, pk, data):
-        return next(is_changed_vals)
+    def fake_compare(stored, data, encoder):
+        return (not next(is_changed_vals), None)
 
     fetcher = db.ChecksumTableFether(
         tableconfig,
         FakeDB(tableconfig.checksum_column, input_data, log),
-        None
+        FakeRedis()
     )
-    monkeypatch.setattr(fetcher, 'is_changed', fake_is_changed)
+    monkeypatch.setattr(fetcher, 'compare', fake_compare)
 
     assert len(log) == 0
     data = []
@@ -106,15 +97,299 @@ async def test_fetch(tableconfig, input_data, is_changed_vals, expected_result,
     assert log == expected_log
 
 
-Column = namedtuple('Column', 'name')
+async def test_fetch_keyset_pagination(monkeypatch):
+    log = []
+
+    def fake_compare(stored, data, encoder):
+        return (True, None)
+
+    tableconfig = tables.TableConfig('test', None, 'id', 'client_id', page_size=2)
+    fetcher = db.ChecksumTableFether(
+        tableconfig,
+        FakeDB(
+            'id',
+            iter((((7, 'N1', 53), (3, 'N2', 103)), ((5, 'N3', 1), ))),
+            log,
+            columns=('id', 'client_id', 'amount'),
+            paged=True
+        ),
+        FakeRedis()
+    )
+    monkeypatch.setattr(fetcher, 'compare', fake_compare)
+
+    data = []
+    async for record in fetcher.fetch():
+        data.append(record['id'])
+
+    assert data == [7, 3, 5]
+    assert log == [
+        'acquire',
+        'cursor',
+        ('execute', 'SELECT * FROM external.test ORDER BY client_id, id  LIMIT 2', {}),
+        (
+            'execute',
+            (
+                'SELECT * FROM external.test '
+                'WHERE ((client_id > %(key_0)s) OR (client_id = %(key_0)s AND id > %(key_1)s)) '
+                'ORDER BY client_id, id  LIMIT 2'
+            ),
+            {'key_0': 'N2', 'key_1': 3},
+        ),
+    ]
+
+
+async def test_fetch_changed(monkeypatch):
+    log = []
+    stored = {1: 'h1', 2: 'old', 3: 'h3'}
+
+    class FakeStorage:
+
+        def __init__(self, *args):
+            ...
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, exc_type, exc_value, traceback):
+            ...
+
+        async def load(self, pks):
+            log.append(('load', list(pks)))
+
+        def get(self, key):
+            return stored.get(key)
+
+        async def update(self, checksums):
+            for key, value in checksums.items():
+                log.append(('set', key, value))
+
+        @staticmethod
+        def digest(checksum):
+            return checksum
+
+    monkeypatch.setattr(db, 'ChecksumStorage', FakeStorage)
+    cursor = FakeTwoPhaseCursor(
+        log,
+        [(1, 'h1'), (2, 'h2'), (3, 'h3'), (4, 'h4')],
+        {2: (2, 'N2', 10), 4: (4, 'N4', 20)}
+    )
+    fetcher = db.ChecksumTableFether(tables.TableConfig('test', None, 'id', checksum_pushdown=True), cursor, None)
+
+    data = []
+    async for record in fetcher.fetch():
+        data.append(record)
+
+    assert data == [{'id': 2, 'name': 'N2', 'amount': 10}, {'id': 4, 'name': 'N4', 'amount': 20}]
+    assert log == [
+        ('execute', 'SELECT * FROM external.test ORDER BY id  LIMIT 0', {}),
+        (
+            'execute',
+            (
+                'SELECT id, MD5('
+                "COALESCE(CAST(id AS VARCHAR(65535)), '\\N') || ':' || "
+                "COALESCE(CAST(name AS VARCHAR(65535)), '\\N') || ':' || "
+                "COALESCE(CAST(amount AS VARCHAR(65535)), '\\N')"
+                ') AS devourer_checksum FROM external.test ORDER BY id  LIMIT 10000'
+            ),
+            {},
+        ),
+        ('load', [1, 2, 3, 4]),
+        ('execute', 'SELECT * FROM external.test WHERE id = ANY(%(pks)s) ORDER BY id ', {'pks': [2, 4]}),
+        ('set', 2, 'h2'),
+        ('set', 4, 'h4'),
+    ]
+
+
+@pytest.mark.parametrize('stored, expected_buckets', (
+    ({'0': '2:10', '1': '1:5'}, []),
+    ({'0': '2:10', '1': '1:4'}, [1]),
+    ({'0': '2:10', '1': '1:5', '2': '1:7'}, [2]),
+    ({}, [0, 1]),
+))
+@pytest.mark.asyncio
+async def test_fingerprint_storage_get_changed_buckets(stored, expected_buckets):
+    log = []
+
+    class FakeRedis:
+
+        async def hgetall(self, key, encoding=None):
+            log.append(('hgetall', key))
+            return stored
+
+    class FakeCursor:
+
+        async def execute(self, sql, params=None, timeout=None):
+            log.append(('execute', sql))
+
+        async def fetchall(self):
+            return [(0, 2, 10), (1, 1, 5)]
+
+    table = tables.TableConfig('test', None, 'id', fingerprint_buckets=2)
+    stor = db.FingerprintStorage('test', FakeRedis())
+
+    buckets = await stor.get_changed_buckets(FakeCursor(), table, [('id', 23)])
+
+    assert buckets == expected_buckets
+    assert stor.fingerprints == {'0': '2:10', '1': '1:5'}
+    assert log == [
+        ('execute', table.get_fingerprint_sql([('id', 23)])),
+        ('hgetall', 'devourer.datasource.versuccess.fingerprints-test'),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_fetch_changed_buckets_unchanged(monkeypatch):
+    data, log = await fetch_changed_buckets([], monkeypatch)
+
+    assert data == []
+    assert log[1:] == [('get_changed_buckets', [('id', 23), ('name', 1043), ('amount', 23)])]
+
+
+@pytest.mark.asyncio
+async def test_fetch_changed_buckets(monkeypatch):
+    data, log = await fetch_changed_buckets([3, 7], monkeypatch)
+
+    assert [record['id'] for record in data] == [2, 4]
+    assert log[1] == ('get_changed_buckets', [('id', 23), ('name', 1043), ('amount', 23)])
+    sql, params = log[2][1:]
+    assert 'MOD(STRTOL(SUBSTRING(MD5(CAST(id AS VARCHAR(65535))), 1, 8), 16), 8) = ANY(%(buckets)s)' in sql
+    assert params == {'buckets': [3, 7]}
+    assert log[-1] == 'save'
+
+
+async def fetch_changed_buckets(changed_buckets, monkeypatch):
+    log = []
+    monkeypatch.setattr(db, 'ChecksumStorage', EmptyChecksumStorage)
+    monkeypatch.setattr(db, 'FingerprintStorage', FakeFingerprintStorage.build(log, changed_buckets))
+    cursor = FakeTwoPhaseCursor(log, [(2, 'h2'), (4, 'h4')], {2: (2, 'N2', 10), 4: (4, 'N4', 20)})
+    table = tables.TableConfig('test', None, 'id', checksum_pushdown=True, fingerprint_buckets=8)
+    fetcher = db.ChecksumTableFether(table, cursor, None)
+
+    data = []
+    async for record in fetcher.fetch():
+        data.append(record)
+
+    return data, log
+
+
+class EmptyChecksumStorage:
+    """No checksums are stored, every row is changed"""
+
+    def __init__(self, *args):
+        ...
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        ...
+
+    async def load(self, pks):
+        ...
+
+    def get(self, key):
+        return None
+
+    async def update(self, checksums):
+        ...
+
+    @staticmethod
+    def digest(checksum):
+        return checksum
+
+
+class FakeFingerprintStorage:
+
+    @classmethod
+    def build(cls, log, changed_buckets):
+        def builder(*args):
+            return cls(log, changed_buckets)
+
+        return builder
+
+    def __init__(self, log, changed_buckets):
+        self.log = log
+        self.changed_buckets = changed_buckets
+
+    async def get_changed_buckets(self, cur, table, columns):
+        self.log.append(('get_changed_buckets', columns))
+        return self.changed_buckets
+
+    async def save(self):
+        self.log.append('save')
+
+
+Column = namedtuple('Column', 'name type_code', defaults=(None, ))
+TypedColumn = namedtuple('TypedColumn', 'name type_code')
+
+
+class FakeTwoPhaseCursor:
+
+    def __init__(self, log, checksums, rows):
+        self.log = log
+        self.checksums = checksums
+        self.rows = rows
+        self.page = []
+        self.description = ()
+
+    def acquire(self):
+        return self
+
+    def cursor(self):
+        return self
+
+    async def execute(self, sql, params=None, timeout=None):
+        self.log.append(('execute', sql, params))
+        if 'LIMIT 0' in sql:
+            self.description = (TypedColumn('id', 23), TypedColumn('name', 1043), TypedColumn('amount', 23))
+            self.page = []
+        elif 'devourer_checksum' in sql:
+            self.description = (TypedColumn('id', 23), TypedColumn('devourer_checksum', 1043))
+            self.page = self.checksums
+        else:
+            self.description = (TypedColumn('id', 23), TypedColumn('name', 1043), TypedColumn('amount', 23))
+            self.page = [self.rows[pk] for pk in params['pks']]
+
+    async def fetchall(self):
+        return self.page
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        ...
+
+
+class FakeRedis:
+
+    async def exists(self, *keys):
+        # checksums are stored, the snapshot import isn't used
+        return 1
+
+    def pipeline(self):
+        return self
+
+    def hmget(self, key, *fields, encoding=None):
+        future = asyncio.get_event_loop().create_future()
+        future.set_result([None] * len(fields))
+
+        return future
+
+    async def execute(self):
+        ...
 
 
 class FakeDB:
 
-    def __init__(self, checksum_column, input_data, log):
+    def __init__(self, checksum_column, input_data, log, columns=None, paged=False):
         self.log = log
-        self.input_data = input_data
-        self.description = (Column(checksum_column), Column('name'), Column('amount'), )
+        self.paged = paged
+        self.pages = input_data
+        self.input_data = input_data if not paged else iter(())
+        self.description = tuple(
+            Column(name)
+            for name in (columns or (checksum_column, 'name', 'amount'))
+        )
 
     def acquire(self):
         self.log.append('acquire')
@@ -124,12 +399,14 @@ class FakeDB:
         self.log.append('cursor')
         return self
 
-    @property
-    def rowcount(self):
-        return 0
+    async def execute(self, sql, params=None, timeout=None):
+        self.log.append(('execute', sql, params))
+        if self.paged:
+            page = next(self.pages, ())
+            self.input_data = iter(page)
 
-    async def execute(self, sql):
-        self.log.append(('execute', sql))
+    async def fetchall(self):
+        return list(self.input_data)
 
     async def __aenter__(self):
         return self
@@ -137,11 +414,84 @@ class FakeDB:
     async def __aexit__(self, exc_type, exc_value, traceback):
         ...
 
-    def __aiter__(self):
-        return self
 
-    async def __anext__(self):
-        try:
-            return next(self.input_data)
-        except StopIteration:
-            raise StopAsyncIteration
+async def test_fetch_batches_pushdown_initial(monkeypatch):
+    class EmptyStorage(db.ChecksumStorage):
+
+        async def has_state(self):
+            return False
+
+        async def exists(self):
+            return False
+
+    async def fetch_changed():
+        yield [{'id': 1}]
+
+    def fetch_pages(initial, after=None, **params):
+        raise AssertionError('pushdown tables are fetched by Redshift checksums')
+
+    monkeypatch.setattr(db, 'ChecksumStorage', EmptyStorage)
+    table = tables.TableConfig('test', None, 'id', checksum_pushdown=True)
+    fetcher = db.ChecksumTableFether(table, None, FakeRedis(), object())
+    monkeypatch.setattr(fetcher, 'fetch_changed', fetch_changed)
+    monkeypatch.setattr(fetcher, 'fetch_pages', fetch_pages)
+
+    # the first import of a pushdown table stores Redshift checksums too, even with an unloader
+    assert [batch async for batch in fetcher.fetch_batches()] == [[{'id': 1}]]
+
+
+@pytest.mark.parametrize('is_columnar', (False, True))
+async def test_fetch_snapshot(is_columnar, monkeypatch):
+    log = []
+
+    class FakeStorage(db.ChecksumStorage):
+
+        async def has_state(self):
+            return False
+
+        async def write_snapshot(self, checksums):
+            log.append(('write_snapshot', dict(checksums)))
+
+        async def mark_initialized(self):
+            log.append('mark_initialized')
+
+    def fake_compare(stored, data, encoder):
+        raise AssertionError('snapshot rows are not compared')
+
+    monkeypatch.setattr(db, 'ChecksumStorage', FakeStorage)
+    tableconfig = tables.TableConfig('test', None, 'id', page_size=2, columnar=is_columnar)
+    rows = (((1, 'N1', 53), (2, 'N2', 103)), ((3, 'N3', 1), ))
+    fake_db = FakeDB('id', iter(rows), log, paged=True)
+    fake_db.description = (Column('id', 23), Column('name', 1043), Column('amount', 23))
+    fetcher = db.ChecksumTableFether(tableconfig, fake_db, FakeRedis())
+    monkeypatch.setattr(fetcher, 'compare', fake_compare)
+
+    batches = []
+    async for batch in fetcher.fetch_batches():
+        batches.append([record['id'] for record in batch])
+        log.append('batch')
+
+    type_codes = (23, 1043, 23)
+    encoder = encoding.get_row_encoder(type_codes, db.ChecksumStorage.DIGEST_SIZE)
+    if is_columnar:
+        expected = [
+            {
+                row[0]: columnar.unpack_digest(digest)
+                for row, digest in zip(page, columnar.get_digests(page, type_codes))
+            }
+            for page in rows
+        ]
+    else:
+        expected = [{row[0]: encoder.digest(row) for row in page} for page in rows]
+
+    assert batches == [[1, 2], [3]]
+    assert [entry for entry in log if entry[0] != 'execute'] == [
+        'acquire',
+        'cursor',
+        'batch',
+        ('write_snapshot', expected[0]),
+        'batch',
+        ('write_snapshot', expected[1]),
+        'mark_initialized',
+    ]
+    assert fetcher.get_stats()['snapshot'] is True
@@ -0,0 +1,165 @@
+import asyncio
+from collections import namedtuple
+
+from devourer.datasources.vetsuccess import db, tables
+
+
+Column = namedtuple('Column', 'name type_code', defaults=(None, ))
+
+
+CODE_TAGS = (
+    (1, 'Root', None),
+    (2, 'Vaccines', '1'),
+    (3, 'Rabies', '1/2'),
+    (4, 'Dental', '1'),
+)
+MAPPINGS = (
+    (2, 'code-a', 10),
+    (3, 'code-a', 10),
+    (4, 'code-b', 11),
+    (2, 'code-c', 12),
+)
+REVENUE_CATEGORIES = (
+    (100, 10, 1, 'Vaccines'),
+    (200, 20, 2, 'Dental'),
+)
+
+
+async def test_fetch():
+    log = []
+    fetcher = db.CodeAdditionalDataFetcher()
+    table = tables.CodeTableConfig('codes', None, 'vetsuccess_id')
+    conn = FakeDB(log)
+
+    data = []
+    for record in (
+        {'pms_code_vetsuccess_id': 'code-a', 'revenue_category_id': 100},
+        {'pms_code_vetsuccess_id': 'code-b', 'revenue_category_id': 20},
+        {'pms_code_vetsuccess_id': 'code-x', 'revenue_category_id': 2},
+        {'pms_code_vetsuccess_id': None, 'revenue_category_id': 5},
+    ):
+        data.append(await fetcher.fetch(record, table, conn))
+
+    assert log == [
+        'SELECT * FROM external.code_tags',
+        'SELECT code_tag_id, pms_code_vetsuccess_id, practice_id FROM external.code_tag_mappings',
+        'SELECT * FROM external.revenue_categories_hierarchy',
+    ]
+    assert data == [
+        {
+            'code_tags': [
+                {'id': 1, 'name': 'Root', 'ancestry': None, 'pms_code_vetsuccess_id': None, 'practice_id': None},
+                {'id': 2, 'name': 'Vaccines', 'ancestry': '1', 'pms_code_vetsuccess_id': 'code-a', 'practice_id': 10},
+                {'id': 2, 'name': 'Vaccines', 'ancestry': '1', 'pms_code_vetsuccess_id': 'code-a', 'practice_id': 10},
+                {'id': 2, 'name': 'Vaccines', 'ancestry': '1', 'pms_code_vetsuccess_id': 'code-c', 'practice_id': 12},
+                {'id': 3, 'name': 'Rabies', 'ancestry': '1/2', 'pms_code_vetsuccess_id': 'code-a', 'practice_id': 10},
+            ],
+            'revenue_category': {
+                'revenue_category_id': 100,
+                'subset_of_level_2_id': 10,
+                'subset_of_level_1_id': 1,
+                'name': 'Vaccines',
+            },
+        },
+        {
+            'code_tags': [
+                {'id': 1, 'name': 'Root', 'ancestry': None, 'pms_code_vetsuccess_id': None, 'practice_id': None},
+                {'id': 4, 'name': 'Dental', 'ancestry': '1', 'pms_code_vetsuccess_id': 'code-b', 'practice_id': 11},
+            ],
+            'revenue_category': {
+                'revenue_category_id': 200,
+                'subset_of_level_2_id': 20,
+                'subset_of_level_1_id': 2,
+                'name': 'Dental',
+            },
+        },
+        {
+            'code_tags': [],
+            'revenue_category': {
+                'revenue_category_id': 200,
+                'subset_of_level_2_id': 20,
+                'subset_of_level_1_id': 2,
+                'name': 'Dental',
+            },
+        },
+        {
+            'revenue_category': None,
+        },
+    ]
+
+
+async def test_enrich_loads_once(monkeypatch):
+    log = []
+    monkeypatch.setattr(db.CodeAdditionalDataFetcher, 'BATCH_SIZE', 1)
+    table = tables.CodeTableConfig('codes', None, 'vetsuccess_id')
+
+    async def batches():
+        yield [
+            {'pms_code_vetsuccess_id': 'code-b', 'revenue_category_id': None},
+            {'pms_code_vetsuccess_id': 'code-b', 'revenue_category_id': None},
+        ]
+
+    result = []
+    async for batch in db.DB(FakeDB(log), None).enrich(batches(), table, db.CodeAdditionalDataFetcher()):
+        result.extend(batch)
+
+    # chunks are enriched concurrently, the reference tables are loaded by one of them
+    assert len(log) == 3
+    assert [
+        [code_tag['id'] for code_tag in record['_additionals']['code_tags']]
+        for record in result
+    ] == [[1, 4], [1, 4]]
+
+
+async def test_related_code_tags_are_copies():
+    fetcher = db.CodeAdditionalDataFetcher()
+    fetcher.code_tags = {'1': {'id': 1, 'ancestry': None}}
+
+    related = fetcher.get_related_code_tags('1')
+    related[0]['id'] = 5
+
+    assert fetcher.get_related_code_tags('1') == [
+        {'id': 1, 'ancestry': None, 'pms_code_vetsuccess_id': None, 'practice_id': None}
+    ]
+
+
+class FakeDB:
+
+    def __init__(self, log):
+        self.log = log
+        self.description = ()
+        self.rows = ()
+
+    def acquire(self):
+        return self
+
+    def cursor(self):
+        return self
+
+    async def execute(self, sql, params=None, timeout=None):
+        self.log.append(sql)
+        # queries of aiopg yield to the event loop
+        await asyncio.sleep(0)
+        if 'code_tag_mappings' in sql:
+            self.description = (Column('code_tag_id'), Column('pms_code_vetsuccess_id'), Column('practice_id'))
+            self.rows = MAPPINGS
+        elif 'code_tags' in sql:
+            self.description = (Column('id'), Column('name'), Column('ancestry'))
+            self.rows = CODE_TAGS
+        else:
+            self.description = (
+                Column('revenue_category_id'),
+                Column('subset_of_level_2_id'),
+                Column('subset_of_level_1_id'),
+                Column('name'),
+            )
+            self.rows = REVENUE_CATEGORIES
+
+    async def fetchall(self):
+        return list(self.rows)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        ...
@@ -0,0 +1,236 @@
+import asyncio
+import json
+import pytest
+from collections import namedtuple
+
+from devourer.datasources.vetsuccess import db, tables
+
+
+@pytest.mark.parametrize(
+    'strategy, expected_log',
+    (
+        (
+            tables.FetchStrategy.OFFSET,
+            [
+                ('execute', 'SELECT * FROM external.test ORDER BY id  LIMIT 2 OFFSET 0', {}),
+                ('execute', 'SELECT * FROM external.test ORDER BY id  LIMIT 2 OFFSET 2', {}),
+            ],
+        ),
+        (
+            tables.FetchStrategy.KEYSET,
+            [
+                ('execute', 'SELECT * FROM external.test ORDER BY id  LIMIT 2', {}),
+                ('execute', 'SELECT * FROM external.test WHERE ((id > %(key_0)s)) ORDER BY id  LIMIT 2', {'key_0': 2}),
+            ],
+        ),
+        (
+            tables.FetchStrategy.CURSOR,
+            [
+                ('execute', 'BEGIN', None),
+                ('execute', 'DECLARE devourer_test NO SCROLL CURSOR FOR SELECT * FROM external.test ORDER BY id ', {}),
+                ('execute', 'FETCH FORWARD 2 FROM devourer_test', None),
+                ('execute', 'FETCH FORWARD 2 FROM devourer_test', None),
+                ('execute', 'CLOSE devourer_test', None),
+                ('execute', 'COMMIT', None),
+            ],
+        ),
+    )
+)
+async def test_fetch_pages(strategy, expected_log):
+    log = []
+    cur = FakeCursor(((1, 'N1'), (2, 'N2'), (3, 'N3')), 2, log)
+    fetcher = PageFetcher(tables.TableConfig('test', None, 'id', page_size=2, strategy=strategy), cur, None)
+
+    pages = []
+    async for column_names, rows in fetcher.fetch_pages():
+        assert column_names == ['id', 'name']
+        pages.append(rows)
+
+    assert pages == [[(1, 'N1'), (2, 'N2')], [(3, 'N3')]]
+    assert log == expected_log
+
+
+@pytest.mark.parametrize('read_ahead, expected_executes', ((0, 1), (1, 2)))
+async def test_fetch_pages_read_ahead(read_ahead, expected_executes):
+    log = []
+    cur = FakeCursor(((1, 'N1'), (2, 'N2'), (3, 'N3')), 2, log)
+    fetcher = PageFetcher(tables.TableConfig('test', None, 'id', page_size=2, read_ahead=read_ahead), cur, None)
+
+    pages = fetcher.fetch_pages()
+    await pages.__anext__()
+    await asyncio.sleep(0.01)
+
+    # the next page is fetched while the current one is consumed
+    assert len(log) == expected_executes
+    await pages.aclose()
+
+
+async def test_fetch_pages_cursor_rollback():
+    log = []
+    cur = FakeCursor(((1, 'N1'), (2, 'N2'), (3, 'N3')), 2, log)
+    fetcher = PageFetcher(
+        tables.TableConfig('test', None, 'id', page_size=2, strategy=tables.FetchStrategy.CURSOR),
+        cur,
+        None
+    )
+
+    pages = fetcher.fetch_pages()
+    await pages.__anext__()
+    await pages.aclose()
+
+    assert log[-1] == ('execute', 'ROLLBACK', None)
+
+
+@pytest.mark.parametrize(
+    'stored, expected_ranges, expected_sql',
+    (
+        (
+            {},
+            [[None, 2], [2, None]],
+            [
+                'SELECT PERCENTILE_DISC(0.5000) WITHIN GROUP (ORDER BY id) FROM external.test ',
+                'SELECT * FROM external.test WHERE id <= %(partition_upper)s ORDER BY id  LIMIT 2',
+                (
+                    'SELECT * FROM external.test WHERE ((id > %(key_0)s)) AND id <= %(partition_upper)s '
+                    'ORDER BY id  LIMIT 2'
+                ),
+                'SELECT * FROM external.test WHERE id > %(partition_lower)s ORDER BY id  LIMIT 2',
+            ],
+        ),
+        (
+            {
+                '0': '{"range": [null, 2], "after": null, "params": {}, "done": true}',
+                '1': '{"range": [2, null], "after": null, "params": {}, "done": false}',
+            },
+            [[None, 2], [2, None]],
+            [
+                'SELECT * FROM external.test WHERE id > %(partition_lower)s ORDER BY id  LIMIT 2',
+            ],
+        ),
+    )
+)
+async def test_fetch_partitioned_pages(stored, expected_ranges, expected_sql):
+    log = []
+    redis = FakeRedis(stored)
+    db_pool = FakePartitionedDB(((1, 'N1'), (2, 'N2'), (3, 'N3')), 2, log)
+    fetcher = PageFetcher(tables.TableConfig('test', None, 'id', page_size=2, partitions=2), db_pool, redis)
+
+    rows = []
+    async for column_names, page in fetcher.fetch_pages():
+        rows.extend(page)
+
+    assert sorted(entry[1] for entry in log) == sorted(expected_sql)
+    if not stored:
+        assert sorted(rows) == [(1, 'N1'), (2, 'N2'), (3, 'N3')]
+        assert [partition['range'] for partition in redis.history[0].values()] == expected_ranges
+    else:
+        assert rows == [(3, 'N3')]
+    assert redis.data == {}
+
+
+class PageFetcher(db.TableFetcher):
+
+    async def fetch_batches(self):
+        async for _, rows in self.fetch_pages():
+            yield rows
+
+
+Column = namedtuple('Column', 'name type_code', defaults=(None, ))
+
+
+class FakeRedis:
+
+    def __init__(self, data):
+        self.data = dict(data)
+        self.history = []
+
+    async def hgetall(self, key, encoding=None):
+        return dict(self.data)
+
+    async def hmset_dict(self, key, data):
+        self.data.update(data)
+        self.history.append({index: json.loads(value) for index, value in data.items()})
+
+    async def hset(self, key, field, value):
+        self.data[field] = value
+
+    async def delete(self, key):
+        self.data = {}
+
+
+class FakePartitionedDB:
+
+    def __init__(self, rows, page_size, log):
+        self.rows = rows
+        self.page_size = page_size
+        self.log = log
+
+    def acquire(self):
+        return FakePartitionedCursor(self)
+
+
+class FakePartitionedCursor:
+    description = (Column('id'), Column('name'))
+
+    def __init__(self, db):
+        self.db = db
+        self.page = []
+
+    def cursor(self):
+        return self
+
+    async def execute(self, sql, params=None, timeout=None):
+        self.db.log.append(('execute', sql, params))
+        if 'PERCENTILE_DISC' in sql:
+            self.page = [(2, )]
+            return
+
+        rows = [
+            row
+            for row in self.db.rows
+            if row[0] > (params.get('key_0') or params.get('partition_lower') or 0)
+            and row[0] <= (params.get('partition_upper') or 100)
+        ]
+        self.page = rows[:self.db.page_size]
+
+    async def fetchone(self):
+        return self.page[0]
+
+    async def fetchall(self):
+        return self.page
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        ...
+
+
+class FakeCursor:
+
+    def __init__(self, rows, page_size, log):
+        self.rows = list(rows)
+        self.page_size = page_size
+        self.log = log
+        self.page = []
+        self.description = (Column('id'), Column('name'))
+
+    async def execute(self, sql, params=None, timeout=None):
+        self.log.append(('execute', sql, params))
+        if sql.startswith(('SELECT', 'FETCH')):
+            self.page, self.rows = self.rows[:self.page_size], self.rows[self.page_size:]
+
+    async def fetchall(self):
+        return self.page
+
+    def acquire(self):
+        return self
+
+    def cursor(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        ...
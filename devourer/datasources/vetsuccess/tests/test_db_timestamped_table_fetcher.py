@@ -1,3 +1,4 @@
+import json
 import pytest
 from collections import namedtuple
 from datetime import datetime
@@ -6,10 +7,10 @@ from devourer.datasources.vetsuccess import db, tables
 
 
 TIMESTAMP = 1574346720  # 2019-11-21T16:32:00
-TIMESTAMP_DT = datetime.fromtimestamp(TIMESTAMP).strftime('%Y-%m-%dT%H:%M:%S')
+TIMESTAMP_DT = datetime.fromtimestamp(TIMESTAMP)
 
-TIMESTAMP_LINE_1 = "1574346730"
-TIMESTAMP_LINE_2 = "1574346732"  # +2 seconds
+TIMESTAMP_LINE_1 = datetime(2019, 11, 21, 16, 32, 10, 250000)
+TIMESTAMP_LINE_2 = datetime(2019, 11, 21, 16, 32, 12, 500)  # +2 seconds
 
 
 @pytest.mark.parametrize(
@@ -23,18 +24,19 @@ TIMESTAMP_LINE_2 = "1574346732"  # +2 seconds
                 {'id': 2, 'name': 'N2', 'amount': 103, 'update_at': TIMESTAMP_LINE_2}
             ],
             [
+                ('get', 'devourer.datasource.versuccess.timestamp-test'),
                 'acquire',
                 'cursor',
-                ('get', 'devourer.datasource.versuccess.timestamp-test'),
                 (
                     'execute',
                     (
-                        f"SELECT * FROM external.test "
-                        f"WHERE update_at >= '{TIMESTAMP_DT}'::timestamp "
-                        "ORDER BY id  LIMIT 500000 OFFSET 0"
+                        "SELECT * FROM external.test "
+                        "WHERE update_at >= %(timestamp)s "
+                        "ORDER BY update_at, id  LIMIT 500000"
                     ),
+                    {'timestamp': TIMESTAMP_DT},
                 ),
-                ('set', 'devourer.datasource.versuccess.timestamp-test', int(TIMESTAMP_LINE_2)),  # set last timestamp
+                ('set', 'devourer.datasource.versuccess.timestamp-test', '["2019-11-21 16:32:12.000500", 2]'),
             ],
         ),
         (
@@ -42,18 +44,19 @@ TIMESTAMP_LINE_2 = "1574346732"  # +2 seconds
             ((2, 'N2', 103, TIMESTAMP_LINE_1), ),
             [{'id': 2, 'name': 'N2', 'amount': 103, 'update_at': TIMESTAMP_LINE_1}, ],
             [
+                ('get', 'devourer.datasource.versuccess.timestamp-testing'),
                 'acquire',
                 'cursor',
-                ('get', 'devourer.datasource.versuccess.timestamp-testing'),
                 (
                     'execute',
                     (
                         "SELECT * FROM external.testing "
-                        f"WHERE update_at >= '{TIMESTAMP_DT}'::timestamp "
-                        "ORDER BY id  LIMIT 500000 OFFSET 0"
-                    )
+                        "WHERE update_at >= %(timestamp)s "
+                        "ORDER BY update_at, id  LIMIT 500000"
+                    ),
+                    {'timestamp': TIMESTAMP_DT},
                 ),
-                ('set', 'devourer.datasource.versuccess.timestamp-testing', int(TIMESTAMP_LINE_1)),
+                ('set', 'devourer.datasource.versuccess.timestamp-testing', '["2019-11-21 16:32:10.250000", 2]'),
             ],
         ),
     )
@@ -66,7 +69,7 @@ async def test_fetch(tableconfig, input_data, expected_result, expected_log):
     fetcher = db.TimestampedTableFetcher(
         tableconfig,
         FakeDB(input_data, log),
-        FakeRedis(log, 1574346720)
+        FakeRedis(log, b'1574346720')
     )
 
     assert len(log) == 0
@@ -78,6 +81,153 @@ async def test_fetch(tableconfig, input_data, expected_result, expected_log):
     assert log == expected_log
 
 
+async def test_fetch_keyset_pagination(monkeypatch):
+    log = []
+
+    monkeypatch.setattr(db.TimestampedTableFetcher, 'PAGE_SIZE', 2)
+    pages = iter((
+        ((1, 'N1', 53, TIMESTAMP_LINE_1), (2, 'N2', 103, TIMESTAMP_LINE_1)),
+        ((3, 'N3', 5, TIMESTAMP_LINE_2), ),
+    ))
+
+    fetcher = db.TimestampedTableFetcher(
+        tables.TableConfig('test', 'update_at', None),
+        FakeDB(pages, log, paged=True),
+        FakeRedis(log, b'1574346720')
+    )
+
+    data = []
+    async for record in fetcher.fetch():
+        data.append(record['id'])
+
+    assert data == [1, 2, 3]
+    assert [entry for entry in log if entry[0] == 'execute'] == [
+        (
+            'execute',
+            'SELECT * FROM external.test WHERE update_at >= %(timestamp)s ORDER BY update_at, id  LIMIT 2',
+            {'timestamp': TIMESTAMP_DT},
+        ),
+        (
+            'execute',
+            (
+                'SELECT * FROM external.test '
+                'WHERE ((update_at > %(key_0)s) OR (update_at = %(key_0)s AND id > %(key_1)s)) '
+                'ORDER BY update_at, id  LIMIT 2'
+            ),
+            {'timestamp': TIMESTAMP_DT, 'key_0': TIMESTAMP_LINE_1, 'key_1': 2},
+        ),
+    ]
+
+
+async def test_fetch_batches(monkeypatch):
+    log = []
+
+    monkeypatch.setattr(db.TimestampedTableFetcher, 'PAGE_SIZE', 2)
+    pages = iter((
+        ((1, 'N1', 53, TIMESTAMP_LINE_1), (2, 'N2', 103, TIMESTAMP_LINE_2)),
+        ((3, 'N3', 5, TIMESTAMP_LINE_2), ),
+    ))
+
+    fetcher = db.TimestampedTableFetcher(
+        tables.TableConfig('test', 'update_at', None),
+        FakeDB(pages, log, paged=True),
+        FakeRedis(log, b'1574346720')
+    )
+
+    batches = []
+    async for batch in fetcher.fetch_batches():
+        batches.append(batch)
+        log.append(('batch', [record['id'] for record in batch]))
+
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert batches[0][0].columns is batches[0][1].columns
+    assert [entry for entry in log if entry[0] in ('batch', 'set')] == [
+        ('batch', [1, 2]),
+        ('set', 'devourer.datasource.versuccess.timestamp-test', '["2019-11-21 16:32:12.000500", 2]'),
+        ('batch', [3]),
+        ('set', 'devourer.datasource.versuccess.timestamp-test', '["2019-11-21 16:32:12.000500", 3]'),
+    ]
+    assert fetcher.get_stats() == {
+        'scanned': 3,
+        'fetch_time': pytest.approx(0, abs=0.1),
+        'checkpoint_before': TIMESTAMP_DT,
+        'checkpoint_after': (TIMESTAMP_LINE_2, 3),
+    }
+
+
+async def test_fetch_resumes_after_checkpoint():
+    log = []
+    checkpoint = json.dumps([str(TIMESTAMP_LINE_1), 2])
+
+    fetcher = db.TimestampedTableFetcher(
+        tables.TableConfig('test', 'update_at', None),
+        FakeDB(iter(((3, 'N3', 5, TIMESTAMP_LINE_1), )), log),
+        FakeRedis(log, checkpoint.encode())
+    )
+
+    data = []
+    async for record in fetcher.fetch():
+        data.append(record['id'])
+
+    assert data == [3]
+    assert [entry for entry in log if entry[0] in ('execute', 'set')] == [
+        (
+            'execute',
+            (
+                'SELECT * FROM external.test '
+                'WHERE ((update_at > %(key_0)s) OR (update_at = %(key_0)s AND id > %(key_1)s)) '
+                'ORDER BY update_at, id  LIMIT 500000'
+            ),
+            {'timestamp': TIMESTAMP_LINE_1, 'key_0': TIMESTAMP_LINE_1, 'key_1': 2},
+        ),
+        ('set', 'devourer.datasource.versuccess.timestamp-test', '["2019-11-21 16:32:10.250000", 3]'),
+    ]
+
+
+async def test_fetch_bulk_checkpoint():
+    log = []
+
+    class FakeUnloader:
+
+        async def fetch_pages(self, table, cur, page_size, **params):
+            columns = db.encoding.Columns(cur.description)
+            # part files come back in no particular order
+            yield (columns, [(3, 'N3', 5, TIMESTAMP_LINE_2)])
+            yield (columns, [(1, 'N1', 53, TIMESTAMP_LINE_1)])
+
+    fetcher = db.TimestampedTableFetcher(
+        tables.TableConfig('test', 'update_at', None),
+        FakeDB(iter(()), log),
+        FakeRedis(log, None),
+        FakeUnloader()
+    )
+
+    async for batch in fetcher.fetch_batches():
+        log.append(('batch', [record['id'] for record in batch]))
+
+    assert [entry for entry in log if entry[0] in ('batch', 'set')] == [
+        ('batch', [3]),
+        ('batch', [1]),
+        ('set', 'devourer.datasource.versuccess.timestamp-test', '["2019-11-21 16:32:12.000500", 3]'),
+    ]
+
+
+async def test_checkpoint_keeps_greatest_key():
+    log = []
+    stor = db.TimestampStorage('test', FakeRedis(log, None))
+
+    assert await stor.get_checkpoint() == (db.TimestampStorage.INITIAL, None)
+
+    await stor.set_checkpoint((TIMESTAMP_LINE_2, 1))
+    await stor.set_checkpoint((TIMESTAMP_LINE_1, 5))
+
+    assert stor.checkpoint == (TIMESTAMP_LINE_2, 1)
+    assert log == [
+        ('get', 'devourer.datasource.versuccess.timestamp-test'),
+        ('set', 'devourer.datasource.versuccess.timestamp-test', '["2019-11-21 16:32:12.000500", 1]'),
+    ]
+
+
 class FakeRedis:
 
     def __init__(self, log, timestamp):
@@ -92,14 +242,16 @@ class FakeRedis:
         self.log.append(('set', key, value))
 
 
-Column = namedtuple('Column', 'name')
+Column = namedtuple('Column', 'name type_code', defaults=(None, ))
 
 
 class FakeDB:
 
-    def __init__(self, input_data, log):
+    def __init__(self, input_data, log, paged=False):
         self.log = log
-        self.input_data = input_data
+        self.paged = paged
+        self.pages = input_data
+        self.input_data = input_data if not paged else iter(())
         self.description = (Column('id'), Column('name'), Column('amount'), Column('update_at'))
 
     def acquire(self):
@@ -110,24 +262,17 @@ class FakeDB:
         self.log.append('cursor')
         return self
 
-    @property
-    def rowcount(self):
-        return 0
+    async def execute(self, sql, params=None, timeout=None):
+        self.log.append(('execute', sql, params))
+        if self.paged:
+            page = next(self.pages, ())
+            self.input_data = iter(page)
 
-    async def execute(self, sql, timeout=None):
-        self.log.append(('execute', sql))
+    async def fetchall(self):
+        return list(self.input_data)
 
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc_value, traceback):
         ...
-
-    def __aiter__(self):
-        return self
-
-    async def __anext__(self):
-        try:
-            return next(self.input_data)
-        except StopIteration:
-            raise StopAsyncIteration
@@ -0,0 +1,87 @@
+import json
+import pytest
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from devourer.datasources.vetsuccess import encoding
+from devourer.utils import json_helpers
+
+
+Column = namedtuple('Column', 'name type_code')
+
+
+def test_columns():
+    columns = encoding.Columns((Column('id', 23), Column('name', 1043), Column('id', 23)))
+
+    assert columns == ['id', 'name', 'id']
+    assert columns.positions == {'id': 2, 'name': 1}
+    assert columns.type_codes == [23, 1043, 23]
+
+
+def test_record():
+    columns = encoding.Columns((Column('id', 23), Column('name', 1043)))
+    record = encoding.Record(columns, (1, 'Max'))
+
+    assert record['name'] == 'Max'
+    assert record == {'id': 1, 'name': 'Max'}
+    assert len(record) == 2
+    with pytest.raises(KeyError):
+        record['missing']
+
+    record['_additionals'] = {'code_tags': []}
+
+    assert record.to_dict() == {'id': 1, 'name': 'Max', '_additionals': {'code_tags': []}}
+    assert list(record) == ['id', 'name', '_additionals']
+    assert json.loads(json.dumps({'data': record}, cls=json_helpers.JSONEncoder)) == {
+        'data': {'id': 1, 'name': 'Max', '_additionals': {'code_tags': []}}
+    }
+
+
+@pytest.mark.parametrize('type_codes, row, expected', (
+    ((23, 1043, 1700), (1, 'abc', Decimal('10.50')), b"[1, 'abc', Decimal('10.50')]"),
+    ((1043, 25, 16), (None, 'None', True), b"[None, 'None', True]"),
+    (
+        (1114, 1082),
+        (datetime(2020, 1, 1, 10, 30), date(2020, 1, 1)),
+        b"[(b'\\x07\\xe4\\x01\\x01\\n\\x1e\\x00\\x00\\x00\\x00',), (b'\\x07\\xe4\\x01\\x01',)]",
+    ),
+    ((1114, ), (None, ), b'[None]'),
+))
+def test_encode(type_codes, row, expected):
+    assert encoding.RowEncoder(type_codes).encode(row) == expected
+
+
+def test_encode_timezone():
+    encoder = encoding.RowEncoder((1184, ))
+    utc = datetime(2020, 1, 1, 10, 30, tzinfo=timezone.utc)
+    local = datetime(2020, 1, 1, 10, 30, tzinfo=timezone(timedelta(hours=-5)))
+
+    assert encoder.encode((utc, )) != encoder.encode((local, ))
+
+
+@pytest.mark.parametrize('row1, row2', (
+    (('a:b', 'c'), ('a', 'b:c')),
+    ((None, 'x'), ('None', 'x')),
+))
+def test_no_collisions(row1, row2):
+    encoder = encoding.RowEncoder((1043, 1043))
+
+    assert encoding.legacy_digest(row1) == encoding.legacy_digest(row2)
+    assert encoder.encode(row1) != encoder.encode(row2)
+    assert encoder.digest(row1) != encoder.digest(row2)
+
+
+def test_digest_size():
+    row = (1, 'name', datetime(2020, 1, 1))
+
+    assert len(encoding.RowEncoder((23, 1043, 1114)).digest(row)) == encoding.DIGEST_SIZE
+    assert len(encoding.RowEncoder((23, 1043, 1114), 16).digest(row)) == 16
+
+
+def test_get_row_encoder_cached():
+    assert encoding.get_row_encoder((23, 1043)) is encoding.get_row_encoder((23, 1043))
+
+
+def test_legacy_digest():
+    assert encoding.legacy_digest(('str', 42, datetime(2019, 11, 20, 11, 0))) == bytes.fromhex('76ba9bcaaee3e7f3')
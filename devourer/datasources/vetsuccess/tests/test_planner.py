@@ -0,0 +1,122 @@
+import json
+import pytest
+
+from devourer.datasources.vetsuccess import planner, tables
+
+
+CHECKSUM_TABLE = tables.TableConfig('test', None, 'id')
+
+
+@pytest.mark.parametrize('quiet, expected', ((0, 1), (2, 1), (3, 2), (4, 4), (5, 8), (10, 8)))
+def test_get_interval(quiet, expected):
+    assert planner.Planner(None).get_interval(planner.TableStats(quiet=quiet)) == expected
+
+
+@pytest.mark.parametrize('table, stats, fingerprint, expected', (
+    (CHECKSUM_TABLE, None, None, (True, 'new', 1)),
+    (tables.TableConfig('test', 'updated_at', None), {'quiet': 10}, None, (True, 'incremental', 1)),
+    (CHECKSUM_TABLE, {'quiet': 1, 'fingerprint': ['5']}, ['6'], (True, 'hot', 1)),
+    (CHECKSUM_TABLE, {'quiet': 1, 'fingerprint': ['5']}, ['5'], (False, 'unchanged', 1)),
+    (CHECKSUM_TABLE, {'quiet': 1, 'skipped': 7, 'fingerprint': ['5']}, ['5'], (True, 'hot', 1)),
+    (CHECKSUM_TABLE, {'quiet': 4, 'skipped': 3}, ['5'], (True, 'due', 4)),
+    (CHECKSUM_TABLE, {'quiet': 4, 'skipped': 3, 'fingerprint': ['5']}, ['5'], (False, 'unchanged', 4)),
+    (CHECKSUM_TABLE, {'quiet': 4, 'skipped': 1, 'fingerprint': ['5']}, ['6'], (True, 'fingerprint', 4)),
+    (CHECKSUM_TABLE, {'quiet': 4, 'skipped': 1, 'fingerprint': ['5']}, None, (True, 'fingerprint', 4)),
+    (CHECKSUM_TABLE, {'quiet': 4, 'skipped': 1}, ['5'], (False, 'static', 4)),
+))
+async def test_decide(table, stats, fingerprint, expected):
+    redis = FakeRedis()
+    if stats is not None:
+        redis.data['devourer.datasource.versuccess.stats-test'] = json.dumps(stats)
+
+    async def get_fingerprint(table):
+        return fingerprint
+
+    decision = await planner.Planner(redis).decide(table, get_fingerprint)
+
+    assert (decision.run, decision.reason, decision.interval) == expected
+    assert decision.fingerprint == (None if table.timestamp_column or stats is None else fingerprint)
+
+
+@pytest.mark.parametrize('stats, expected', (
+    ({'quiet': 1, 'fingerprint': ['5']}, (True, 'hot', 1)),
+    ({'quiet': 4, 'skipped': 3, 'fingerprint': ['5']}, (True, 'due', 4)),
+    ({'quiet': 4, 'skipped': 1, 'fingerprint': ['5']}, (False, 'static', 4)),
+))
+async def test_decide_without_fingerprint(stats, expected):
+    redis = FakeRedis()
+    redis.data['devourer.datasource.versuccess.stats-test'] = json.dumps(stats)
+
+    decision = await planner.Planner(redis).decide(CHECKSUM_TABLE, None)
+
+    assert (decision.run, decision.reason, decision.interval, decision.fingerprint) == expected + (None, )
+
+
+async def test_plan_order():
+    redis = FakeRedis()
+    for name, duration in (('short', 1.0), ('long', 30.0), ('urgent', 0.5)):
+        redis.data[f'devourer.datasource.versuccess.stats-{name}'] = json.dumps({'duration': duration})
+
+    async def get_fingerprint(table):
+        return ['1']
+
+    plan = await planner.Planner(redis).plan(
+        (
+            (tables.TableConfig('short', None, 'id'), None),
+            (tables.TableConfig('new', None, 'id'), None),
+            (tables.TableConfig('long', None, 'id'), None),
+            (tables.TableConfig('urgent', None, 'id', priority=10), None),
+        ),
+        get_fingerprint
+    )
+
+    assert [table.name for table, _, _ in plan] == ['urgent', 'new', 'long', 'short']
+
+
+async def test_record():
+    redis = FakeRedis()
+    table_planner = planner.Planner(redis)
+
+    async def get_fingerprint(table):
+        return ['7']
+
+    table = tables.TableConfig('test', None, 'id')
+    await table_planner.record(await table_planner.decide(table, get_fingerprint), 100, 0, 10.0)
+    stats = await table_planner.get_stats('test')
+    assert (stats.runs, stats.quiet, stats.scanned, stats.changed, stats.duration) == (1, 1, 100, 0, 10.0)
+    assert stats.fingerprint is None
+
+    await table_planner.record(await table_planner.decide(table, get_fingerprint), 100, 0, 20.0)
+    await table_planner.record(await table_planner.decide(table, get_fingerprint), 100, 0, 20.0)
+    stats = await table_planner.get_stats('test')
+    assert (stats.runs, stats.quiet, stats.duration, stats.fingerprint) == (3, 3, 17.5, ['7'])
+
+    for _ in range(table_planner.MAX_INTERVAL - 1):
+        decision = await table_planner.decide(table, get_fingerprint)
+        assert (decision.run, decision.reason) == (False, 'unchanged')
+        await table_planner.record_skip(decision)
+    assert (await table_planner.get_stats('test')).skipped == 7
+
+    decision = await table_planner.decide(table, get_fingerprint)
+    assert (decision.run, decision.reason) == (True, 'due')
+    await table_planner.record(decision, 100, 2, 20.0)
+    stats = await table_planner.get_stats('test')
+    assert (stats.runs, stats.quiet, stats.skipped, stats.changed) == (4, 0, 0, 2)
+
+    async def get_changed_fingerprint(table):
+        return ['8']
+
+    decision = await table_planner.decide(table, get_changed_fingerprint)
+    assert (decision.run, decision.reason) == (True, 'hot')
+
+
+class FakeRedis:
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value):
+        self.data[key] = value
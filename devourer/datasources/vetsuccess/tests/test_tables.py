@@ -0,0 +1,230 @@
+import pytest
+
+from devourer.datasources.vetsuccess import tables
+
+
+def test_improper_table_config():
+    with pytest.raises(tables.ImproperTableConfig):
+        tables.TableConfig('test')
+
+
+@pytest.mark.parametrize(
+    'tableconfig, expected',
+    (
+        (tables.TableConfig('test', 'updated_at', None), ('updated_at', 'id')),
+        (tables.TableConfig('test', None, 'id'), ('id', )),
+        (tables.TableConfig('test', None, 'vetsuccess_id', 'vetsuccess_id'), ('vetsuccess_id', )),
+        (
+            tables.TableConfig('test', None, 'vetsuccess_id', 'client_vetsuccess_id'),
+            ('client_vetsuccess_id', 'vetsuccess_id'),
+        ),
+    )
+)
+def test_get_key_columns(tableconfig, expected):
+    assert tableconfig.get_key_columns() == expected
+
+
+@pytest.mark.parametrize(
+    'columns, expected',
+    (
+        (('id', ), '((id > %(key_0)s))'),
+        (('a', 'b'), '((a > %(key_0)s) OR (a = %(key_0)s AND b > %(key_1)s))'),
+        (
+            ('a', 'b', 'c'),
+            (
+                '((a > %(key_0)s) OR (a = %(key_0)s AND b > %(key_1)s) '
+                'OR (a = %(key_0)s AND b = %(key_1)s AND c > %(key_2)s))'
+            ),
+        ),
+    )
+)
+def test_get_keyset_condition(columns, expected):
+    assert tables.TableConfig.get_keyset_condition(columns) == expected
+
+
+@pytest.mark.parametrize(
+    'after, expected',
+    (
+        (
+            (1, 2),
+            '(((a > %(key_0)s OR a IS NULL)) OR (a = %(key_0)s AND b > %(key_1)s))',
+        ),
+        (
+            (None, 2),
+            '((a IS NULL AND b > %(key_1)s))',
+        ),
+    )
+)
+def test_get_keyset_condition_nullable(after, expected):
+    assert tables.TableConfig.get_keyset_condition(('a', 'b'), after, ('a', )) == expected
+
+
+def test_get_sql_nullable():
+    table = tables.TableConfig('emails', None, 'vetsuccess_id', 'client_vetsuccess_id', nullable_columns=(
+        'client_vetsuccess_id',
+    ))
+
+    assert table.get_sql((None, 5)) == (
+        'SELECT * FROM external.emails '
+        'WHERE ((client_vetsuccess_id IS NULL AND vetsuccess_id > %(key_1)s)) '
+        'ORDER BY client_vetsuccess_id NULLS LAST, vetsuccess_id '
+    )
+    assert table.get_where_clause(partition=(10, None)) == (
+        'WHERE (client_vetsuccess_id > %(partition_lower)s OR client_vetsuccess_id IS NULL) '
+    )
+
+
+def test_get_sql_params():
+    assert tables.TableConfig.get_sql_params() == {}
+    assert tables.TableConfig.get_sql_params((1, 'a'), timestamp=5) == {'timestamp': 5, 'key_0': 1, 'key_1': 'a'}
+
+
+@pytest.mark.parametrize(
+    'tableconfig, after, expected',
+    (
+        (
+            tables.PatientTableConfig('patients', None, 'vetsuccess_id', 'client_vetsuccess_id'),
+            None,
+            (
+                'SELECT DISTINCT patients.vetsuccess_id, rel.client_vetsuccess_id, patients.* '
+                'FROM external.patients '
+                'INNER JOIN external.client_patient_relationships as rel ON '
+                '  rel.patient_vetsuccess_id = patients.vetsuccess_id AND rel.is_primary = \'true\' '
+                'ORDER BY rel.client_vetsuccess_id, patients.vetsuccess_id '
+            ),
+        ),
+        (
+            tables.PatientTableConfig('patients', None, 'vetsuccess_id', 'client_vetsuccess_id'),
+            (1, 2),
+            (
+                'SELECT DISTINCT patients.vetsuccess_id, rel.client_vetsuccess_id, patients.* '
+                'FROM external.patients '
+                'INNER JOIN external.client_patient_relationships as rel ON '
+                '  rel.patient_vetsuccess_id = patients.vetsuccess_id AND rel.is_primary = \'true\' '
+                'WHERE ((rel.client_vetsuccess_id > %(key_0)s) OR '
+                '(rel.client_vetsuccess_id = %(key_0)s AND patients.vetsuccess_id > %(key_1)s)) '
+                'ORDER BY rel.client_vetsuccess_id, patients.vetsuccess_id '
+            ),
+        ),
+        (
+            tables.PatientCoOwnerTableConfig('client_patient_relationships', None, 'patient_vetsuccess_id'),
+            None,
+            (
+                'SELECT * FROM external.client_patient_relationships '
+                'WHERE is_primary = \'false\' '
+                'ORDER BY id, patient_vetsuccess_id '
+            ),
+        ),
+        (
+            tables.PatientCoOwnerTableConfig('client_patient_relationships', None, 'patient_vetsuccess_id'),
+            (1, 2),
+            (
+                'SELECT * FROM external.client_patient_relationships '
+                'WHERE is_primary = \'false\' AND '
+                '((id > %(key_0)s) OR (id = %(key_0)s AND patient_vetsuccess_id > %(key_1)s)) '
+                'ORDER BY id, patient_vetsuccess_id '
+            ),
+        ),
+    )
+)
+def test_get_sql(tableconfig, after, expected):
+    assert tableconfig.get_sql(after) == expected
+
+
+def test_get_checksum_sql():
+    tableconfig = tables.PatientTableConfig('patients', None, 'vetsuccess_id', 'client_vetsuccess_id')
+    columns = [('vetsuccess_id', 1043), ('client_vetsuccess_id', 1043), ('vetsuccess_id', 1043), ('is_deceased', 16)]
+
+    assert tableconfig.get_checksum_sql(columns, (1, 2)) == (
+        'SELECT rel.client_vetsuccess_id, patients.vetsuccess_id, '
+        'MD5('
+        "COALESCE(CAST(patients.vetsuccess_id AS VARCHAR(65535)), '\\N') || ':' || "
+        "COALESCE(CAST(rel.client_vetsuccess_id AS VARCHAR(65535)), '\\N') || ':' || "
+        "COALESCE(CASE WHEN patients.is_deceased THEN 't' WHEN NOT patients.is_deceased THEN 'f' END, '\\N')"
+        ') AS devourer_checksum '
+        'FROM external.patients '
+        'INNER JOIN external.client_patient_relationships as rel ON '
+        '  rel.patient_vetsuccess_id = patients.vetsuccess_id AND rel.is_primary = \'true\' '
+        'WHERE ((rel.client_vetsuccess_id > %(key_0)s) OR '
+        '(rel.client_vetsuccess_id = %(key_0)s AND patients.vetsuccess_id > %(key_1)s)) '
+        'ORDER BY rel.client_vetsuccess_id, patients.vetsuccess_id '
+    )
+
+
+def test_get_fingerprint_sql():
+    table = tables.TableConfig('test', None, 'id', fingerprint_buckets=16)
+
+    assert table.get_fingerprint_sql([('id', 23), ('name', 1043)]) == (
+        'SELECT MOD(STRTOL(SUBSTRING(MD5(CAST(id AS VARCHAR(65535))), 1, 8), 16), 16) AS devourer_bucket, '
+        'COUNT(*), SUM(STRTOL(SUBSTRING(MD5('
+        "COALESCE(CAST(id AS VARCHAR(65535)), '\\N') || ':' || "
+        "COALESCE(CAST(name AS VARCHAR(65535)), '\\N')"
+        '), 1, 8), 16)) FROM external.test GROUP BY 1'
+    )
+
+
+def test_get_table_fingerprint_sql():
+    table = tables.PatientCoOwnerTableConfig('client_patient_relationships', None, 'patient_vetsuccess_id')
+    checksum = "MD5(COALESCE(CAST(id AS VARCHAR(65535)), '\\N'))"
+
+    assert table.get_table_fingerprint_sql([('id', 23)]) == (
+        f'SELECT COUNT(*), SUM(STRTOL(SUBSTRING({checksum}, 1, 8), 16)), '
+        f'SUM(STRTOL(SUBSTRING({checksum}, 9, 8), 16)) '
+        "FROM external.client_patient_relationships WHERE is_primary = 'false'"
+    )
+
+
+def test_get_rows_by_pk_sql():
+    tableconfig = tables.PatientCoOwnerTableConfig('client_patient_relationships', None, 'patient_vetsuccess_id')
+
+    assert tableconfig.get_rows_by_pk_sql() == (
+        'SELECT * FROM external.client_patient_relationships '
+        'WHERE is_primary = \'false\' AND patient_vetsuccess_id = ANY(%(pks)s) '
+        'ORDER BY id, patient_vetsuccess_id '
+    )
+
+
+@pytest.mark.parametrize(
+    'tableconfig, schema, expected',
+    (
+        (tables.TableConfig('test', None, 'id'), None, None),
+        (tables.TableConfig('test', None, 'id', columns=('name', 'id')), None, ['id', 'name']),
+        (
+            tables.TableConfig('test', 'updated_at', None, columns=('name', ), exclude_columns=('updated_at', )),
+            None,
+            ['updated_at', 'id', 'name'],
+        ),
+        (
+            tables.TableConfig('test', None, 'id', exclude_columns=('notes', 'id')),
+            ('id', 'name', 'notes'),
+            ['id', 'name'],
+        ),
+    )
+)
+def test_get_columns(tableconfig, schema, expected):
+    if schema is not None:
+        tableconfig.set_schema(schema)
+
+    assert tableconfig.get_columns() == expected
+
+
+def test_get_columns_schema_not_loaded():
+    with pytest.raises(tables.SchemaNotLoaded):
+        tables.TableConfig('test', None, 'id', exclude_columns=('notes', )).get_columns()
+
+
+def test_get_sql_columns():
+    tableconfig = tables.PatientTableConfig(
+        'patients', None, 'vetsuccess_id', 'client_vetsuccess_id', columns=('name', 'species')
+    )
+
+    assert tableconfig.get_sql() == (
+        'SELECT DISTINCT patients.vetsuccess_id, rel.client_vetsuccess_id, patients.name, patients.species '
+        'FROM external.patients '
+        'INNER JOIN external.client_patient_relationships as rel ON '
+        '  rel.patient_vetsuccess_id = patients.vetsuccess_id AND rel.is_primary = \'true\' '
+        'ORDER BY rel.client_vetsuccess_id, patients.vetsuccess_id '
+    )
+    assert tableconfig.get_rows_by_pk_sql().startswith(
+        'SELECT DISTINCT patients.vetsuccess_id, rel.client_vetsuccess_id, patients.name, patients.species '
+    )
@@ -0,0 +1,138 @@
+import gzip
+import os
+import pytest
+from collections import namedtuple
+from datetime import datetime, time, timedelta, timezone
+import psycopg2.tz
+
+from devourer.datasources.vetsuccess import tables, unload
+
+
+def test_get_unload_sql():
+    unloader = unload.Unloader(unload.LocalStorage('/tmp'), 'arn:aws:iam::1:role/unload')
+
+    assert unloader.get_unload_sql("SELECT * FROM t WHERE a = 'b'", 's3://bucket/t/part-') == (
+        "UNLOAD ('SELECT * FROM t WHERE a = ''b''') TO 's3://bucket/t/part-' "
+        "IAM_ROLE 'arn:aws:iam::1:role/unload' "
+        "FORMAT AS CSV NULL AS '\\N' GZIP "
+        "MAXFILESIZE 100 MB ALLOWOVERWRITE"
+    )
+
+
+def test_from_config():
+    unloader = unload.Unloader.from_config({'path': '/tmp/unload', 'iam_role': 'role', 'concurrency': 2})
+
+    assert isinstance(unloader.storage, unload.LocalStorage)
+    assert unloader.storage.path == '/tmp/unload'
+    assert unloader.iam_role == 'role'
+    assert unloader.concurrency == 2
+
+    with pytest.raises(unload.ImproperUnloadConfig):
+        unload.Unloader.from_config({'path': '/tmp/unload'})
+
+
+@pytest.mark.parametrize('type_code, value, expected', (
+    (1184, '2020-01-01 10:00:00+00', datetime(2020, 1, 1, 10, tzinfo=timezone.utc)),
+    (1184, '2020-01-01 10:00:00+0530', datetime(2020, 1, 1, 10, tzinfo=timezone(timedelta(hours=5, minutes=30)))),
+    (1266, '10:00:00-02', time(10, tzinfo=timezone(timedelta(hours=-2)))),
+    (1114, '2020-01-01 10:00:00', datetime(2020, 1, 1, 10)),
+))
+def test_get_caster(type_code, value, expected):
+    result = unload.get_caster(type_code)(value, None)
+
+    assert (result, result.utcoffset()) == (expected, expected.utcoffset())
+
+
+async def fake_unload(log, sql):
+    log.append(sql)
+    if sql.startswith('UNLOAD'):
+        url = sql.split("TO '")[1].split("'")[0]
+        os.makedirs(os.path.dirname(url))
+        for i, lines in enumerate((
+            '1,N1,2019-11-20 11:00:00,"a, b",2019-11-20 11:00:00+00\n2,\\N,2019-11-20 12:00:00,,\\N\n',
+            '3,N3,2019-11-21 11:00:00,c,2019-11-21 11:00:00.5-05:30\n',
+        )):
+            with gzip.open(f'{url}000{i}_part_00.gz', 'wt') as fl:
+                fl.write(lines)
+
+
+async def test_fetch_pages(tmp_path, monkeypatch):
+    log = []
+    storage = unload.LocalStorage(str(tmp_path))
+
+    async def fake_execute(sql, params=None, timeout=None):
+        await fake_unload(log, sql)
+
+    monkeypatch.setattr(unload.time, 'time', lambda: 1574346720)
+    cur = FakeCursor(fake_execute)
+    unloader = unload.Unloader(storage, 'role', concurrency=1)
+
+    pages = []
+    async for column_names, rows in unloader.fetch_pages(
+        tables.TableConfig('test', 'updated_at', None),
+        cur,
+        1000,
+        timestamp=datetime(1, 1, 1)
+    ):
+        assert column_names == ['id', 'name', 'updated_at', 'tags', 'created_at']
+        pages.append(rows)
+
+    assert pages == [
+        [
+            (1, 'N1', datetime(2019, 11, 20, 11, 0), 'a, b', datetime(2019, 11, 20, 11, 0, tzinfo=timezone.utc)),
+            (2, None, datetime(2019, 11, 20, 12, 0), '', None),
+        ],
+        [
+            (
+                3,
+                'N3',
+                datetime(2019, 11, 21, 11, 0),
+                'c',
+                datetime(2019, 11, 21, 11, 0, 0, 500000, tzinfo=timezone(-timedelta(hours=5, minutes=30))),
+            ),
+        ],
+    ]
+    assert pages[0][0][4].tzinfo == psycopg2.tz.FixedOffsetTimezone(0)
+    assert log[0] == 'SELECT * FROM external.test WHERE updated_at >= %(timestamp)s ORDER BY updated_at, id  LIMIT 0'
+    assert log[1].startswith(
+        "UNLOAD ('SELECT * FROM external.test WHERE updated_at >= ''0001-01-01T00:00:00''::timestamp "
+        f"ORDER BY updated_at, id ') TO '{tmp_path}/test/1574346720/part-' "
+    )
+    assert storage.list('test/') == []
+
+
+async def test_fetch_pages_by_page_size(tmp_path):
+    log = []
+    storage = unload.LocalStorage(str(tmp_path))
+
+    async def fake_execute(sql, params=None, timeout=None):
+        await fake_unload(log, sql)
+
+    unloader = unload.Unloader(storage, 'role', concurrency=1)
+    pages = unloader.fetch_pages(tables.TableConfig('test', 'updated_at', None), FakeCursor(fake_execute), 1)
+
+    assert [row[0] for row in (await pages.__anext__())[1]] == [1]
+    assert [row[0] for row in (await pages.__anext__())[1]] == [2]
+    await pages.aclose()
+
+    # part files are deleted when the consumer stops early
+    assert storage.list('test/') == []
+
+
+Column = namedtuple('Column', 'name type_code')
+
+
+class FakeCursor:
+    description = (
+        Column('id', 23),
+        Column('name', 1043),
+        Column('updated_at', 1114),
+        Column('tags', 25),
+        Column('created_at', 1184),
+    )
+
+    def __init__(self, execute):
+        self.execute = execute
+
+    def mogrify(self, sql, params):
+        return (sql % {'timestamp': "'0001-01-01T00:00:00'::timestamp"}).encode('utf-8')
@@ -0,0 +1,232 @@
+import abc
+import asyncio
+import csv
+import gzip
+import io
+import itertools
+import logging
+import os
+import re
+import time
+import typing
+import aiopg
+import boto3
+import psycopg2.extensions
+import psycopg2.tz
+
+from devourer.core.datasource import exceptions
+from devourer.utils import aio
+from . import encoding, tables
+
+
+logger = logging.getLogger('devourer.datasource.vetsuccess')
+
+
+class ImproperUnloadConfig(exceptions.DataSourceException):
+    message = 'Unload config should have IAM role which Redshift assumes to write part files'
+
+
+class TzCaster:
+    """Caster of a time zone aware type, psycopg2 casters of these types read
+    `tzinfo_factory` of the cursor and crash without a real one. The value is
+    cast by the caster of its type without time zone and gets the offset as
+    psycopg2 gives it by default
+    """
+    OFFSET = re.compile(r'([+-])(\d\d)(?::?(\d\d))?$')
+
+    def __init__(self, caster: typing.Callable):
+        self.caster = caster
+
+    def __call__(self, value: str, cursor: typing.Any = None) -> typing.Any:
+        match = self.OFFSET.search(value)
+        if match is None:
+            return self.caster(value, cursor)
+
+        sign, hours, minutes = match.groups()
+        offset = int(hours) * 60 + int(minutes or 0)
+        tzinfo = psycopg2.tz.FixedOffsetTimezone(-offset if sign == '-' else offset)
+
+        return self.caster(value[:match.start()], cursor).replace(tzinfo=tzinfo)
+
+
+# timestamptz and timetz by the types of their values without time zone
+TZ_TYPES = {1184: 1114, 1266: 1083}
+
+
+def get_caster(type_code: int) -> typing.Optional[typing.Callable]:
+    """Caster of the column values of the type, which doesn't need a cursor"""
+    if type_code in TZ_TYPES:
+        return TzCaster(psycopg2.extensions.string_types[TZ_TYPES[type_code]])
+
+    return psycopg2.extensions.string_types.get(type_code)
+
+
+class ObjectStorage(abc.ABC):
+
+    @abc.abstractmethod
+    def get_url(self, prefix: str) -> str:
+        """URL which Redshift UNLOAD writes part files to"""
+
+    @abc.abstractmethod
+    def list(self, prefix: str) -> typing.List[str]:
+        ...
+
+    @abc.abstractmethod
+    def open(self, key: str) -> typing.BinaryIO:
+        """Stream of the object content"""
+
+    @abc.abstractmethod
+    def delete(self, keys: typing.List[str]):
+        ...
+
+
+class S3Storage(ObjectStorage):
+
+    def __init__(self, bucket: str, prefix: str = '', endpoint_url: str = None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def get_url(self, prefix: str) -> str:
+        return f's3://{self.bucket}/{os.path.join(self.prefix, prefix)}'
+
+    def list(self, prefix: str) -> typing.List[str]:
+        keys = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=os.path.join(self.prefix, prefix)):
+            keys.extend(item['Key'] for item in page.get('Contents', []))
+
+        return sorted(keys)
+
+    def open(self, key: str) -> typing.BinaryIO:
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+
+    def delete(self, keys: typing.List[str]):
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]]}
+            )
+
+
+class LocalStorage(ObjectStorage):
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def get_url(self, prefix: str) -> str:
+        return os.path.join(self.path, prefix)
+
+    def list(self, prefix: str) -> typing.List[str]:
+        url = self.get_url(prefix)
+        folder = os.path.dirname(url)
+        if not os.path.isdir(folder):
+            return []
+
+        paths = (os.path.join(folder, name) for name in os.listdir(folder))
+
+        return sorted(path for path in paths if path.startswith(url) and os.path.isfile(path))
+
+    def open(self, key: str) -> typing.BinaryIO:
+        return open(key, 'rb')
+
+    def delete(self, keys: typing.List[str]):
+        for key in keys:
+            os.remove(key)
+
+
+class Unloader:
+    """Export table query with Redshift UNLOAD and read gzipped CSV part files
+    in parallel, pages have the same (column names, rows) shape as regular fetch.
+    Part files are streamed, only a page of rows of each file read is kept in memory.
+    Pages come in no particular order
+    """
+    NULL_AS = r'\N'
+    MAX_FILE_SIZE = '100 MB'
+    CONCURRENCY = 4
+    QUERY_TIMEOUT = 60 * 60
+
+    def __init__(self, storage: ObjectStorage, iam_role: str, concurrency: int = None):
+        self.storage = storage
+        self.iam_role = iam_role
+        self.concurrency = concurrency or self.CONCURRENCY
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'Unloader':
+        if not config.get('iam_role'):
+            raise ImproperUnloadConfig()
+
+        if 'path' in config:
+            storage = LocalStorage(config['path'])
+        else:
+            storage = S3Storage(config['bucket'], config.get('prefix', ''), config.get('endpoint_url'))
+
+        return cls(storage, config['iam_role'], config.get('concurrency'))
+
+    async def fetch_pages(self, table: tables.TableConfig, cur: aiopg.Cursor, page_size: int, **params):
+        sql = table.get_sql()
+        params = table.get_sql_params(**params)
+
+        await cur.execute(f'{sql} LIMIT 0', params)
+        column_names = encoding.Columns(cur.description)
+        casters = [get_caster(column.type_code) for column in cur.description]
+
+        prefix = f'{table.name}/{int(time.time())}/part-'
+        query = cur.mogrify(sql, params).decode('utf-8')
+        await cur.execute(self.get_unload_sql(query, self.storage.get_url(prefix)), timeout=self.QUERY_TIMEOUT)
+
+        loop = asyncio.get_event_loop()
+        keys = await loop.run_in_executor(None, self.storage.list, prefix)
+        logger.info('unload %s: %d part files', table.name, len(keys))
+
+        try:
+            parts = (self.read_part(key, casters, page_size) for key in keys)
+            async for rows in aio.merge(parts, self.concurrency):
+                yield (column_names, rows)
+        finally:
+            await loop.run_in_executor(None, self.storage.delete, keys)
+
+    def get_unload_sql(self, query: str, url: str) -> str:
+        query = query.replace("'", "''")
+
+        return (
+            f"UNLOAD ('{query}') TO '{url}' "
+            f"IAM_ROLE '{self.iam_role}' "
+            f"FORMAT AS CSV NULL AS '{self.NULL_AS}' GZIP "
+            f'MAXFILESIZE {self.MAX_FILE_SIZE} ALLOWOVERWRITE'
+        )
+
+    async def read_part(
+        self,
+        key: str,
+        casters: typing.List[typing.Callable],
+        page_size: int
+    ) -> typing.AsyncGenerator[typing.List[tuple], None]:
+        """Pages of the part file rows, the file is decompressed and parsed a page at a time"""
+        loop = asyncio.get_event_loop()
+        fl = await loop.run_in_executor(None, self.storage.open, key)
+        try:
+            rows = csv.reader(io.TextIOWrapper(gzip.GzipFile(fileobj=fl), encoding='utf-8', newline=''))
+            while True:
+                page = await loop.run_in_executor(None, self.read_rows, rows, casters, page_size)
+                if page:
+                    yield page
+                if len(page) < page_size:
+                    break
+        finally:
+            fl.close()
+
+    def read_rows(
+        self,
+        rows: typing.Iterator[typing.List[str]],
+        casters: typing.List[typing.Callable],
+        size: int
+    ) -> typing.List[tuple]:
+        """Parse up to `size` CSV rows typed in the same way psycopg2 does for query results"""
+        return [
+            tuple(
+                None if value == self.NULL_AS else (caster(value, None) if caster else value)
+                for caster, value in zip(casters, row)
+            )
+            for row in itertools.islice(rows, size)
+        ]
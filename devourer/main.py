@@ -6,6 +6,7 @@ from sentry_sdk.integrations.aiohttp import AioHttpIntegration
 
 from . import config
 from .utils import log, module_loading, secret_manager
+from .core import jobs
 from .core.datasource import exceptions
 from .views import devtools
 
@@ -20,9 +21,11 @@ async def create_redis_pool() -> aioredis.ConnectionsPool:
 async def on_startup(app: web.Application):
     app['secretmanager'] = secret_manager.SecretManager(config.GCP_PROJECT_ID)
     app['redis_pool'] = await create_redis_pool()
+    app['jobs'] = jobs.JobManager(config.IMPORT_JOBS_CONCURRENCY)
 
 
 async def on_shutdown(app: web.Application):
+    await app['jobs'].close()
     app['redis_pool'].close()
     await app['redis_pool'].wait_closed()
 
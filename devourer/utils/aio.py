@@ -0,0 +1,134 @@
+import asyncio
+import typing
+
+
+_DONE = object()
+
+
+async def merge(
+    generators: typing.Iterable[typing.AsyncIterator],
+    concurrency: int,
+    queue_size: int = 1
+) -> typing.AsyncGenerator[typing.Any, None]:
+    """Merge async generators into a single stream running at most `concurrency`
+    of them at once, generators are started in the given order. Producers are
+    blocked while the bounded queue is full, so slow consumer applies backpressure.
+    An exception in any generator is raised to the consumer and stops the others,
+    stopped generators are closed before `merge` returns.
+
+    A generator is resumed only after the consumer has taken its item, so work
+    after `yield`, like saving a checkpoint, follows the hand over of the item
+    and at most `concurrency` items are held at once.
+    """
+    queue = asyncio.Queue(maxsize=queue_size)
+    tasks = []
+    scheduler = asyncio.ensure_future(_schedule(generators, concurrency, queue, tasks))
+    try:
+        async for item in _consume(queue):
+            yield item
+    finally:
+        await _cancel([scheduler] + tasks)
+
+
+async def _schedule(
+    generators: typing.Iterable[typing.AsyncIterator],
+    concurrency: int,
+    queue: asyncio.Queue,
+    tasks: typing.List[asyncio.Future]
+):
+    semaphore = asyncio.Semaphore(concurrency)
+    for generator in generators:
+        await semaphore.acquire()
+        task = asyncio.ensure_future(_produce(generator, queue, handoff=True))
+        task.add_done_callback(lambda _: semaphore.release())
+        tasks.append(task)
+
+    await asyncio.gather(*tasks)
+    await queue.put((_DONE, None, None))
+
+
+async def _produce(
+    iterator: typing.AsyncIterator,
+    queue: asyncio.Queue,
+    done: bool = False,
+    handoff: bool = False
+):
+    """Put (item, None, taken) of the iterator to the queue, or (None, exception, None)
+    when it fails, `done` puts _DONE after the last item. With `handoff` the next item
+    is produced once the consumer sets `taken` event of the previous one
+    """
+    try:
+        async for item in iterator:
+            taken = asyncio.Event() if handoff else None
+            await queue.put((item, None, taken))
+            if taken is not None:
+                await taken.wait()
+        if done:
+            await queue.put((_DONE, None, None))
+    except asyncio.CancelledError:
+        raise
+    except Exception as ex:
+        await queue.put((None, ex, None))
+    finally:
+        # the iterator is suspended when the producer is cancelled waiting for the queue
+        if hasattr(iterator, 'aclose'):
+            await iterator.aclose()
+
+
+async def _consume(queue: asyncio.Queue) -> typing.AsyncGenerator[typing.Any, None]:
+    """Items of the producers until _DONE, an exception of a producer is raised"""
+    while True:
+        item, ex, taken = await queue.get()
+        if ex is not None:
+            raise ex
+        if item is _DONE:
+            break
+
+        yield item
+        if taken is not None:
+            taken.set()
+
+
+async def _cancel(tasks: typing.List[asyncio.Future]):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def read_ahead(iterator: typing.AsyncIterator, depth: int) -> typing.AsyncGenerator[typing.Any, None]:
+    """Iterate `iterator` in a background task at most `depth` items ahead of the
+    consumer, so the next items are produced while the current one is handled.
+    An item is requested only when there's a free slot, it's freed once the
+    consumer takes an item. The producer is cancelled and awaited when the
+    consumer stops.
+    """
+    if depth < 1:
+        async for item in iterator:
+            yield item
+        return
+
+    queue = asyncio.Queue()
+    slots = asyncio.Semaphore(depth)
+    task = asyncio.ensure_future(_produce(_acquire(iterator, slots), queue, done=True))
+    try:
+        async for item in _consume(queue):
+            slots.release()
+            yield item
+    finally:
+        await _cancel([task])
+
+
+async def _acquire(iterator: typing.AsyncIterator, slots: asyncio.Semaphore) -> typing.AsyncGenerator[typing.Any, None]:
+    """Items of the iterator, each one is requested after a slot is acquired"""
+    try:
+        while True:
+            await slots.acquire()
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+
+            yield item
+    finally:
+        if hasattr(iterator, 'aclose'):
+            await iterator.aclose()
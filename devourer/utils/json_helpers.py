@@ -1,3 +1,4 @@
+import collections.abc
 import json
 import datetime
 import decimal
@@ -9,8 +10,8 @@ from . import timezone
 
 class JSONEncoder(json.JSONEncoder):
     """
-    JSONEncoder subclass that knows how to encode date/time, decimal types, and
-    UUIDs.
+    JSONEncoder subclass that knows how to encode date/time, decimal types,
+    UUIDs and mappings which are not dicts.
     """
     def default(self, o: typing.Any) -> str:
         # See "Date Time String Format" in the ECMA-262 specification.
@@ -32,5 +33,7 @@ class JSONEncoder(json.JSONEncoder):
             return r
         elif isinstance(o, (decimal.Decimal, uuid.UUID)):
             return str(o)
+        elif isinstance(o, collections.abc.Mapping):
+            return dict(o.items())
         else:
             return super().default(o)
@@ -0,0 +1,161 @@
+import asyncio
+import pytest
+
+from .. import aio
+
+
+async def generate(name, count, log, delay=0):
+    log.append(('start', name))
+    for i in range(count):
+        await asyncio.sleep(delay)
+        yield (name, i)
+    log.append(('stop', name))
+
+
+async def test_merge_sequential():
+    log = []
+    result = []
+    async for item in aio.merge((generate(name, 2, log) for name in 'abc'), 1):
+        result.append(item)
+
+    assert result == [('a', 0), ('a', 1), ('b', 0), ('b', 1), ('c', 0), ('c', 1)]
+    assert log == [
+        ('start', 'a'), ('stop', 'a'),
+        ('start', 'b'), ('stop', 'b'),
+        ('start', 'c'), ('stop', 'c'),
+    ]
+
+
+async def test_merge_bounded_concurrency():
+    log = []
+    result = []
+    async for item in aio.merge((generate(name, 3, log, 0.01) for name in 'abc'), 2):
+        result.append(item)
+
+    assert sorted(result) == [(name, i) for name in 'abc' for i in range(3)]
+    assert log[:2] == [('start', 'a'), ('start', 'b')]
+    assert log.index(('start', 'c')) > min(log.index(('stop', 'a')), log.index(('stop', 'b')))
+
+
+async def test_merge_backpressure():
+    log = []
+    merged = aio.merge([generate('a', 10, log)], 1, queue_size=2)
+
+    assert await merged.__anext__() == ('a', 0)
+    await asyncio.sleep(0.01)
+    assert ('stop', 'a') not in log
+    await merged.aclose()
+
+
+async def test_merge_handoff():
+    log = []
+
+    async def produce():
+        for i in range(3):
+            yield i
+            log.append(('taken', i))
+
+    merged = aio.merge([produce()], 1, queue_size=2)
+
+    assert await merged.__anext__() == 0
+    await asyncio.sleep(0.01)
+    # the generator isn't resumed until the consumer comes back for the next item
+    assert log == []
+
+    assert await merged.__anext__() == 1
+    assert log == [('taken', 0)]
+    await merged.aclose()
+
+
+async def test_merge_error():
+    async def failed():
+        yield 1
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        async for item in aio.merge([failed(), generate('a', 3, [], 0.01)], 2):
+            ...
+
+
+async def test_merge_close():
+    log = []
+
+    async def produce(name):
+        try:
+            for i in range(10):
+                yield (name, i)
+        finally:
+            log.append(('closed', name))
+
+    merged = aio.merge([produce('a'), produce('b')], 2, queue_size=1)
+    await merged.__anext__()
+    await asyncio.sleep(0.01)
+    await merged.aclose()
+
+    # stopped generators release their resources before merge returns
+    assert sorted(log) == [('closed', 'a'), ('closed', 'b')]
+
+
+@pytest.mark.parametrize('depth', (0, 1, 3))
+async def test_read_ahead(depth):
+    result = []
+    async for item in aio.read_ahead(generate('a', 5, []), depth):
+        result.append(item)
+
+    assert result == [('a', i) for i in range(5)]
+
+
+@pytest.mark.parametrize('depth', (1, 2))
+async def test_read_ahead_depth(depth):
+    log = []
+
+    async def produce():
+        for i in range(10):
+            log.append(('produce', i))
+            yield i
+
+    pages = aio.read_ahead(produce(), depth)
+
+    assert await pages.__anext__() == 0
+    await asyncio.sleep(0.01)
+    # the consumer holds the first item and `depth` next ones are produced
+    assert log == [('produce', i) for i in range(depth + 1)]
+
+    assert await pages.__anext__() == 1
+    await asyncio.sleep(0.01)
+    assert log == [('produce', i) for i in range(depth + 2)]
+
+    await pages.aclose()
+    await asyncio.sleep(0.01)
+
+    assert len(log) == depth + 2
+
+
+async def test_read_ahead_close():
+    log = []
+
+    async def produce():
+        try:
+            for i in range(10):
+                yield i
+        finally:
+            log.append('closed')
+
+    pages = aio.read_ahead(produce(), 1)
+    await pages.__anext__()
+    await pages.aclose()
+
+    assert log == ['closed']
+
+
+async def test_read_ahead_error():
+    async def failed():
+        yield 1
+        raise ValueError()
+
+    result = []
+    with pytest.raises(ValueError):
+        async for item in aio.read_ahead(failed(), 2):
+            result.append(item)
+
+    assert result == [1]
@@ -3,6 +3,7 @@ import aioredis
 from aiohttp import web
 
 from devourer import config
+from devourer.datasources.vetsuccess import db
 
 
 async def redis_delete(request):
@@ -66,17 +67,6 @@ async def idsmapping_rename(request):
 
 
 async def redis_checksum_storage_migrate(request):
-    redis_conn = request.app['redis_pool']
-    buckets = {
-        key.decode('utf-8').split('-')[-2]
-        for key in await redis_conn.keys('devourer.datasource.versuccess.checksums*')
-    }
-    for bucket in buckets:
-        for key in await redis_conn.keys(f'devourer.datasource.versuccess.checksums-{bucket}-*'):
-            await redis_conn.hmset_dict(
-                f'devourer.datasource.versuccess.checksums-{bucket}',
-                await redis_conn.hgetall(key)
-            )
-            await redis_conn.delete(key)
-
-    return web.Response(status=200)
+    migrated = await db.ChecksumStorageMigration(request.app['redis_pool']).run()
+
+    return web.json_response(migrated)
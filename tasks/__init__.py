@@ -1,2 +1,3 @@
+from .benchmark import *
 from .deploy import *
 from .secrets import *
@@ -0,0 +1,145 @@
+import random
+import timeit
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from invoke import task
+
+from devourer.datasources.vetsuccess import columnar, db, encoding, tables
+
+
+Column = namedtuple('Column', 'name type_code')
+
+CLIENTS_TYPES = (
+    1043, 23, 1043, 1043, 1043, 1043, 1043, 1043, 1043, 1043, 1043, 1700, 16, 1114, 1114, 1114,
+)
+PATIENTS_TYPES = (
+    1043, 1043, 23, 1043, 1043, 1043, 1043, 1043, 1082, 1082, 1700, 16, 16, 1114, 1114,
+)
+
+
+def random_timestamp(rnd: random.Random) -> datetime:
+    return datetime(2015, 1, 1) + timedelta(seconds=rnd.randrange(200_000_000))
+
+
+def get_client_row(rnd: random.Random) -> tuple:
+    return (
+        f'{rnd.getrandbits(64):016x}',
+        rnd.randrange(1, 5000),
+        f'{rnd.randrange(10 ** 6)}',
+        rnd.choice(('John', 'Mary', 'Robert', 'Patricia', 'Michael')),
+        rnd.choice(('Smith', 'Johnson', 'Williams', 'Brown', 'Jones')),
+        f'user{rnd.randrange(10 ** 6)}@example.com',
+        f'({rnd.randrange(200, 999)}) 555-{rnd.randrange(10000):04d}',
+        f'{rnd.randrange(1, 9999)} Main St.',
+        rnd.choice(('Austin', 'Denver', 'Portland', None)),
+        rnd.choice(('TX', 'CO', 'OR')),
+        f'{rnd.randrange(10000, 99999)}',
+        Decimal(rnd.randrange(-10000, 100000)) / 100,
+        rnd.random() > 0.1,
+        random_timestamp(rnd),
+        random_timestamp(rnd),
+        None if rnd.random() > 0.05 else random_timestamp(rnd),
+    )
+
+
+def get_patient_row(rnd: random.Random) -> tuple:
+    return (
+        f'{rnd.getrandbits(64):016x}',
+        f'{rnd.getrandbits(64):016x}',
+        rnd.randrange(1, 5000),
+        rnd.choice(('Max', 'Bella', 'Charlie', 'Luna', 'Lucy')),
+        rnd.choice(('Canine', 'Feline', 'Equine')),
+        rnd.choice(('Labrador Retriever', 'Domestic Shorthair', 'Poodle', None)),
+        rnd.choice(('Male', 'Female', 'Male Neutered', 'Female Spayed')),
+        rnd.choice(('Black', 'White', 'Brown', None)),
+        date(2005, 1, 1) + timedelta(days=rnd.randrange(6000)),
+        None if rnd.random() > 0.1 else date(2019, 1, 1) + timedelta(days=rnd.randrange(700)),
+        Decimal(rnd.randrange(100, 10000)) / 100,
+        rnd.random() > 0.9,
+        rnd.random() > 0.5,
+        random_timestamp(rnd),
+        random_timestamp(rnd),
+    )
+
+
+@task(
+    help={
+        'rows': 'number of rows per table',
+        'repeat': 'number of measurements, the best one is reported',
+    }
+)
+def benchmark_row_digest(ctx, rows=100_000, repeat=5):
+    """
+    Compare canonical row encoding digest with the legacy SHA1 checksums
+    """
+    rnd = random.Random(42)
+    for table, type_codes, get_row in (
+        ('clients', CLIENTS_TYPES, get_client_row),
+        ('patients', PATIENTS_TYPES, get_patient_row),
+    ):
+        data = [get_row(rnd) for _ in range(int(rows))]
+        encoder = encoding.RowEncoder(type_codes)
+        results = {}
+        for name, digest in (('legacy sha1', encoding.legacy_digest), ('encoded blake2b', encoder.digest)):
+            best = min(timeit.repeat(lambda: [digest(row) for row in data], number=1, repeat=int(repeat)))
+            results[name] = best
+            print(f'{table:>10} {name:>15}: {best:.3f}s, {len(data) / best:,.0f} rows/s')
+
+        print(f'{table:>10} {"speedup":>15}: {results["legacy sha1"] / results["encoded blake2b"]:.2f}x')
+
+
+@task(
+    help={
+        'rows': 'number of rows per page',
+        'changed': 'share of changed rows',
+        'repeat': 'number of measurements, the best one is reported',
+    }
+)
+def benchmark_columnar_digest(ctx, rows=100_000, changed=0.01, repeat=5):
+    """
+    Compare rows/s of the checksum table page comparison: dict per row with
+    SHA1 checksums, records with row encoding digests and the columnar path
+    """
+    rnd = random.Random(42)
+    for table, type_codes, get_row in (
+        ('clients', CLIENTS_TYPES, get_client_row),
+        ('patients', PATIENTS_TYPES, get_patient_row),
+    ):
+        data = [get_row(rnd) for _ in range(int(rows))]
+        names = [f'column_{i}' for i in range(len(type_codes))]
+        columns = encoding.Columns([Column(name, type_code) for name, type_code in zip(names, type_codes)])
+        encoder = encoding.RowEncoder(type_codes)
+        fetcher = db.ChecksumTableFether(tables.TableConfig(table, None, names[0], columnar=True), None, None)
+        is_changed = [rnd.random() < float(changed) for _ in data]
+
+        legacy = [None if flag else encoding.legacy_digest(row) for row, flag in zip(data, is_changed)]
+        stored = [None if flag else encoder.digest(row) for row, flag in zip(data, is_changed)]
+        stored_columnar = [
+            None if flag else columnar.unpack_digest(digest)
+            for digest, flag in zip(columnar.get_digests(data, type_codes), is_changed)
+        ]
+
+        def dict_per_row():
+            return [
+                dict(zip(names, row))
+                for row, checksum in zip(data, legacy) if encoding.legacy_digest(row) != checksum
+            ]
+
+        def records():
+            return [encoding.Record(columns, data[i]) for i in fetcher.compare_rows(stored, data, encoder)[0]]
+
+        def columns_batch():
+            return [
+                encoding.Record(columns, data[i])
+                for i in fetcher.compare_columns(stored_columnar, data, encoder)[0]
+            ]
+
+        results = {}
+        for name, run in (('dict per row', dict_per_row), ('records', records), ('columnar', columns_batch)):
+            assert len(run()) == sum(is_changed)
+            best = min(timeit.repeat(run, number=1, repeat=int(repeat)))
+            results[name] = best
+            print(f'{table:>10} {name:>12}: {best:.3f}s, {len(data) / best:,.0f} rows/s')
+
+        print(f'{table:>10} {"speedup":>12}: {results["dict per row"] / results["columnar"]:.2f}x')